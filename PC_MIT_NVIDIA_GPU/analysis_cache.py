@@ -0,0 +1,141 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import json
+import struct
+import sqlite3
+import hashlib
+import datetime
+from mutagen.flac import FLAC
+
+# --- KONFIGURATION ---
+ANALYSIS_CACHE_DB_PATH = os.getenv("STARAIN_ANALYSIS_CACHE_DB", "/data/analysis_cache.db")
+CHUNK_SIZE = 1024 * 1024
+ALGO_VERSION = "2026-02-01-v2-robust"  # Bei neuem Modell/Algorithmus erhöhen -> alte Cache-Einträge gelten nicht mehr
+
+# ==========================================
+# CONTENT-ID (unabhängig von Pfad und Tags)
+# ==========================================
+
+def _id3v2_size(header):
+    """Größe eines ID3v2-Blocks am Dateianfang (inkl. Header/Footer), sonst 0."""
+    if len(header) < 10 or header[:3] != b"ID3": return 0
+    size = 0
+    for b in header[6:10]:
+        size = (size << 7) | (b & 0x7F)
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+def _flac_audio_offset(fh):
+    """Springt über alle FLAC-Metadatenblöcke (Tags, Bilder) und liefert den Beginn der Audio-Frames."""
+    fh.seek(0)
+    start = _id3v2_size(fh.read(10))
+    fh.seek(start)
+    if fh.read(4) != b"fLaC": return None
+    while True:
+        head = fh.read(4)
+        if len(head) < 4: return None
+        is_last = head[0] & 0x80
+        length = struct.unpack(">I", b"\x00" + head[1:4])[0]
+        fh.seek(length, os.SEEK_CUR)
+        if is_last: return fh.tell()
+
+def _mp3_audio_range(fh):
+    """Audio-Bereich einer MP3 ohne ID3v2 (Anfang), ID3v1 und APEv2 (Ende)."""
+    fh.seek(0, os.SEEK_END)
+    end = fh.tell()
+    fh.seek(0)
+    start = _id3v2_size(fh.read(10))
+
+    if end - start > 128:
+        fh.seek(end - 128)
+        if fh.read(3) == b"TAG": end -= 128
+    if end - start > 32:
+        fh.seek(end - 32)
+        footer = fh.read(32)
+        if footer[:8] == b"APETAGEX":
+            ape_size = struct.unpack("<I", footer[12:16])[0]
+            has_header = struct.unpack("<I", footer[20:24])[0] & 0x80000000
+            end -= ape_size + (32 if has_header else 0)
+    return start, max(start, end)
+
+def _hash_range(fh, start, end):
+    h = hashlib.blake2b(digest_size=20)
+    fh.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = fh.read(min(CHUNK_SIZE, remaining))
+        if not chunk: break
+        h.update(chunk)
+        remaining -= len(chunk)
+    return h.hexdigest()
+
+def content_id(filepath):
+    """
+    Identität des Audio-Inhalts: FLAC -> STREAMINFO-MD5 (kostet nur das Lesen des Headers),
+    MP3 -> Hash der Audio-Frames ohne Tags. Umbenennen, Verschieben und Neu-Taggen ändern sie nicht.
+    """
+    try:
+        ext = os.path.splitext(filepath)[1].lower()
+        if ext == ".flac":
+            md5 = FLAC(filepath).info.md5_signature
+            if md5: return f"flac-md5:{md5:032x}"
+            # Encoder ohne MD5 -> Audio-Frames hashen
+            with open(filepath, "rb") as fh:
+                start = _flac_audio_offset(fh)
+                if start is None: return None
+                fh.seek(0, os.SEEK_END)
+                return f"flac-frames:{_hash_range(fh, start, fh.tell())}"
+        if ext == ".mp3":
+            with open(filepath, "rb") as fh:
+                start, end = _mp3_audio_range(fh)
+                if end <= start: return None
+                return f"mp3-frames:{_hash_range(fh, start, end)}"
+    except Exception:
+        pass
+    return None
+
+# ==========================================
+# CACHE (SQLite)
+# ==========================================
+
+class AnalysisCache:
+    def __init__(self, db_path=ANALYSIS_CACHE_DB_PATH, algo_version=ALGO_VERSION):
+        self.db_path = db_path
+        self.algo_version = algo_version
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    content_id TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    source_path TEXT,
+                    updated_at TEXT
+                )
+            """)
+
+    def _key(self, cid):
+        """Ergebnisse gelten nur für die Analyse-Version, die sie erzeugt hat."""
+        return f"{self.algo_version}/{cid}"
+
+    def get(self, cid):
+        """Analyse-Ergebnis (Format wie analysis_tags.read_analysis_result) oder None."""
+        if not cid: return None
+        try:
+            with sqlite3.connect(self.db_path, timeout=30) as conn:
+                row = conn.execute("SELECT result FROM results WHERE content_id = ?", (self._key(cid),)).fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception:
+            return None
+
+    def put(self, cid, data, source_path=None):
+        if not cid or not data: return
+        try:
+            with sqlite3.connect(self.db_path, timeout=30) as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO results (content_id, result, source_path, updated_at)
+                    VALUES (?, ?, ?, ?)
+                """, (self._key(cid), json.dumps(data), source_path, datetime.datetime.now().isoformat()))
+        except Exception as e:
+            print(f" ⚠️  [CACHE] Konnte Ergebnis nicht speichern: {e}", flush=True)
@@ -0,0 +1,76 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import datetime
+import mutagen
+from mutagen.id3 import ID3, TXXX, TBPM, TKEY, TMOO
+from mutagen.flac import FLAC
+
+TIME_FMT = "%Y-%m-%d %H:%M:%S"
+
+# Tags, die eine fertige Analyse ausmachen (Format wie write_tags im Worker)
+RESULT_TXXX_KEYS = ["XX_DANCEABILITY", "XX_INTENSITY", "XX_EMBEDDING_JSON", "XX_ANCHOR_MATCH"]
+
+def read_analysis_result(filepath):
+    """
+    Liest ein vorhandenes Analyse-Ergebnis (BPM, Key, Moods, Embedding) aus den Tags.
+    Gibt None zurück, wenn die Datei nicht vollständig analysiert ist.
+    """
+    try:
+        f = mutagen.File(filepath)
+        if f is None or f.tags is None: return None
+
+        data = {}
+        if isinstance(f, FLAC):
+            if "XX_ANALYZE_DONE" not in f: return None
+            data['bpm'] = f["BPM"][0] if "BPM" in f else None
+            data['key'] = f["KEY"][0] if "KEY" in f else None
+            data['MOOD'] = list(f["MOOD"]) if "MOOD" in f else []
+            for k in RESULT_TXXX_KEYS:
+                data[k] = f[k][0] if k in f else None
+        elif isinstance(f.tags, ID3):
+            txxx = {frame.desc: frame.text[0] for frame in f.tags.getall("TXXX") if frame.text}
+            if "XX_ANALYZE_DONE" not in txxx: return None
+            data['bpm'] = f.tags["TBPM"].text[0] if "TBPM" in f.tags else None
+            data['key'] = f.tags["TKEY"].text[0] if "TKEY" in f.tags else None
+            data['MOOD'] = [m.strip() for m in f.tags["TMOO"].text[0].split(",")] if "TMOO" in f.tags else []
+            for k in RESULT_TXXX_KEYS:
+                data[k] = txxx.get(k)
+        else:
+            return None
+
+        if not data['bpm'] or not data['key'] or not data['XX_EMBEDDING_JSON']: return None
+        data['bpm'] = int(round(float(data['bpm'])))
+        if data['XX_ANCHOR_MATCH'] is None: data['XX_ANCHOR_MATCH'] = "Keiner"
+        return data
+    except:
+        return None
+
+def write_analysis_result(filepath, data, extra=None):
+    """Schreibt ein übernommenes Analyse-Ergebnis (gleiches Format wie read_analysis_result)."""
+    try:
+        f = mutagen.File(filepath)
+        if f is None: return False
+        if f.tags is None: f.add_tags()
+        ts = datetime.datetime.now().strftime(TIME_FMT)
+
+        def set_txxx(k, v):
+            if isinstance(f, FLAC): f[k] = str(v)
+            else: f.tags.add(TXXX(encoding=3, desc=k, text=str(v)))
+
+        new_bpm = str(int(data['bpm']))
+        if isinstance(f, FLAC):
+            f['BPM'], f['KEY'], f['MOOD'] = new_bpm, data['key'], data['MOOD']
+        else:
+            f.tags.add(TBPM(encoding=3, text=new_bpm))
+            f.tags.add(TKEY(encoding=3, text=data['key']))
+            f.tags.add(TMOO(encoding=3, text=",".join(data['MOOD'])))
+
+        for k in RESULT_TXXX_KEYS:
+            if data.get(k) is not None: set_txxx(k, data[k])
+        for k, v in (extra or {}).items():
+            set_txxx(k, v)
+        set_txxx('XX_ANALYZE_DONE', ts)
+        f.save(); return True
+    except: return False
@@ -9,13 +9,18 @@ import subprocess
 import argparse
 import sqlite3
 import sys
-import shutil
 import datetime
 import logging
 import random
 import mutagen
 from mutagen.id3 import ID3
 
+from analysis_cache import AnalysisCache, content_id
+from analysis_tags import write_analysis_result
+from fingerprint import FingerprintIndex
+from move_journal import JournalReader, busy_lock, mark_dir_dirty, BUSY_FILE
+from db_snapshot import DBSnapshot
+
 # --- KONFIGURATION ---
 DB_PATH = "/navidrome.db"
 MUSIC_DIR = "/music"
@@ -54,20 +59,61 @@ def get_file_analyze_status(filepath):
     except:
         return 'VIRGIN'
 
-def create_db_snapshot(src_db):
-    temp_db = "/tmp/navidrome_snapshot.db"
-    if os.path.exists(temp_db):
-        try: os.remove(temp_db)
-        except: pass
+def mark_busy(filepath):
+    """
+    Teilt dem parallel laufenden Hausmeister mit, welche Datei gerade analysiert wird.
+    Unter dem Busy-Lock: False, wenn der Hausmeister sie inzwischen verschoben hat.
+    """
     try:
-        if not os.path.exists(src_db): return None
-        shutil.copy2(src_db, temp_db)
-        if os.path.exists(src_db + "-wal"):
-            shutil.copy2(src_db + "-wal", temp_db + "-wal")
-        return temp_db
-    except Exception as e:
-        print(f"❌ Snapshot Fehler: {e}")
-        return None
+        with busy_lock():
+            if filepath is None:
+                if os.path.exists(BUSY_FILE): os.remove(BUSY_FILE)
+                return True
+            if not os.path.exists(filepath): return False
+            with open(BUSY_FILE, "w", encoding="utf-8") as f:
+                f.write(filepath)
+        return True
+    except Exception:
+        return True
+
+def mark_tagged(full_path, music_dir):
+    """Neue Tags ändern nur die mtime der Datei -> Ordner für den Hausmeister vormerken."""
+    mark_dir_dirty(os.path.relpath(os.path.dirname(full_path), music_dir))
+
+def apply_move_journal(reader, queue, music_dir, content_ids=None):
+    """
+    Übernimmt neue Verschiebungen des Hausmeisters: Pfade in der laufenden Queue (samt
+    bereits berechneter Content-IDs) und im Fingerprint-Index werden umgeschrieben statt neu ermittelt.
+    """
+    entries = reader.poll()
+    if not entries: return 0
+
+    moves = [(os.path.join(music_dir, e["old"]), os.path.join(music_dir, e["new"])) for e in entries]
+    remap = {}
+    for old, new in moves:
+        remap[old] = new
+        # Ketten (A -> B -> C) auflösen
+        for k, v in remap.items():
+            if v == old: remap[k] = new
+
+    for i, path in enumerate(queue):
+        if path in remap: queue[i] = remap[path]
+    if content_ids:
+        for old, new in remap.items():
+            if old in content_ids: content_ids[new] = content_ids.pop(old)
+
+    try: FingerprintIndex().remap_paths(moves)
+    except Exception as e: print(f"⚠️ Fingerprint-Index Remap Fehler: {e}", flush=True)
+
+    reader.commit()
+    return len(moves)
+
+def create_db_snapshot(snapshot):
+    """Konsistenter Snapshot über die SQLite Backup-API; kopiert nur, wenn sich die DB geändert hat."""
+    if not snapshot.refresh(): return None
+    if not snapshot.changed:
+        print(f"[{get_time()}] 📎 DB unverändert, Snapshot wird wiederverwendet.", flush=True)
+    return snapshot.path
 
 def get_files_from_db(db_path):
     try:
@@ -94,25 +140,32 @@ def main():
     print(f"--- MANAGER GESTARTET (V5.2 Modular Edition) ---", flush=True)
     print(f"Modus: Random Shuffle + Optionaler Hausmeister", flush=True)
 
+    organizer = None
+    journal = JournalReader("analyzer")
+    snapshot = DBSnapshot(args.db, "/tmp/navidrome_snapshot.db")
+
     while True:
         try:
             # 1. ORGANIZER CHECK
-            # Wir prüfen, ob das Skript existiert. Wenn ja, führen wir es aus.
+            # Wir prüfen, ob das Skript existiert. Wenn ja, läuft es parallel zur Analyse
+            # (inkrementell, blockiert die Queue nicht). Nur ein Lauf gleichzeitig.
             if os.path.exists(ORGANIZER_SCRIPT):
-                # print(f"[{get_time()}] 🧹 Starte externen Hausmeister...", flush=True)
-                try:
-                    subprocess.run(
-                        ["python3", ORGANIZER_SCRIPT, "--music_dir", args.music_dir],
-                        check=False # Wir wollen nicht crashen, wenn der Hausmeister stolpert
-                    )
-                except Exception as e:
-                    print(f"❌ Fehler beim Hausmeister-Aufruf: {e}")
+                if organizer is None or organizer.poll() is not None:
+                    try:
+                        organizer = subprocess.Popen(
+                            ["python3", ORGANIZER_SCRIPT, "--music_dir", args.music_dir]
+                        )
+                    except Exception as e:
+                        print(f"❌ Fehler beim Hausmeister-Aufruf: {e}")
             else:
                 # Silent Skip - Wenn das Skript fehlt, machen wir einfach weiter
                 pass
 
+            # Verschiebungen seit der letzten Runde in die eigenen Indizes übernehmen
+            apply_move_journal(journal, [], args.music_dir)
+
             # 2. SNAPSHOT
-            snap_db = create_db_snapshot(args.db)
+            snap_db = create_db_snapshot(snapshot)
             if not snap_db:
                 print("Warte auf DB...", flush=True)
                 time.sleep(10)
@@ -123,9 +176,16 @@ def main():
 
             # 4. QUEUE BAUEN (VOR-FILTER)
             queue = []
+            content_ids = {}    # Pfad -> Content-ID, damit der Worker nicht noch einmal hasht
+            restored = 0
             if len(db_files) > 0:
                 print(f"[{get_time()}] 🔍 Prüfe DB auf neue Songs...", flush=True)
 
+            try: cache = AnalysisCache()
+            except Exception as e:
+                print(f"⚠️ Content-Cache nicht verfügbar: {e}", flush=True)
+                cache = None
+
             for db_path in db_files:
                 rel_path = db_path
                 if rel_path.startswith("/music/"): rel_path = rel_path[7:]
@@ -135,8 +195,19 @@ def main():
                 if not os.path.exists(full_path): continue
 
                 if get_file_analyze_status(full_path) == 'VIRGIN':
+                    # Gleicher Audio-Inhalt schon analysiert (verschoben/umbenannt/neu getaggt)? -> Ohne Worker zurückholen
+                    if cache is not None:
+                        content_ids[full_path] = content_id(full_path)
+                        cached = cache.get(content_ids[full_path])
+                        if cached and write_analysis_result(full_path, cached):
+                            mark_tagged(full_path, args.music_dir)
+                            restored += 1
+                            continue
                     queue.append(full_path)
 
+            if restored:
+                print(f"[{get_time()}] ♻️  {restored} Songs aus dem Content-Cache wiederhergestellt.", flush=True)
+
             # 5. CLUSTER-LOGIK: MISCHEN!
             if queue:
                 random.shuffle(queue)
@@ -147,17 +218,25 @@ def main():
                 continue
 
             # 6. ABARBEITEN
-            for i, full_path in enumerate(queue):
-                # Check, falls der Cluster-Partner schneller war
-                if get_file_analyze_status(full_path) == 'DONE':
+            for i in range(len(queue)):
+                # Hausmeister läuft parallel -> verschobene Dateien in der Queue nachziehen
+                apply_move_journal(journal, queue, args.music_dir, content_ids)
+                full_path = queue[i]
+
+                # Check, falls der Cluster-Partner schneller war (oder der Hausmeister sie verschoben hat)
+                if not os.path.exists(full_path) or get_file_analyze_status(full_path) == 'DONE':
                     continue
 
                 filename = os.path.basename(full_path)
                 print(f"\n[{i+1}/{len(queue)}] [START] {filename}", flush=True)
 
+                if not mark_busy(full_path):
+                    continue
                 try:
+                    cmd = ["python3", WORKER_SCRIPT, "--file", full_path]
+                    if content_ids.get(full_path): cmd += ["--content_id", content_ids[full_path]]
                     process = subprocess.Popen(
-                        ["python3", WORKER_SCRIPT, "--file", full_path],
+                        cmd,
                         stdout=subprocess.PIPE,
                         stderr=subprocess.STDOUT,
                         text=True,
@@ -168,12 +247,14 @@ def main():
                     process.wait()
 
                     if process.returncode == 0:
+                        mark_tagged(full_path, args.music_dir)
                         print(f"[SUCCESS] {filename}", flush=True)
                     else:
                         print(f"[FAIL] Exit Code {process.returncode}", flush=True)
 
                 except Exception as e:
                     print(f"❌ Worker Start Fehler: {e}", flush=True)
+                mark_busy(None)
 
                 time.sleep(0.1)
 
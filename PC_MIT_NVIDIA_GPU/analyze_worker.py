@@ -21,6 +21,10 @@ import mutagen
 from mutagen.id3 import ID3, TXXX, TBPM, TKEY, TMOO
 from mutagen.flac import FLAC
 
+import fingerprint
+from analysis_cache import AnalysisCache, content_id, ALGO_VERSION
+from analysis_tags import read_analysis_result, write_analysis_result
+
 logging.basicConfig(level=logging.ERROR)
 TIME_FMT = "%Y-%m-%d %H:%M:%S"
 ANCHOR_BASE_PATH = "/anker"
@@ -28,7 +32,6 @@ CSV_LOG_PATH = os.path.join(ANCHOR_BASE_PATH, "analysis_history.csv")
 AUSSORTIERT_PATH = os.getenv("AUSSORTIERT_PATH", "/aussortiert")
 
 # --- VERSIONIERUNG & KONFIGURATION ---
-ALGO_VERSION = "2026-02-01-v2-robust"  # Damit du später weißt, wer das war
 FFMPEG_TIMEOUT = 30                    # Sekunden, bevor FFmpeg abgeschossen wird
 BPM_LIMITS = (40, 210)                 # Alles außerhalb ist Müll/Fehler
 
@@ -260,11 +263,26 @@ def write_tags(filepath, data, was_healed=False):
     except: return False
 
 def main():
-    parser = argparse.ArgumentParser(); parser.add_argument("--file", required=True); args = parser.parse_args()
+    parser = argparse.ArgumentParser(); parser.add_argument("--file", required=True)
+    parser.add_argument("--content_id", default=None, help="Schon vom Manager berechnet (spart das zweite Hashen)")
+    args = parser.parse_args()
     fname = os.path.basename(args.file)
 
     if not os.path.exists(args.file): sys.exit(0)
 
+    # 0. CONTENT-CACHE: gleicher Audio-Inhalt schon analysiert (verschoben, umbenannt, neu getaggt)?
+    cache, cid = None, None
+    try:
+        cache = AnalysisCache()
+        cid = args.content_id or content_id(args.file)
+        cached = cache.get(cid)
+        if cached and write_analysis_result(args.file, cached, extra={'XX_ALGO_VERSION': ALGO_VERSION}):
+            print(f" ♻️  [CACHE] {fname} -> Ergebnis aus Content-Cache übernommen", flush=True)
+            print(f" ✅ [DONE] {fname}", flush=True)
+            sys.exit(0)
+    except Exception as e:
+        print(f" ⚠️  [CACHE] Übersprungen: {e}", flush=True)
+
     # 1. Metadaten Check
     existing_emb = read_metadata_for_embedding(args.file)
     cache_status = "♻️ (Cache)" if existing_emb else "🆕 (Neu)"
@@ -297,7 +315,31 @@ def main():
         move_to_aussortiert(args.file, reason="Audio empty/too short")
         sys.exit(0)
 
-    # 3. Normale Analyse
+    # 3. DUPLIKAT-CHECK (Fingerprint): gleiche Aufnahme schon analysiert? -> Ergebnis übernehmen
+    fp_index, fp, duration, fp_group = None, None, len(audio_ess) / 44100.0, None
+    try:
+        fp = fingerprint.compute_fingerprint(audio_ess, 44100)
+        fp_index = fingerprint.FingerprintIndex()
+        match = fp_index.find_match(fp, duration, exclude_path=args.file)
+        if match:
+            match_path, fp_group, ber = match
+            data = read_analysis_result(match_path)
+            if data and write_analysis_result(args.file, data, extra={'XX_DUPLICATE_OF': os.path.basename(match_path), 'XX_ALGO_VERSION': ALGO_VERSION}):
+                fp_index.add(args.file, duration, fp, group_id=fp_group, analyzed=True)
+                if cache is not None: cache.put(cid, data, args.file)
+                print(f"    └─ 👯 Duplikat von {os.path.basename(match_path)} (BER {ber:.2f}) -> Ergebnis übernommen", flush=True)
+                log_to_csv({
+                    "Filename": fname, "Action": "DUPLICATE",
+                    "BPM_Final": data['bpm'], "Method": "Fingerprint",
+                    "Anchor_Ref": data['XX_ANCHOR_MATCH'], "Score": round(1.0 - ber, 3), "Confidence": 0,
+                    "Essentia_Raw": "", "Librosa_Raw": ""
+                })
+                print(f" ✅ [DONE] {fname}", flush=True)
+                sys.exit(0)
+    except Exception as e:
+        print(f" ⚠️  [FINGERPRINT] Übersprungen: {e}", flush=True)
+
+    # 4. Normale Analyse
     try:
         bpm_ess = es.RhythmExtractor2013(method="multifeature")(audio_ess)[0]
         dance = es.Danceability()(audio_ess)[0]
@@ -356,13 +398,20 @@ def main():
         moods = determine_moods(final_bpm, f"{key} {scale}", dance, intensity)
 
         # HIER ÜBERGEBEN WIR 'was_healed'
-        write_tags(args.file, {
+        result = {
             'bpm': final_bpm, 'key': f"{key} {scale}",
             'XX_DANCEABILITY': round(dance, 4), 'XX_INTENSITY': round(intensity, 4),
             'XX_EMBEDDING_JSON': json.dumps(current_emb),
             'XX_ANCHOR_MATCH': anchor_info,
             'MOOD': moods
-        }, was_healed=was_healed)
+        }
+        tags_ok = write_tags(args.file, result, was_healed=was_healed)
+
+        if tags_ok and fp_index is not None:
+            fp_index.add(args.file, duration, fp, group_id=fp_group, analyzed=True)
+        if tags_ok and cache is not None:
+            # Nach dem Heilen hat die Datei neue Audio-Frames -> Content-ID neu bestimmen
+            cache.put(content_id(args.file) if was_healed else cid, result, args.file)
 
         log_to_csv({
             "Filename": fname, "Action": "UPDATE",
@@ -0,0 +1,98 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import sqlite3
+import logging
+
+SNAPSHOT_PAGES_PER_STEP = int(os.getenv("STARAIN_SNAPSHOT_PAGES", "256"))     # Seiten pro Backup-Schritt
+SNAPSHOT_STEP_SLEEP = float(os.getenv("STARAIN_SNAPSHOT_SLEEP", "0.005"))     # Pause zwischen Schritten (Navidrome kommt dazwischen)
+
+logger = logging.getLogger("DB_Snapshot")
+
+# --------------------------------------------------
+# Konsistenter Snapshot der Navidrome-DB (SQLite Backup-API)
+# --------------------------------------------------
+
+class DBSnapshot:
+    """
+    Kopiert die Navidrome-DB über sqlite3.Connection.backup: konsistent inklusive der noch
+    nicht zurückgeschriebenen Seiten im -wal, in kleinen Schritten mit Pausen. Neu kopiert
+    wird nur, wenn sich PRAGMA data_version, die Größe von DB/-wal oder die Datei selbst
+    (Inode) geändert hat.
+    """
+
+    def __init__(self, src_path, dst_path, pages=SNAPSHOT_PAGES_PER_STEP, sleep=SNAPSHOT_STEP_SLEEP):
+        self.src_path = src_path
+        self.path = dst_path
+        self.pages = pages
+        self.sleep = sleep
+        self._src = None
+        self._inode = None
+        self._signature = None
+        self.changed = False
+
+    def _connect(self):
+        if self._src is None:
+            # mode=ro: liest das WAL mit, schreibt aber nie in die Navidrome-DB
+            self._src = sqlite3.connect(f"file:{self.src_path}?mode=ro", uri=True, timeout=30,
+                                        check_same_thread=False)
+        return self._src
+
+    def _close(self):
+        try:
+            if self._src is not None:
+                self._src.close()
+        except Exception:
+            pass
+        self._src = None
+
+    def _file_size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return -1
+
+    def signature(self):
+        st = os.stat(self.src_path)
+        inode = (st.st_dev, st.st_ino)
+        if inode != self._inode:
+            # DB ersetzt (Restore, Neuaufbau): alte Verbindung hält sonst die gelöschte Datei offen
+            self._close()
+            self._inode = inode
+        version = self._connect().execute("PRAGMA data_version").fetchone()[0]
+        return (inode, version, st.st_size, self._file_size(self.src_path + "-wal"))
+
+    def refresh(self, force=False):
+        """Stellt einen aktuellen Snapshot unter self.path bereit. self.changed: wurde neu kopiert?"""
+        self.changed = False
+        if not os.path.exists(self.src_path):
+            return False
+        try:
+            sig = self.signature()
+            if not force and sig == self._signature and os.path.exists(self.path):
+                return True
+
+            tmp = self.path + ".tmp"
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            dst = sqlite3.connect(tmp)
+            try:
+                self._connect().backup(dst, pages=self.pages, sleep=self.sleep)
+                # Snapshot ohne WAL, damit beim Austausch keine fremde -wal-Datei daneben liegt
+                dst.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                dst.close()
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+            os.replace(tmp, self.path)
+
+            self._signature = sig
+            self.changed = True
+            return True
+        except Exception as e:
+            logger.error(f"Snapshot Fehler: {e}")
+            self._close()
+            return False
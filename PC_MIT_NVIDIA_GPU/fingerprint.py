@@ -0,0 +1,161 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import sqlite3
+import uuid
+import datetime
+import numpy as np
+
+# --- KONFIGURATION ---
+FINGERPRINT_DB_PATH = os.getenv("STARAIN_FINGERPRINT_DB", "/data/fingerprints.db")
+FP_SAMPLE_RATE = 11025        # Für Chroma reicht ein Viertel von 44.1 kHz
+EXCERPT_OFFSET = 30.0         # Sekunden: Intro/Stille überspringen
+EXCERPT_SECONDS = 20.0        # Länge des Ausschnitts
+FRAME_SIZE = 4096
+HOP_SIZE = 2048
+MAX_SHIFT = 3                 # Frames Versatz (Encoder-Delay, Stille am Anfang)
+MATCH_BER = 0.25              # Maximale Bitfehlerrate für "gleiche Aufnahme"
+DURATION_TOLERANCE = 3.0      # Sekunden Unterschied in der Gesamtlänge
+
+# ==========================================
+# FINGERPRINT (Chroma + Haitsma/Kalker-Bits)
+# ==========================================
+
+def _chroma_filter():
+    """Matrix (Bins x 12), die FFT-Bins auf Tonklassen abbildet (55 Hz - 5 kHz)."""
+    freqs = np.fft.rfftfreq(FRAME_SIZE, 1.0 / FP_SAMPLE_RATE)
+    fmap = np.zeros((len(freqs), 12), dtype=np.float32)
+    valid = (freqs >= 55.0) & (freqs <= 5000.0)
+    pitch = np.round(12 * np.log2(freqs[valid] / 440.0) + 69).astype(int) % 12
+    fmap[np.where(valid)[0], pitch] = 1.0
+    return fmap
+
+_CHROMA_FILTER = _chroma_filter()
+
+def compute_fingerprint(audio, sample_rate=44100):
+    """
+    Berechnet einen kompakten Fingerprint aus einem kurzen Ausschnitt (Mono-Float-Audio).
+    Pro Frame ein 24-Bit-Wort: 12 Bits Chroma-Gradient (Tonklasse vs. Nachbar, über die Zeit)
+    und 12 Bits zeitliche Änderung je Tonklasse. Unempfindlich gegenüber Codec und Lautstärke.
+    """
+    audio = np.asarray(audio, dtype=np.float32)
+    factor = max(1, int(round(sample_rate / FP_SAMPLE_RATE)))
+    if factor > 1:
+        usable = len(audio) - (len(audio) % factor)
+        audio = audio[:usable].reshape(-1, factor).mean(axis=1)
+
+    excerpt_len = int(EXCERPT_SECONDS * FP_SAMPLE_RATE)
+    start = int(EXCERPT_OFFSET * FP_SAMPLE_RATE)
+    if start + excerpt_len > len(audio):
+        start = max(0, (len(audio) - excerpt_len) // 2)
+    excerpt = audio[start:start + excerpt_len]
+    if len(excerpt) < FRAME_SIZE * 4: return None
+
+    n_frames = 1 + (len(excerpt) - FRAME_SIZE) // HOP_SIZE
+    idx = np.arange(FRAME_SIZE)[None, :] + HOP_SIZE * np.arange(n_frames)[:, None]
+    frames = excerpt[idx] * np.hanning(FRAME_SIZE).astype(np.float32)
+    spec = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    chroma = spec @ _CHROMA_FILTER
+    chroma /= (chroma.sum(axis=1, keepdims=True) + 1e-9)
+
+    band_diff = chroma - np.roll(chroma, -1, axis=1)
+    bits_a = (band_diff[1:] - band_diff[:-1]) > 0
+    bits_b = (chroma[1:] - chroma[:-1]) > 0
+    bits = np.concatenate([bits_a, bits_b], axis=1).astype(np.uint32)
+    weights = (1 << np.arange(24, dtype=np.uint32))
+    return (bits * weights).sum(axis=1).astype(np.uint32)
+
+def _popcount(words):
+    words = words.astype(np.uint32)
+    return np.unpackbits(words.view(np.uint8)).sum()
+
+def bit_error_rate(fp_a, fp_b, max_shift=MAX_SHIFT):
+    """Kleinste Bitfehlerrate über einen kleinen zeitlichen Versatz."""
+    best = 1.0
+    for shift in range(-max_shift, max_shift + 1):
+        a = fp_a[max(0, shift):]
+        b = fp_b[max(0, -shift):]
+        n = min(len(a), len(b))
+        if n < 8: continue
+        ber = _popcount(np.bitwise_xor(a[:n], b[:n])) / float(n * 24)
+        if ber < best: best = ber
+    return best
+
+def bit_error_rates(fp, candidates, max_shift=MAX_SHIFT):
+    """bit_error_rate für viele gleich lange Fingerprints auf einmal (eine Zeile pro Kandidat)."""
+    best = np.ones(len(candidates))
+    for shift in range(-max_shift, max_shift + 1):
+        a = fp[max(0, shift):]
+        b = candidates[:, max(0, -shift):]
+        n = min(len(a), b.shape[1])
+        if n < 8: continue
+        diff = np.bitwise_xor(b[:, :n], a[:n])
+        errors = np.unpackbits(diff.view(np.uint8), axis=1).sum(axis=1)
+        best = np.minimum(best, errors / float(n * 24))
+    return best
+
+# ==========================================
+# INDEX (SQLite, von Worker und DJ gelesen)
+# ==========================================
+
+class FingerprintIndex:
+    def __init__(self, db_path=FINGERPRINT_DB_PATH):
+        self.db_path = db_path
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    path TEXT PRIMARY KEY,
+                    duration REAL NOT NULL,
+                    fp BLOB NOT NULL,
+                    group_id TEXT NOT NULL,
+                    analyzed INTEGER NOT NULL DEFAULT 0,
+                    updated_at TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_fp_duration ON fingerprints (duration)")
+
+    def find_match(self, fp, duration, exclude_path=None):
+        """Sucht eine bereits analysierte Aufnahme mit gleichem Fingerprint. Gibt (path, group_id, ber) oder None."""
+        if fp is None: return None
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            rows = conn.execute("""
+                SELECT path, fp, group_id FROM fingerprints
+                WHERE analyzed = 1 AND duration BETWEEN ? AND ?
+            """, (duration - DURATION_TOLERANCE, duration + DURATION_TOLERANCE)).fetchall()
+
+        # Gleich lange Fingerprints (Normalfall: gleicher Ausschnitt) als Matrix auf einmal vergleichen
+        fp = np.asarray(fp, dtype=np.uint32)
+        by_len = {}
+        for path, blob, group_id in rows:
+            if path == exclude_path: continue
+            by_len.setdefault(len(blob) // 4, []).append((path, blob, group_id))
+
+        best = None
+        for group in by_len.values():
+            matrix = np.frombuffer(b"".join(blob for _, blob, _ in group), dtype=np.uint32).reshape(len(group), -1)
+            bers = bit_error_rates(fp, matrix)
+            i = int(np.argmin(bers))
+            if bers[i] <= MATCH_BER and (best is None or bers[i] < best[2]):
+                best = (group[i][0], group[i][2], float(bers[i]))
+        return best
+
+    def add(self, path, duration, fp, group_id=None, analyzed=True):
+        if fp is None: return None
+        group_id = group_id or uuid.uuid4().hex
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO fingerprints (path, duration, fp, group_id, analyzed, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (path, float(duration), np.asarray(fp, dtype=np.uint32).tobytes(), group_id,
+                  1 if analyzed else 0, datetime.datetime.now().isoformat()))
+        return group_id
+
+    def remap_paths(self, moves):
+        """Übernimmt Verschiebungen des Hausmeisters: Liste von (alter_pfad, neuer_pfad)."""
+        if not moves: return 0
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            cur = conn.executemany("UPDATE OR REPLACE fingerprints SET path = ? WHERE path = ?",
+                                   [(new, old) for old, new in moves])
+            return cur.rowcount
@@ -0,0 +1,108 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import json
+import time
+import fcntl
+from contextlib import contextmanager
+
+# Append-only Journal aller Verschiebungen des Hausmeisters (eine JSON-Zeile pro Move).
+# Pfade sind relativ zum Musik-Wurzelverzeichnis, damit jeder Container sie auf seinen Mount abbilden kann.
+MOVE_JOURNAL_PATH = os.getenv("STARAIN_MOVE_JOURNAL", "/data/organizer_moves.jsonl")
+BUSY_FILE = os.getenv("STARAIN_BUSY_FILE", "/tmp/starain_analyzing")          # Datei, die gerade analysiert wird
+DIRTY_DIRS_PATH = os.getenv("STARAIN_DIRTY_DIRS", "/data/organizer_dirty.txt")  # Ordner mit neu getaggten Dateien
+
+@contextmanager
+def busy_lock(busy_file=BUSY_FILE):
+    """
+    Exklusiver flock neben BUSY_FILE. Analyzer (Datei beanspruchen, Ordner melden) und
+    Hausmeister (prüfen + verschieben) halten ihn, damit zwischen Prüfen und Handeln nichts passiert.
+    """
+    with open(busy_file + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def mark_dir_dirty(rel_dir, dirty_path=DIRTY_DIRS_PATH):
+    """
+    Analyzer hat Tags in diesem Ordner geschrieben. Ein Tag-Update ändert die mtime der
+    Datei, nicht die des Ordners -> der Hausmeister liest den Ordner beim nächsten Lauf neu ein.
+    """
+    try:
+        with busy_lock(), open(dirty_path, "a", encoding="utf-8") as f:
+            f.write(rel_dir + "\n")
+    except Exception as e:
+        print(f" ⚠️  [JOURNAL] Konnte Ordner nicht vormerken: {e}", flush=True)
+
+def take_dirty_dirs(dirty_path=DIRTY_DIRS_PATH):
+    """Vorgemerkte Ordner (relativ zur Musik-Wurzel) abholen und die Liste leeren."""
+    try:
+        with busy_lock():
+            with open(dirty_path, "r", encoding="utf-8") as f:
+                dirs = {line.strip() for line in f if line.strip()}
+            os.remove(dirty_path)
+        return dirs
+    except FileNotFoundError:
+        return set()
+    except Exception as e:
+        print(f" ⚠️  [JOURNAL] Vorgemerkte Ordner nicht lesbar: {e}", flush=True)
+        return set()
+
+def append_move(old_rel, new_rel, size, journal_path=MOVE_JOURNAL_PATH):
+    try:
+        line = json.dumps({"old": old_rel, "new": new_rel, "size": size, "ts": time.time()}, ensure_ascii=False)
+        with open(journal_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except Exception as e:
+        print(f" ⚠️  [JOURNAL] Konnte Move nicht protokollieren: {e}", flush=True)
+
+class JournalReader:
+    """Liest neue Journal-Einträge ab der zuletzt gemerkten Position (pro Consumer persistiert)."""
+
+    def __init__(self, consumer, journal_path=MOVE_JOURNAL_PATH):
+        self.journal_path = journal_path
+        self.state_path = f"{journal_path}.{consumer}.offset"
+        self.offset = 0
+        try:
+            with open(self.state_path, "r") as f:
+                self.offset = int(f.read().strip() or 0)
+        except Exception:
+            pass
+
+    def poll(self):
+        """Gibt neue Einträge als Liste von Dicts zurück (leer, wenn sich nichts geändert hat)."""
+        try:
+            size = os.path.getsize(self.journal_path)
+        except OSError:
+            return []
+        if size < self.offset:
+            # Journal wurde rotiert/geleert -> von vorn
+            self.offset = 0
+        if size == self.offset:
+            return []
+
+        entries = []
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            f.seek(self.offset)
+            while True:
+                line = f.readline()
+                if not line or not line.endswith("\n"):
+                    break  # unvollständige Zeile: beim nächsten Mal
+                self.offset = f.tell()
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries
+
+    def commit(self):
+        """Position erst speichern, wenn die Einträge angewendet wurden."""
+        try:
+            with open(self.state_path, "w") as f:
+                f.write(str(self.offset))
+        except Exception:
+            pass
@@ -22,6 +22,9 @@ from mutagen.flac import FLAC
 
 # --- NEU: Config Import ---
 import starain_config as cfg
+import fingerprint
+from analysis_cache import AnalysisCache, content_id
+from analysis_tags import read_analysis_result, write_analysis_result
 
 logging.basicConfig(level=logging.ERROR)
 TIME_FMT = "%Y-%m-%d %H:%M:%S"
@@ -196,8 +199,46 @@ def main():
     print(f" 🎵 [START] {fname} {cache_status}", flush=True)
 
     try:
+        # Content-Cache: gleicher Audio-Inhalt schon analysiert (verschoben, umbenannt, neu getaggt)?
+        cache, cid = None, None
+        try:
+            cache = AnalysisCache()
+            cid = content_id(args.file)
+            cached = cache.get(cid)
+            if cached and write_analysis_result(args.file, cached):
+                print(f" ♻️  [CACHE] {fname} -> Ergebnis aus Content-Cache übernommen", flush=True)
+                print(f" ✅ [DONE] {fname}", flush=True)
+                return
+        except Exception as e:
+            print(f" ⚠️  [CACHE] Übersprungen: {e}", flush=True)
+
         loader = es.MonoLoader(filename=args.file, sampleRate=44100)
         audio_ess = loader()
+
+        # Duplikat-Check (Fingerprint): gleiche Aufnahme schon analysiert? -> Ergebnis übernehmen
+        fp_index, fp, duration, fp_group = None, None, len(audio_ess) / 44100.0, None
+        try:
+            fp = fingerprint.compute_fingerprint(audio_ess, 44100)
+            fp_index = fingerprint.FingerprintIndex()
+            match = fp_index.find_match(fp, duration, exclude_path=args.file)
+            if match:
+                match_path, fp_group, ber = match
+                data = read_analysis_result(match_path)
+                if data and write_analysis_result(args.file, data, extra={'XX_DUPLICATE_OF': os.path.basename(match_path)}):
+                    fp_index.add(args.file, duration, fp, group_id=fp_group, analyzed=True)
+                    if cache is not None: cache.put(cid, data, args.file)
+                    print(f"    └─ 👯 Duplikat von {os.path.basename(match_path)} (BER {ber:.2f}) -> Ergebnis übernommen", flush=True)
+                    log_to_csv({
+                        "Filename": fname, "Action": "DUPLICATE",
+                        "BPM_Final": data['bpm'], "Method": "Fingerprint",
+                        "Anchor_Ref": data['XX_ANCHOR_MATCH'], "Score": round(1.0 - ber, 3), "Confidence": 0,
+                        "Essentia_Raw": "", "Librosa_Raw": ""
+                    })
+                    print(f" ✅ [DONE] {fname}", flush=True)
+                    return
+        except Exception as e:
+            print(f" ⚠️  [FINGERPRINT] Übersprungen: {e}", flush=True)
+
         bpm_ess = es.RhythmExtractor2013(method="multifeature")(audio_ess)[0]
         dance = es.Danceability()(audio_ess)[0]
         intensity = min(1.0, (np.sqrt(np.mean(audio_ess**2)) * 3.5))
@@ -250,13 +291,19 @@ def main():
         # 2. Moods übersetzen (je nach starain_config Einstellung)
         final_moods = cfg.translate_list(raw_moods)
 
-        write_tags(args.file, {
+        result = {
             'bpm': final_bpm, 'key': f"{key} {scale}",
             'XX_DANCEABILITY': round(dance, 4), 'XX_INTENSITY': round(intensity, 4),
             'XX_EMBEDDING_JSON': json.dumps(current_emb),
             'XX_ANCHOR_MATCH': anchor_info,
             'MOOD': final_moods  # <--- Jetzt übersetzt
-        })
+        }
+        tags_ok = write_tags(args.file, result)
+
+        if tags_ok and fp_index is not None:
+            fp_index.add(args.file, duration, fp, group_id=fp_group, analyzed=True)
+        if tags_ok and cache is not None:
+            cache.put(cid, result, args.file)
 
         log_to_csv({
             "Filename": fname, "Action": "UPDATE",
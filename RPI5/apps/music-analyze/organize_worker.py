@@ -4,16 +4,29 @@
 
 
 import os
+import json
+import time
 import shutil
 import argparse
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
 import mutagen
 from mutagen.easyid3 import EasyID3
 from mutagen.flac import FLAC
 from mutagen.mp3 import MP3
 from mutagen.id3 import ID3
 
+from move_journal import append_move, busy_lock, take_dirty_dirs, BUSY_FILE
+
+# Konfiguration
+INDEX_PATH = os.getenv("ORGANIZER_INDEX_PATH", "/data/organizer_index.json")
+READ_THREADS = int(os.getenv("ORGANIZER_THREADS", "8"))                 # I/O-gebunden (NAS/USB)
+FULL_SCAN_HOURS = 24                                                   # Sicherheitsnetz für fremde Tag-Änderungen
+
+# EasyID3 liest TXXX nur, wenn der Key registriert ist -> Embedding-Check ohne zweites Öffnen
+EasyID3.RegisterTXXXKey('xx_embedding_json', 'XX_EMBEDDING_JSON')
+
 # Setup Logging
 logging.basicConfig(
     level=logging.INFO,
@@ -70,98 +83,244 @@ def get_track_disc_info(tags):
 
     return disc, track
 
+def plan_file(filepath, target_root):
+    """Liest die Tags (einmal) und bestimmt das Ziel. Läuft parallel im Thread-Pool."""
+    filename = os.path.basename(filepath)
+    ext = os.path.splitext(filename)[1].lower()
+
+    if ext not in ['.flac', '.mp3']:
+        return None
+
+    # 1. Metadaten laden für Namensgebung
+    try:
+        if ext == '.flac':
+            audio = FLAC(filepath) #
+            source_has_emb = "XX_EMBEDDING_JSON" in audio
+        else:
+            # EasyID3 für Standard-Tags wie Artist/Album (+ registrierter Embedding-Key)
+            audio = MP3(filepath, ID3=EasyID3)
+            source_has_emb = 'xx_embedding_json' in audio
+    except Exception as e:
+        logging.error(f"Konnte Tags nicht lesen: {filename} ({e})")
+        return None
+
+    # 2. Infos sammeln
+    artist = clean_name(get_tag(audio, 'artist', 'Unknown Artist'))
+    album_artist = clean_name(get_tag(audio, 'albumartist', artist))
+    album = clean_name(get_tag(audio, 'album', 'Unknown Album'))
+    title = clean_name(get_tag(audio, 'title', filename))
+    disc_num, track_num = get_track_disc_info(audio)
+
+    # 3. Zielstruktur bauen
+    new_filename = f"{disc_num}#{track_num} - {artist} - {title}{ext}"
+    target_dir = os.path.join(target_root, album_artist, album)
+
+    return {
+        "src": filepath, "ext": ext, "source_has_emb": source_has_emb,
+        "target_dir": target_dir, "target_path": os.path.join(target_dir, new_filename),
+        "label": f"{album_artist}/{album}/{new_filename}",
+    }
+
+def apply_plan(plan, target_root):
+    """Kollisionsprüfung und Verschieben. Gibt den finalen Pfad zurück (oder None bei Fehler)."""
+    filepath, target_path, ext = plan["src"], plan["target_path"], plan["ext"]
+    filename = os.path.basename(filepath)
+
+    # 4. Prüfen ob Verschiebung nötig ist
+    if os.path.normpath(filepath) == os.path.normpath(target_path):
+        return filepath
+
+    # Prüfen und Verschieben unter dem Busy-Lock: der Analyzer kann die Datei nicht dazwischen beanspruchen
+    with busy_lock():
+        return _apply_plan_locked(plan, target_root)
+
+def _apply_plan_locked(plan, target_root):
+    filepath, target_path, ext = plan["src"], plan["target_path"], plan["ext"]
+    filename = os.path.basename(filepath)
+
+    # Datei wird gerade analysiert -> nächste Runde
+    if is_busy(filepath):
+        logging.info(f"Überspringe: Wird gerade analysiert. ({filename})")
+        return None
+
+    # 5. KI-AWARE KOLLISIONS-CHECK
+    if os.path.exists(target_path):
+        source_has_emb = plan["source_has_emb"]
+        target_has_emb = has_embedding_tag(target_path, ext)
+
+        if target_has_emb and not source_has_emb:
+            logging.info(f"Überspringe: Ziel hat bereits KI-Tags, Quelle nicht. ({filename})")
+            return filepath
+
+        if source_has_emb and not target_has_emb:
+            logging.info(f"Ersetze: Quelle hat KI-Tags, Ziel noch nicht. ({filename})")
+            # Explizites Löschen vor move für maximale Kontrolle
+            os.remove(target_path)
+
+        elif source_has_emb and target_has_emb:
+            logging.info(f"Kollision: Beide analysiert. Behalte bestehende Datei. ({filename})")
+            return filepath
+        else:
+            logging.info(f"Kollision: Keine KI-Tags. Behalte bestehende Datei. ({filename})")
+            return filepath
+
+    # 6. Verschieben
+    os.makedirs(plan["target_dir"], exist_ok=True)
+    try:
+        shutil.move(filepath, target_path)
+        logging.info(f"Verschoben: {filename} -> {plan['label']}")
+        append_move(os.path.relpath(filepath, target_root), os.path.relpath(target_path, target_root),
+                    os.path.getsize(target_path))
+
+        # Alten Ordner aufräumen, falls leer
+        old_dir = os.path.dirname(filepath)
+        if old_dir != target_root and os.path.exists(old_dir) and not os.listdir(old_dir):
+            os.rmdir(old_dir)
+
+        return target_path
+    except Exception as e:
+        logging.error(f"Fehler beim Verschieben: {e}")
+        return None
+
 def process_file(filepath, target_root):
     """Verarbeitet eine einzelne Datei inkl. KI-Aware-Kollisionsprüfung."""
     try:
-        filename = os.path.basename(filepath)
-        ext = os.path.splitext(filename)[1].lower()
+        plan = plan_file(filepath, target_root)
+        if plan:
+            return apply_plan(plan, target_root)
+    except Exception as e:
+        logging.error(f"General Error {filepath}: {e}")
+    return None
 
-        if ext not in ['.flac', '.mp3']:
-            return
+def _safe_plan(filepath, target_root):
+    try:
+        return plan_file(filepath, target_root)
+    except Exception as e:
+        logging.error(f"General Error {filepath}: {e}")
+        return None
 
-        # 1. Metadaten laden für Namensgebung
-        try:
-            if ext == '.flac':
-                audio = FLAC(filepath) #
-            elif ext == '.mp3':
-                # EasyID3 für Standard-Tags wie Artist/Album
-                audio = MP3(filepath, ID3=EasyID3)
-            else:
-                return
-        except Exception as e:
-            logging.error(f"Konnte Tags nicht lesen: {filename} ({e})")
-            return
-
-        # 2. Infos sammeln
-        artist = clean_name(get_tag(audio, 'artist', 'Unknown Artist'))
-        album_artist = clean_name(get_tag(audio, 'albumartist', artist))
-        album = clean_name(get_tag(audio, 'album', 'Unknown Album'))
-        title = clean_name(get_tag(audio, 'title', filename))
-        disc_num, track_num = get_track_disc_info(audio)
-
-        # 3. Zielstruktur bauen
-        new_filename = f"{disc_num}#{track_num} - {artist} - {title}{ext}"
-        target_dir = os.path.join(target_root, album_artist, album)
-        target_path = os.path.join(target_dir, new_filename)
-
-        # 4. Prüfen ob Verschiebung nötig ist
-        if os.path.normpath(filepath) == os.path.normpath(target_path):
-            return
-
-        # 5. KI-AWARE KOLLISIONS-CHECK
-        if os.path.exists(target_path):
-            source_has_emb = has_embedding_tag(filepath, ext)
-            target_has_emb = has_embedding_tag(target_path, ext)
-
-            if target_has_emb and not source_has_emb:
-                logging.info(f"Überspringe: Ziel hat bereits KI-Tags, Quelle nicht. ({filename})")
-                return
-
-            if source_has_emb and not target_has_emb:
-                logging.info(f"Ersetze: Quelle hat KI-Tags, Ziel noch nicht. ({filename})")
-                # Explizites Löschen vor move für maximale Kontrolle
-                os.remove(target_path)
-
-            elif source_has_emb and target_has_emb:
-                logging.info(f"Kollision: Beide analysiert. Behalte bestehende Datei. ({filename})")
-                return
-            else:
-                logging.info(f"Kollision: Keine KI-Tags. Behalte bestehende Datei. ({filename})")
-                return
-
-        # 6. Verschieben
-        os.makedirs(target_dir, exist_ok=True)
-        try:
-            shutil.move(filepath, target_path)
-            logging.info(f"Verschoben: {filename} -> {album_artist}/{album}/{new_filename}")
+def is_busy(filepath):
+    try:
+        with open(BUSY_FILE, "r", encoding="utf-8") as f:
+            return os.path.normpath(f.read().strip()) == os.path.normpath(filepath)
+    except Exception:
+        return False
 
-            # Alten Ordner aufräumen, falls leer
-            old_dir = os.path.dirname(filepath)
-            if old_dir != target_root and os.path.exists(old_dir) and not os.listdir(old_dir):
-                os.rmdir(old_dir)
+# ==========================================
+# INKREMENTELLER INDEX
+# ==========================================
 
-        except Exception as e:
-            logging.error(f"Fehler beim Verschieben: {e}")
+def load_index(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+            if isinstance(index.get("dirs"), dict) and isinstance(index.get("files"), dict):
+                return index
+    except Exception:
+        pass
+    return {"dirs": {}, "files": {}, "last_full": 0}
 
+def save_index(path, index):
+    try:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, path)
     except Exception as e:
-        logging.error(f"General Error {filepath}: {e}")
+        logging.error(f"Index konnte nicht gespeichert werden: {e}")
+
+def file_sig(st):
+    return [int(st.st_mtime), st.st_size]
+
+def scan_changed(root, index, full=False, dirty=()):
+    """
+    Läuft über den Verzeichnisbaum und listet nur Ordner, deren mtime sich geändert hat oder
+    die der Analyzer vorgemerkt hat (dirty: neu getaggte Dateien, Ordner-mtime unverändert).
+    Unveränderte Ordner kosten ein stat(), ihre Unterordner kommen aus dem Index.
+    Gibt die Dateien zurück, die neu sind oder sich seit dem letzten Lauf verändert haben.
+    """
+    old_dirs, files_idx = index["dirs"], index["files"]
+    new_dirs, candidates, seen_files = {}, [], set()
+    stack = [root]
+
+    while stack:
+        d = stack.pop()
+        try:
+            mtime = os.stat(d).st_mtime
+        except OSError:
+            continue
+
+        entry = old_dirs.get(d)
+        if not full and entry and entry["mtime"] == mtime and d not in dirty:
+            new_dirs[d] = entry
+            seen_files.update(entry.get("files", []))
+            # Beim letzten Mal übersprungene Dateien (z.B. gerade in Analyse) erneut versuchen
+            candidates.extend(p for p in entry.get("files", []) if p not in files_idx and os.path.exists(p))
+            stack.extend(entry["subdirs"])
+            continue
+
+        subdirs, names = [], []
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        subdirs.append(e.path)
+                    elif e.is_file(follow_symlinks=False):
+                        names.append(e.path)
+                        if files_idx.get(e.path) != file_sig(e.stat()):
+                            candidates.append(e.path)
+        except OSError:
+            continue
+
+        new_dirs[d] = {"mtime": mtime, "subdirs": subdirs, "files": names}
+        seen_files.update(names)
+        stack.extend(subdirs)
+
+    index["dirs"] = new_dirs
+    # Verschwundene Dateien vergessen
+    index["files"] = {p: sig for p, sig in files_idx.items() if p in seen_files}
+    return candidates
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--music_dir", required=True, help="Wurzelverzeichnis der Musikbibliothek")
+    parser.add_argument("--index", default=INDEX_PATH, help="Persistenter Organizer-Index")
+    parser.add_argument("--full", action="store_true", help="Alle Ordner neu einlesen")
     args = parser.parse_args()
 
     abs_music_dir = os.path.abspath(args.music_dir)
+    index = load_index(args.index)
+    if index.get("root") != abs_music_dir:
+        index = {"dirs": {}, "files": {}, "last_full": 0, "root": abs_music_dir}
+
+    full = args.full or (time.time() - index.get("last_full", 0)) > FULL_SCAN_HOURS * 3600
 
-    # 1. Liste aller Dateien sammeln, um Endlosschleifen beim Verschieben zu vermeiden
-    files_to_process = []
-    for root, dirs, files in os.walk(abs_music_dir):
-        for file in files:
-            files_to_process.append(os.path.join(root, file))
+    # 1. Nur geänderte Ordner/Dateien sammeln (Liste vorab -> keine Endlosschleifen beim Verschieben)
+    dirty = {os.path.normpath(os.path.join(abs_music_dir, d)) for d in take_dirty_dirs()}
+    files_to_process = scan_changed(abs_music_dir, index, full=full, dirty=dirty)
+
+    # 2. Tags parallel lesen (I/O-gebunden), danach sequentiell verschieben
+    with ThreadPoolExecutor(max_workers=READ_THREADS) as pool:
+        plans = list(pool.map(lambda p: _safe_plan(p, abs_music_dir), files_to_process))
+
+    for file_path, plan in zip(files_to_process, plans):
+        final_path = file_path
+        if plan:
+            try:
+                final_path = apply_plan(plan, abs_music_dir)
+            except Exception as e:
+                logging.error(f"General Error {file_path}: {e}")
+                final_path = None
+        if final_path is None:
+            continue
+        try:
+            index["files"][final_path] = file_sig(os.stat(final_path))
+        except OSError:
+            pass
 
-    # 2. Dateien abarbeiten
-    for file_path in files_to_process:
-        process_file(file_path, abs_music_dir)
+    if full:
+        index["last_full"] = time.time()
+    save_index(args.index, index)
 
 if __name__ == "__main__":
     main()
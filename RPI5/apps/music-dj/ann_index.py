@@ -0,0 +1,239 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import logging
+import numpy as np
+
+from dj_index import INDEX_DIR
+
+ANN_MODE = os.getenv("ND_ANN_MODE", "auto")                     # auto | on | off
+ANN_MIN_TRACKS = int(os.getenv("ND_ANN_MIN_TRACKS", "50000"))   # darunter exakte Suche
+ANN_NPROBE = int(os.getenv("ND_ANN_NPROBE", "8"))               # mehr Listen = mehr Recall, mehr Latenz
+ANN_RETRAIN_GROWTH = 2.0                                        # Neu trainieren, wenn Bibliothek so stark wächst
+KMEANS_ITER = 10
+KMEANS_SAMPLE_PER_LIST = 40
+CHUNK_ROWS = 8192
+
+logger = logging.getLogger("DJ_ANN")
+
+# --------------------------------------------------
+# IVF-Index (k-Means-Listen über die Embedding-Matrix)
+# --------------------------------------------------
+
+class IVFIndex:
+    """
+    Inverted-File-Index für Kosinus-Ähnlichkeit: Zeilen werden dem nächsten Zentroid zugeordnet,
+    gesucht wird nur in den nprobe ähnlichsten Listen. Die Zuordnung ist an die Zeilen des
+    EmbeddingIndex gekoppelt und wird beim Refresh inkrementell nachgezogen.
+    """
+
+    def __init__(self, path=None, nprobe=ANN_NPROBE):
+        self.path = path or os.path.join(INDEX_DIR, "ann.npz")
+        self.nprobe = nprobe
+        self.centroids = None
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.trained_count = 0
+        self.generation = None
+        self._order = None
+        self._offsets = None
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def enabled_for(self, emb_index):
+        if ANN_MODE == "off" or not self.trained:
+            return False
+        if ANN_MODE == "on":
+            return True
+        return int(emb_index.has_vec.sum()) >= ANN_MIN_TRACKS
+
+    # --------------------------------------------------
+    # Laden / Speichern
+    # --------------------------------------------------
+
+    def load(self):
+        try:
+            with np.load(self.path) as data:
+                self.centroids = data["centroids"]
+                self.assign = data["assign"]
+                self.trained_count = int(data["trained_count"])
+                self.generation = int(data["generation"]) if "generation" in data.files else None
+            self._build_lists()
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"ANN-Ladefehler: {e}")
+            self.centroids = None
+            return False
+
+    def save(self):
+        if not self.trained:
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp.npz"
+            np.savez(tmp, centroids=self.centroids, assign=self.assign,
+                     trained_count=self.trained_count, generation=self.generation)
+            os.replace(tmp, self.path)
+            return True
+        except Exception as e:
+            logger.error(f"ANN-Speicherfehler: {e}")
+            return False
+
+    # --------------------------------------------------
+    # Training / Zuordnung
+    # --------------------------------------------------
+
+    def _nearest_centroid(self, matrix, rows):
+        out = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), CHUNK_ROWS):
+            chunk = rows[start:start + CHUNK_ROWS]
+            out[start:start + len(chunk)] = np.argmax(matrix[chunk] @ self.centroids.T, axis=1)
+        return out
+
+    def train(self, emb_index, nlist=None, seed=0):
+        valid = np.nonzero(emb_index.has_vec)[0]
+        if len(valid) < 64:
+            return False
+        nlist = nlist or int(np.clip(2 * np.sqrt(len(valid)), 16, 4096))
+        rng = np.random.default_rng(seed)
+        sample = valid if len(valid) <= nlist * KMEANS_SAMPLE_PER_LIST else \
+            np.sort(rng.choice(valid, nlist * KMEANS_SAMPLE_PER_LIST, replace=False))
+        data = np.asarray(emb_index.matrix[sample], dtype=np.float32)
+
+        # Sphärisches k-Means (Vektoren sind normiert -> Skalarprodukt = Kosinus)
+        self.centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITER):
+            labels = np.argmax(data @ self.centroids.T, axis=1)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, labels, data)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            self.centroids = (sums / np.maximum(norms, 1e-9)).astype(np.float32)
+
+        self.assign = np.full(len(emb_index), -1, dtype=np.int32)
+        self.assign[valid] = self._nearest_centroid(emb_index.matrix, valid)
+        self.trained_count = len(valid)
+        self.generation = emb_index.generation
+        self._build_lists()
+        logger.info(f"🧭 ANN trainiert: {nlist} Listen über {len(valid)} Tracks.")
+        return True
+
+    def sync(self, emb_index, aligned=True):
+        """
+        Zuordnung nach einem Refresh nachziehen: übernommene Zeilen behalten ihre Liste, nur neue
+        werden zugeordnet. aligned=False, wenn der Index vor dem Refresh nicht zur Matrix passte.
+        """
+        n_valid = int(emb_index.has_vec.sum())
+        if ANN_MODE == "off" or (ANN_MODE == "auto" and n_valid < ANN_MIN_TRACKS):
+            return False
+        if not self.trained or n_valid > self.trained_count * ANN_RETRAIN_GROWTH:
+            return self.train(emb_index)
+
+        old_assign = self.assign
+        new_assign = np.full(len(emb_index), -1, dtype=np.int32)
+        dst, src = emb_index.last_reuse
+        if aligned and len(dst):
+            new_assign[dst] = old_assign[src]
+
+        missing = np.nonzero(emb_index.has_vec & (new_assign < 0))[0]
+        if len(missing):
+            new_assign[missing] = self._nearest_centroid(emb_index.matrix, missing)
+        new_assign[~emb_index.has_vec] = -1
+
+        # Neue Generation auch bei gleicher Zuordnung sichern, sonst passt die Datei nicht mehr
+        changed = not np.array_equal(new_assign, old_assign) or self.generation != emb_index.generation
+        self.assign = new_assign
+        self.generation = emb_index.generation
+        self._build_lists()
+        return changed
+
+    def update_rows(self, emb_index, rows):
+        """Delta-Update: geänderte/neue/gelöschte Zeilen ihrer Liste zuordnen, ohne Neutraining."""
+        if not self.trained:
+            return False
+        n = len(emb_index)
+        if len(self.assign) < n:
+            self.assign = np.concatenate([self.assign, np.full(n - len(self.assign), -1, dtype=np.int32)])
+        rows = np.asarray(rows, dtype=np.int64)
+        self.assign[rows] = -1
+        valid = rows[emb_index.has_vec[rows]]
+        if len(valid):
+            self.assign[valid] = self._nearest_centroid(emb_index.matrix, valid)
+        self.generation = emb_index.generation
+        self._build_lists()
+        return True
+
+    def matches(self, emb_index):
+        return self.trained and len(self.assign) == len(emb_index) and self.generation == emb_index.generation
+
+    def _build_lists(self):
+        if self.centroids is None:
+            return
+        valid = self.assign >= 0
+        rows = np.nonzero(valid)[0]
+        order = np.argsort(self.assign[rows], kind="stable")
+        self._order = rows[order]
+        counts = np.bincount(self.assign[rows], minlength=len(self.centroids))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    # --------------------------------------------------
+    # Suche
+    # --------------------------------------------------
+
+    def search(self, emb_index, query, k, exclude, nprobe=None):
+        """Gleiche Ausgabe wie EmbeddingIndex.top_k: Liste (song_id, score)."""
+        query = np.asarray(query, dtype=np.float32)
+        nlist = len(self.centroids)
+        nprobe = min(nlist, nprobe or self.nprobe)
+        ranked_lists = np.argsort(-(self.centroids @ query))
+
+        while True:
+            probe = ranked_lists[:nprobe]
+            cands = np.concatenate([self._order[self._offsets[l]:self._offsets[l + 1]] for l in probe])
+            cands = cands[~exclude[cands]]
+            # Zu wenig Kandidaten (viele Ausschlüsse) -> weitere Listen dazunehmen
+            if len(cands) >= k or nprobe >= nlist:
+                break
+            nprobe = min(nlist, nprobe * 2)
+
+        if len(cands) == 0:
+            return []
+        scores = np.asarray(emb_index.matrix[cands]) @ query
+        k = min(k, len(cands))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(emb_index.ids[cands[i]], float(scores[i])) for i in top]
+
+    def evaluate(self, emb_index, k=30, n_queries=50, nprobe=None, seed=0):
+        """Recall@k gegenüber exakter Suche und mittlere Latenz beider Verfahren (zum Einstellen von nprobe)."""
+        import time
+        valid = np.nonzero(emb_index.has_vec)[0]
+        if not self.trained or len(valid) == 0:
+            return None
+        rng = np.random.default_rng(seed)
+        queries = rng.choice(valid, min(n_queries, len(valid)), replace=False)
+        hits = total = 0
+        t_ann = t_exact = 0.0
+        for row in queries:
+            q = np.asarray(emb_index.matrix[row], dtype=np.float32)
+            exclude = emb_index.exclude_mask([emb_index.ids[row]])
+            t0 = time.perf_counter()
+            exact = {sid for sid, _ in emb_index.top_k(q, k, exclude=exclude)}
+            t1 = time.perf_counter()
+            approx = {sid for sid, _ in self.search(emb_index, q, k, exclude, nprobe=nprobe)}
+            t2 = time.perf_counter()
+            hits += len(exact & approx)
+            total += len(exact)
+            t_exact += t1 - t0
+            t_ann += t2 - t1
+        n = len(queries)
+        return {"recall": hits / max(1, total), "ann_ms": 1000 * t_ann / n, "exact_ms": 1000 * t_exact / n,
+                "nprobe": nprobe or self.nprobe, "nlist": len(self.centroids)}
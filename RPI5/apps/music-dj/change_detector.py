@@ -0,0 +1,112 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import time
+import sqlite3
+import logging
+
+FULL_CHECK_SECONDS = int(os.getenv("ND_FULL_CHECK_SECONDS", "900"))   # Sicherheitsnetz: alles prüfen
+
+# Billige Wasserstände pro Thema (nutzen Navidromes Indizes auf annotation/playlist)
+WATERMARKS = {
+    "users": "SELECT id FROM user ORDER BY id",
+    "plays": "SELECT MAX(play_date) FROM annotation",
+    "stars": "SELECT MAX(starred_at), COUNT(*) FROM annotation WHERE starred = 1",
+    "ratings": "SELECT MAX(rated_at) FROM annotation",
+    "playlists": "SELECT MAX(updated_at), COUNT(*) FROM playlist",
+    "library": "SELECT MAX(updated_at), COUNT(*) FROM media_file",
+}
+
+logger = logging.getLogger("ChangeDetector")
+
+# --------------------------------------------------
+# Änderungserkennung für den Monitor
+# --------------------------------------------------
+
+class ChangeDetector:
+    """
+    Meldet, welche Teile der Navidrome-DB sich seit dem letzten Aufruf geändert haben.
+    Stufe 1: stat() von DB und -wal (kein SQL). Stufe 2: PRAGMA data_version auf einer
+    offenen Verbindung. Erst danach werden die Wasserstände der einzelnen Themen abgefragt.
+    """
+
+    def __init__(self, db, full_check_seconds=FULL_CHECK_SECONDS):
+        self.db = db                        # db_access.ConnectionManager
+        self.db_path = db.path
+        self.full_check_seconds = full_check_seconds
+        self._conn = None
+        self._generation = None
+        self._stat = None
+        self._version = None
+        self._marks = {}
+        self._last_full = 0
+
+    def _connect(self):
+        generation = self.db.check()
+        if self._conn is not None and generation != self._generation:
+            # Neue DB-Datei: Wasserstände der alten Datei sind wertlos
+            self._close()
+            self._marks = {}
+        if self._conn is None:
+            self._conn = self.db.open_reader("change_poll")
+            self._generation = generation
+        return self._conn
+
+    def _close(self):
+        try:
+            if self._conn is not None:
+                self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def _file_stat(self):
+        sig = []
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                st = os.stat(path)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append(None)
+        return tuple(sig)
+
+    def poll(self):
+        """Menge der geänderten Themen (siehe WATERMARKS); beim ersten Aufruf alle."""
+        now = time.time()
+        if now - self._last_full >= self.full_check_seconds:
+            self._last_full = now
+            self._stat = None
+            self._marks = {}
+
+        stat = self._file_stat()
+        if stat == self._stat:
+            return set()
+
+        try:
+            conn = self._connect()
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._marks and version == self._version:
+                self._stat = stat
+                return set()
+
+            changed = set()
+            for topic, query in WATERMARKS.items():
+                try:
+                    mark = conn.execute(query).fetchall()
+                except sqlite3.Error as e:
+                    logger.debug(f"Wasserstand '{topic}' nicht lesbar: {e}")
+                    mark = None
+                if mark is None or self._marks.get(topic) != mark:
+                    changed.add(topic)
+                self._marks[topic] = mark
+
+            self._version = version
+            self._stat = stat
+            return changed
+        except Exception as e:
+            logger.error(f"Änderungserkennung fehlgeschlagen: {e}")
+            self._close()
+            self._stat = None
+            return set(WATERMARKS)
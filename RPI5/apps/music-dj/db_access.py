@@ -0,0 +1,416 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+METRICS_FILE = os.getenv("ND_METRICS_FILE", "")                   # Prometheus-Textfile (node_exporter), leer = aus
+SLOW_CYCLE_MS = float(os.getenv("ND_SLOW_CYCLE_MS", "200"))       # Zyklus-Zusammenfassung ab dieser SQL-Zeit
+BUSY_TIMEOUT_MS = int(os.getenv("ND_BUSY_TIMEOUT_MS", "5000"))     # Warten auf Navidromes Schreibsperre
+STATEMENT_CACHE = 256                                              # vorbereitete Anweisungen pro Verbindung
+SUMMARY_TOP = 5
+LOCK_ERRORS = ("locked", "busy")
+
+logger = logging.getLogger("DB_Access")
+
+# --------------------------------------------------
+# Statistik pro logischer Operation
+# --------------------------------------------------
+
+_FIELDS = ("queries", "seconds", "lock_seconds", "rows_read", "rows_written", "errors")
+
+def _statement_key(sql):
+    """Gleiche Anweisungen zusammenfassen: Whitespace und IN-Listen normalisieren."""
+    sql = " ".join(str(sql).split())
+    return re.sub(r"\((\?,\s*)+\?\)", "(?...)", sql)[:160]
+
+class SQLStats:
+    """
+    Zähler pro Operation (Anfragen, Zeit, Wartezeit auf Sperren, gelesene/geschriebene Zeilen,
+    Fehler) seit Prozessstart, dazu die langsamsten Anweisungen des laufenden Zyklus.
+    Lock-Wartezeit: Dauer von BEGIN IMMEDIATE/EXCLUSIVE (wartet auf Navidromes Schreibsperre)
+    plus Anweisungen, die nach dem Busy-Timeout mit 'database is locked' abbrechen.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ops = {}
+        self.cycle = {}
+        self.gauges = {}
+        self._dirty = False
+
+    def _op(self, name):
+        op = self.ops.get(name)
+        if op is None:
+            op = self.ops[name] = dict.fromkeys(_FIELDS, 0)
+        return op
+
+    def record(self, op_name, sql, seconds, rows_written=0, lock_seconds=0.0, error=False):
+        key = _statement_key(sql)
+        with self._lock:
+            op = self._op(op_name)
+            op["queries"] += 1
+            op["seconds"] += seconds
+            op["lock_seconds"] += lock_seconds
+            op["rows_written"] += max(0, rows_written)
+            op["errors"] += int(error)
+            entry = self.cycle.get((op_name, key))
+            if entry is None:
+                entry = self.cycle[(op_name, key)] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            self._dirty = True
+
+    def add_rows_read(self, op_name, rows):
+        if rows:
+            with self._lock:
+                self._op(op_name)["rows_read"] += rows
+
+    def register_gauge(self, name, text, fn, kind="gauge"):
+        """Zusätzlicher Messwert für den Export (fn() wird beim Schreiben abgefragt)."""
+        with self._lock:
+            self.gauges[name] = (text, fn, kind)
+
+    def register_counter(self, name, text, fn):
+        """Wie register_gauge, aber für nur steigende Werte (Export als name_total, Typ counter)."""
+        self.register_gauge(name, text, fn, kind="counter")
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(op) for name, op in self.ops.items()}
+
+    # --------------------------------------------------
+    # Zyklus-Zusammenfassung / Export
+    # --------------------------------------------------
+
+    def end_cycle(self, log=logger, top=SUMMARY_TOP, min_ms=SLOW_CYCLE_MS):
+        """Langsamste Anweisungen des Zyklus loggen (nur wenn er min_ms SQL-Zeit übersteigt), dann zurücksetzen."""
+        with self._lock:
+            cycle, self.cycle = self.cycle, {}
+        total = sum(e[1] for e in cycle.values())
+        if not cycle or total * 1000 < min_ms:
+            return total
+        queries = sum(e[0] for e in cycle.values())
+        log.info(f"🐢 SQL im Zyklus: {queries} Anfragen, {total * 1000:.0f} ms. Langsamste:")
+        for (op_name, key), (count, seconds, worst) in sorted(cycle.items(), key=lambda kv: -kv[1][1])[:top]:
+            log.info(f"   {seconds * 1000:7.1f} ms  {count:4d}x  max {worst * 1000:6.1f} ms  [{op_name}] {key}")
+        return total
+
+    def prometheus_text(self, prefix="starain_sql"):
+        lines = []
+        help_text = {
+            "queries": ("counter", "Ausgeführte SQL-Anweisungen"),
+            "seconds": ("counter", "Zeit in SQL-Anweisungen (Sekunden)"),
+            "lock_seconds": ("counter", "Wartezeit auf Sperren/Busy-Timeouts (Sekunden)"),
+            "rows_read": ("counter", "Gelesene Zeilen"),
+            "rows_written": ("counter", "Geschriebene Zeilen"),
+            "errors": ("counter", "Fehlgeschlagene Anweisungen"),
+        }
+        ops = self.snapshot()
+        for field in _FIELDS:
+            kind, text = help_text[field]
+            name = f"{prefix}_{field}_total"
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for op_name in sorted(ops):
+                lines.append(f'{name}{{op="{op_name}"}} {ops[op_name][field]:g}')
+        for gauge, (text, fn, kind) in sorted(self.gauges.items()):
+            try:
+                value = float(fn())
+            except Exception:
+                continue
+            name = f"starain_{gauge}_total" if kind == "counter" else f"starain_{gauge}"
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path=METRICS_FILE):
+        """Zähler als Prometheus-Textfile schreiben (atomar, nur wenn sich etwas geändert hat)."""
+        if not path or not self._dirty:
+            return False
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp, path)
+            self._dirty = False
+            return True
+        except Exception as e:
+            logger.error(f"Metrik-Export fehlgeschlagen: {e}")
+            return False
+
+STATS = SQLStats()
+
+# --------------------------------------------------
+# Operations-Kontext (pro Thread)
+# --------------------------------------------------
+
+_local = threading.local()
+
+@contextmanager
+def operation(name):
+    """Alle Anweisungen im Block (in diesem Thread) zählen für die Operation name."""
+    stack = getattr(_local, "ops", None)
+    if stack is None:
+        stack = _local.ops = []
+    stack.append(name)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+def current_operation(default):
+    stack = getattr(_local, "ops", None)
+    return stack[-1] if stack else default
+
+# --------------------------------------------------
+# Instrumentierte Verbindung
+# --------------------------------------------------
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Gelesene Zeilen werden im Cursor gezählt und erst am Ende (erschöpft, nächste Anweisung,
+    close, Freigabe) einmal gemeldet, damit große Scans nicht pro Zeile den Stats-Lock nehmen.
+    """
+
+    _rows = 0
+    _rows_op = None
+
+    def _run(self, method, sql, args):
+        self._flush()
+        op_name = current_operation(self.connection.label)
+        t0 = time.perf_counter()
+        try:
+            result = method(sql, *args)
+        except sqlite3.OperationalError as e:
+            elapsed = time.perf_counter() - t0
+            locked = any(word in str(e).lower() for word in LOCK_ERRORS)
+            STATS.record(op_name, sql, elapsed, lock_seconds=elapsed if locked else 0.0, error=True)
+            raise
+        except sqlite3.Error:
+            STATS.record(op_name, sql, time.perf_counter() - t0, error=True)
+            raise
+        elapsed = time.perf_counter() - t0
+        head = str(sql).lstrip()[:16].upper()
+        lock_seconds = elapsed if head.startswith(("BEGIN IMMEDIATE", "BEGIN EXCLUSIVE")) else 0.0
+        STATS.record(op_name, sql, elapsed, rows_written=self.rowcount, lock_seconds=lock_seconds)
+        self._rows_op = op_name
+        return result
+
+    def execute(self, sql, *args):
+        return self._run(super().execute, sql, args)
+
+    def executemany(self, sql, *args):
+        return self._run(super().executemany, sql, args)
+
+    def _flush(self):
+        if self._rows:
+            STATS.add_rows_read(self._rows_op or self.connection.label, self._rows)
+            self._rows = 0
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is None:
+            self._flush()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        self._rows += len(rows)
+        self._flush()
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._rows += len(rows)
+        self._flush()
+        return rows
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._flush()
+            raise
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._flush()
+        super().close()
+
+    def __del__(self):
+        # execute(...).fetchone() liest selten bis zum Ende -> Rest beim Freigeben melden
+        try:
+            self._flush()
+        except Exception:
+            pass
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    sqlite3.Connection mit Zählern. Im with-Block wird wie gewohnt committet/zurückgerollt,
+    danach aber auch geschlossen (statt auf den Garbage Collector zu warten).
+    """
+
+    label = "sql"
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            return super().__exit__(exc_type, exc, tb)
+        finally:
+            self.close()
+
+def connect(path, label, readonly=False, **kwargs):
+    """sqlite3.connect mit Statistik; label ist die Operation, wenn kein operation()-Block aktiv ist."""
+    if readonly:
+        # mode=ro: liest das WAL mit, schreibt aber nie in die Navidrome-DB
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, factory=InstrumentedConnection, **kwargs)
+    else:
+        conn = sqlite3.connect(path, factory=InstrumentedConnection, **kwargs)
+    conn.label = label
+    return conn
+
+# --------------------------------------------------
+# Verbindungs-Manager (langlebige Leser + ein Schreiber)
+# --------------------------------------------------
+
+class ConnectionManager:
+    """
+    Eine Navidrome-DB, langlebige Verbindungen: pro Thread ein Leser (mode=ro, query_only,
+    Autocommit - jede Abfrage sieht den aktuellen Stand), dazu genau ein Schreiber mit
+    busy_timeout. sqlite3 hält pro Verbindung einen Statement-Cache, wiederholte Abfragen
+    werden so nicht neu vorbereitet. Ersetzt Navidrome die DB-Datei (neue Inode), werden
+    alle Verbindungen beim nächsten Zugriff neu geöffnet.
+    """
+
+    def __init__(self, path, busy_timeout_ms=BUSY_TIMEOUT_MS):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.generation = 0
+        self._identity = self._file_identity()
+        self._local = threading.local()
+        self._writer = None
+        self._writer_generation = None
+        self._writer_lock = threading.RLock()
+        self._check_lock = threading.Lock()
+
+    def _file_identity(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_dev, st.st_ino)
+        except OSError:
+            return None
+
+    def check(self):
+        """Aktuelle Generation; erhöht sie, wenn die DB-Datei ersetzt wurde (ein stat())."""
+        identity = self._file_identity()
+        if identity != self._identity:
+            with self._check_lock:
+                if identity != self._identity:
+                    self._identity = identity
+                    self.generation += 1
+                    logger.info("🔁 Navidrome-DB wurde ersetzt -> Verbindungen werden neu geöffnet.")
+        return self.generation
+
+    def _configure(self, conn, readonly):
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        if readonly:
+            conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    def open_reader(self, label):
+        """Eigene Lese-Verbindung für Aufrufer, die sie selbst halten (z.B. wegen PRAGMA data_version)."""
+        conn = connect(self.path, label, readonly=True, timeout=self.busy_timeout_ms / 1000,
+                       isolation_level=None, check_same_thread=False, cached_statements=STATEMENT_CACHE)
+        return self._configure(conn, readonly=True)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            if conn is not None:
+                conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def reader(self, label):
+        """Lese-Verbindung dieses Threads (nicht schließen, nicht in with conn: verwenden)."""
+        generation = self.check()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.generation != generation:
+            self._close(conn)
+            conn = None
+        if conn is None:
+            conn = self._local.conn = self.open_reader(label)
+            self._local.generation = generation
+        conn.label = label
+        try:
+            yield conn
+        except sqlite3.OperationalError as e:
+            if not any(word in str(e).lower() for word in LOCK_ERRORS):
+                self._close(conn)
+                self._local.conn = None
+            raise
+        except sqlite3.DatabaseError:
+            self._close(conn)
+            self._local.conn = None
+            raise
+
+    @contextmanager
+    def writer(self, label):
+        """
+        Die eine Schreib-Verbindung (Autocommit, Transaktionen per BEGIN IMMEDIATE selbst steuern).
+        Der Block hält die Schreibsperre des Prozesses, eine offene Transaktion wird bei Fehlern
+        zurückgerollt.
+        """
+        with self._writer_lock:
+            generation = self.check()
+            if self._writer is not None and self._writer_generation != generation:
+                self._close(self._writer)
+                self._writer = None
+            if self._writer is None:
+                conn = connect(self.path, label, timeout=self.busy_timeout_ms / 1000, isolation_level=None,
+                               check_same_thread=False, cached_statements=STATEMENT_CACHE)
+                self._writer = self._configure(conn, readonly=False)
+                self._writer_generation = generation
+            conn = self._writer
+            conn.label = label
+            try:
+                yield conn
+            except Exception as e:
+                try:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                if isinstance(e, sqlite3.DatabaseError) and not any(w in str(e).lower() for w in LOCK_ERRORS):
+                    self._close(conn)
+                    self._writer = None
+                raise
+
+    def close(self):
+        with self._writer_lock:
+            self._close(self._writer)
+            self._writer = None
+        self._close(getattr(self._local, "conn", None))
+        self._local.conn = None
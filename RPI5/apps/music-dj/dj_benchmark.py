@@ -0,0 +1,289 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+"""
+Offline-Benchmark für DJ und Monitor: baut eine künstliche navidrome.db (N Tracks, M User,
+K Favoriten pro User) samt Stub-MP3s mit Embedding-/Mood-Tags in einem Arbeitsverzeichnis,
+misst die einzelnen Operationen und zählt die dabei ausgeführten SQL-Anweisungen.
+
+    python dj_benchmark.py --tracks 20000 --users 5 --favorites 20
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+from mutagen.id3 import ID3, TXXX, TIT2, TPE1, TBPM, TKEY, TMOO
+
+KEYS = ["C major", "A minor", "G major", "E minor", "D major", "F# minor", "Bb major", "C# minor"]
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413      # ein stummer MPEG-1 Layer III Frame
+
+logger = logging.getLogger("DJ_Benchmark")
+
+# --------------------------------------------------
+# Künstliche Bibliothek
+# --------------------------------------------------
+
+def build_library(workdir, tracks, users, favorites, dim, moods, blacklist_name, duplicates=0.05, seed=0):
+    """Legt music/, navidrome.db und fingerprints.db unter workdir an (Moods/Blacklist wie im DJ konfiguriert)."""
+    rng = random.Random(seed)
+    nrng = np.random.default_rng(seed)
+    music_dir = os.path.join(workdir, "music")
+    os.makedirs(music_dir, exist_ok=True)
+
+    # Embeddings in Clustern, damit Mixe realistische Nachbarschaften haben
+    centers = nrng.standard_normal((max(8, tracks // 500), dim)).astype(np.float32)
+    labels = nrng.integers(0, len(centers), tracks)
+    vectors = centers[labels] + 0.6 * nrng.standard_normal((tracks, dim)).astype(np.float32)
+
+    now = datetime(2026, 1, 1)
+    songs, fingerprints = [], []
+    for i in range(tracks):
+        song_id = uuid.UUID(int=rng.getrandbits(128)).hex
+        artist, title = f"Artist {i // 12}", f"Title {i}"
+        rel = os.path.join(f"Artist {i // 12}", f"Album {i // 12 % 3}", f"{i:06d}.mp3")
+        path = os.path.join(music_dir, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(MP3_FRAME * 3)
+
+        tags = ID3()
+        tags.add(TIT2(encoding=3, text=title))
+        tags.add(TPE1(encoding=3, text=artist))
+        tags.add(TXXX(encoding=3, desc="XX_EMBEDDING_JSON", text=json.dumps(vectors[i].round(4).tolist())))
+        tags.add(TMOO(encoding=3, text=rng.sample(moods, rng.randint(1, 3))))
+        tags.add(TBPM(encoding=3, text=str(rng.randint(70, 175))))
+        tags.add(TKEY(encoding=3, text=rng.choice(KEYS)))
+        tags.add(TXXX(encoding=3, desc="XX_DANCEABILITY", text=f"{rng.uniform(0.5, 2.5):.3f}"))
+        tags.add(TXXX(encoding=3, desc="XX_INTENSITY", text=f"{rng.random():.3f}"))
+        tags.save(path)
+
+        updated = (now + timedelta(seconds=i)).isoformat()
+        songs.append((song_id, rel, title, artist, f"Album {i // 12 % 3}", updated))
+        group = f"g{i - 1}" if i and rng.random() < duplicates else f"g{i}"
+        fingerprints.append((path, 180.0, b"", group, 1, updated))
+
+    with sqlite3.connect(os.path.join(workdir, "navidrome.db")) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE user (id TEXT PRIMARY KEY, user_name TEXT);
+            CREATE TABLE media_file (id TEXT PRIMARY KEY, path TEXT, title TEXT, artist TEXT,
+                                     album TEXT, updated_at TEXT);
+            CREATE TABLE annotation (user_id TEXT, item_id TEXT, item_type TEXT,
+                                     play_count INTEGER DEFAULT 0, play_date TEXT, rating INTEGER DEFAULT 0,
+                                     rated_at TEXT, starred INTEGER DEFAULT 0, starred_at TEXT,
+                                     PRIMARY KEY (user_id, item_id, item_type));
+            CREATE TABLE playlist (id TEXT PRIMARY KEY, name TEXT, owner_id TEXT, public INTEGER,
+                                   created_at TEXT, updated_at TEXT, song_count INTEGER DEFAULT 0);
+            CREATE TABLE playlist_tracks (id TEXT, playlist_id TEXT, media_file_id TEXT);
+            CREATE INDEX media_file_updated_at ON media_file (updated_at);
+            CREATE INDEX annotation_play_date ON annotation (play_date);
+            CREATE INDEX annotation_starred ON annotation (starred);
+            CREATE INDEX playlist_tracks_playlist ON playlist_tracks (playlist_id);
+        """)
+        conn.executemany("INSERT INTO media_file VALUES (?, ?, ?, ?, ?, ?)", songs)
+
+        ids = [s[0] for s in songs]
+        for u in range(users):
+            user_id = f"user-{u}"
+            conn.execute("INSERT INTO user VALUES (?, ?)", (user_id, f"user{u}"))
+            played = rng.sample(ids, min(len(ids), max(favorites * 10, len(ids) // 10)))
+            starred = set(played[:favorites])
+            rows = []
+            for sid in played:
+                plays = rng.randint(0, 40)
+                rating = rng.choice([0, 0, 0, 1, 2, 3, 4])
+                play_date = (now + timedelta(minutes=rng.randint(0, 60 * 24 * 30))).isoformat()
+                rows.append((user_id, sid, "media_file", plays, play_date, rating,
+                             play_date if rating else None, int(sid in starred),
+                             play_date if sid in starred else None))
+            conn.executemany("INSERT INTO annotation VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+            pl_id = str(uuid.uuid4())
+            blocked = rng.sample(ids, min(len(ids), 20))
+            conn.execute("INSERT INTO playlist VALUES (?, ?, ?, 0, ?, ?, ?)",
+                         (pl_id, blacklist_name, user_id, now.isoformat(), now.isoformat(), len(blocked)))
+            conn.executemany("INSERT INTO playlist_tracks VALUES (?, ?, ?)",
+                             [(str(uuid.uuid4()), pl_id, sid) for sid in blocked])
+
+    with sqlite3.connect(os.path.join(workdir, "fingerprints.db")) as conn:
+        conn.execute("""
+            CREATE TABLE fingerprints (path TEXT PRIMARY KEY, duration REAL NOT NULL, fp BLOB NOT NULL,
+                                       group_id TEXT NOT NULL, analyzed INTEGER NOT NULL DEFAULT 0, updated_at TEXT)
+        """)
+        conn.executemany("INSERT INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)", fingerprints)
+
+def configure_env(workdir):
+    """Alle Pfade des DJ auf workdir umbiegen (vor dem Import von dj_loop aufrufen)."""
+    os.environ.update({
+        "ND_DB_PATH": os.path.join(workdir, "navidrome.db"),
+        "ND_TEMP_DB_PATH": os.path.join(workdir, "navidrome_snap.db"),
+        "ND_MUSIC_DIR": os.path.join(workdir, "music"),
+        "ND_INDEX_DIR": os.path.join(workdir, "dj_index"),
+        "ND_STATE_DB": os.path.join(workdir, "dj_state.db"),
+        "ND_FINGERPRINT_DB": os.path.join(workdir, "fingerprints.db"),
+        "ND_DATA_DIR": workdir,
+        "STARAIN_MOVE_JOURNAL": os.path.join(workdir, "organizer_moves.jsonl"),
+    })
+
+# --------------------------------------------------
+# SQL-Zähler (Trace-Callback auf jeder neuen Verbindung)
+# --------------------------------------------------
+
+class StatementCounter:
+    """Ersetzt sqlite3.connect prozessweit durch eine Variante, die jede Anweisung mitzählt."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.connects = 0
+        self._connect = None
+
+    def _trace(self, statement):
+        with self._lock:
+            self.count += 1
+
+    def install(self):
+        self._connect = sqlite3.connect
+
+        def connect(*args, **kwargs):
+            conn = self._connect(*args, **kwargs)
+            conn.set_trace_callback(self._trace)
+            with self._lock:
+                self.connects += 1
+            return conn
+
+        sqlite3.connect = connect
+
+    def uninstall(self):
+        if self._connect is not None:
+            sqlite3.connect = self._connect
+            self._connect = None
+
+    def snapshot(self):
+        with self._lock:
+            return self.count, self.connects
+
+# --------------------------------------------------
+# Messlauf
+# --------------------------------------------------
+
+def run(workdir, seeds=50, batch=32):
+    from dj_loop import NavidromeDJ
+    from playlist_monitor import PlaylistMonitor
+
+    counter = StatementCounter()
+    counter.install()
+    results = []
+
+    def measure(name, fn):
+        statements, connects = counter.snapshot()
+        t0 = time.perf_counter()
+        value = fn()
+        elapsed = time.perf_counter() - t0
+        statements2, connects2 = counter.snapshot()
+        results.append({"op": name, "seconds": elapsed, "statements": statements2 - statements,
+                        "connects": connects2 - connects})
+        return value
+
+    try:
+        monitor = PlaylistMonitor()
+        dj = measure("NavidromeDJ()", lambda: NavidromeDJ(exclusions=monitor.exclusions, db=monitor.db,
+                                                             writes=monitor.writes))
+        monitor.dj = dj
+        measure("create_safe_snapshot", dj.create_safe_snapshot)
+        measure("index_library (kalt)", dj.index_library)
+        measure("create_safe_snapshot (unverändert)", dj.create_safe_snapshot)
+        measure("index_library (warm)", dj.index_library)
+        measure("sync_library (leer)", dj.sync_library)
+        restarted = NavidromeDJ(exclusions=monitor.exclusions, db=monitor.db, writes=monitor.writes)
+        measure("warm_start (Neustart)", restarted.warm_start)
+
+        users = monitor.get_all_users()
+        monitor.users = users
+        user_ids = [uid for uid, _ in users]
+        rng = random.Random(1)
+        picks = rng.sample(sorted(dj.library), min(seeds, len(dj.library)))
+        jobs = [(user_ids[i % len(user_ids)], sid, f"Bench-Mix {i}", None) for i, sid in enumerate(picks)]
+
+        measure(f"generate_mix x{len(jobs)}", lambda: [dj.generate_mix(*job) for job in jobs])
+        measure(f"generate_mixes x{len(jobs)} (Batch {batch})",
+                lambda: [dj.generate_mixes(jobs[i:i + batch]) for i in range(0, len(jobs), batch)])
+        measure(f"process_daily_moods_all x{len(user_ids)}", lambda: dj.process_daily_moods_all(user_ids))
+
+        def check_playlists():
+            for uid, name in users:
+                monitor.check_playlists(uid, name)
+            while monitor.mixes.pending():
+                time.sleep(0.01)
+
+        measure("check_playlists + Mix-Queue", check_playlists)
+        measure("check_playlists (nichts zu tun)", check_playlists)
+        measure("check_ratings", monitor.check_ratings)
+        measure("check_ratings (inkrementell)", monitor.check_ratings)
+        monitor.mixes.stop()
+        monitor.writes.stop()
+    finally:
+        counter.uninstall()
+    return results
+
+def print_results(results, header):
+    print(header)
+    print(f"{'Operation':<42} {'Sekunden':>10} {'SQL':>8} {'Verb.':>6}")
+    for r in results:
+        print(f"{r['op']:<42} {r['seconds']:>10.3f} {r['statements']:>8} {r['connects']:>6}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline-Benchmark für STARAIN DJ / Monitor")
+    parser.add_argument("--tracks", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--favorites", type=int, default=20, help="Favoriten (Herzen) pro User")
+    parser.add_argument("--dim", type=int, default=512, help="Embedding-Dimension")
+    parser.add_argument("--seeds", type=int, default=50, help="Anzahl Mixe für generate_mix(es)")
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--workdir", default="/tmp/starain_dj_bench")
+    parser.add_argument("--reuse", action="store_true", help="Vorhandene Bibliothek im workdir weiterverwenden")
+    parser.add_argument("--json", help="Ergebnisse zusätzlich als JSON schreiben")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s - [BENCH] - %(message)s", stream=sys.stdout)
+
+    configure_env(args.workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from dj_loop import TARGET_MOODS, BLACKLIST_NAME
+
+    if not args.reuse:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+        t0 = time.perf_counter()
+        build_library(args.workdir, args.tracks, args.users, args.favorites, args.dim, TARGET_MOODS, BLACKLIST_NAME)
+        print(f"🏗️ Bibliothek erzeugt in {time.perf_counter() - t0:.1f}s: {args.workdir}")
+    else:
+        # Ableitungen (Index, Snapshot, Zustand) verwerfen, damit 'kalt' wirklich kalt ist
+        shutil.rmtree(os.path.join(args.workdir, "dj_index"), ignore_errors=True)
+        for name in ("navidrome_snap.db", "dj_state.db"):
+            if os.path.exists(os.path.join(args.workdir, name)):
+                os.remove(os.path.join(args.workdir, name))
+
+    results = run(args.workdir, seeds=args.seeds, batch=args.batch)
+    print_results(results, f"📊 {args.tracks} Tracks, {args.users} User, {args.favorites} Favoriten, dim {args.dim}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"tracks": args.tracks, "users": args.users, "favorites": args.favorites,
+                       "dim": args.dim, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
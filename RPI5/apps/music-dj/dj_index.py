@@ -0,0 +1,497 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import json
+import time
+import logging
+import numpy as np
+
+INDEX_DIR = os.getenv("ND_INDEX_DIR", "/data/dj_index")
+INDEX_VERSION = 2
+PITCH_CLASSES = {"C": 0, "C#": 1, "DB": 1, "D": 2, "D#": 3, "EB": 3, "E": 4, "F": 5, "F#": 6, "GB": 6,
+                 "G": 7, "G#": 8, "AB": 8, "A": 9, "A#": 10, "BB": 10, "B": 11}
+NO_FEATURES = (np.nan, -1, np.nan, np.nan)
+
+FEATURE_COLUMNS = ("bpm", "key", "dance", "intensity")
+BATCH_SCORE_CELLS = 1 << 24     # max. Größe der Score-Matrix pro Block (64 MB float32)
+
+logger = logging.getLogger("DJ_Index")
+
+# --------------------------------------------------
+# Tonart als Zahl (0-11 Dur, 12-23 Moll, -1 unbekannt)
+# --------------------------------------------------
+
+def key_index(text):
+    if not text:
+        return -1
+    parts = str(text).replace("-", " ").split()
+    pc = PITCH_CLASSES.get(parts[0].upper()) if parts else None
+    if pc is None:
+        return -1
+    minor = len(parts) > 1 and parts[1].lower() in ("minor", "moll", "min")
+    return pc + (12 if minor else 0)
+
+def rows_mask(row_of, n, ids=()):
+    """Bool-Maske über n Zeilen: True für die IDs, die in row_of stehen."""
+    mask = np.zeros(n, dtype=bool)
+    rows = [row_of[sid] for sid in ids if sid in row_of]
+    if rows:
+        mask[np.array(rows)] = True
+    return mask
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+# --------------------------------------------------
+# Persistenter Embedding-Index (eine Zeile pro Datei)
+# --------------------------------------------------
+
+class EmbeddingIndex:
+    """
+    Zusammenhängende, normierte float32-Matrix plus Spalten (ID, Pfad, mtime, Größe, Mood-Bitmaske,
+    BPM, Tonart, Danceability, Intensität). Liegt als .npy auf der Platte, die Matrix wird per mmap
+    geladen. Beim Refresh werden nur Dateien neu gelesen, deren stat() sich geändert hat.
+    """
+
+    def __init__(self, mood_names, index_dir=INDEX_DIR):
+        self.index_dir = index_dir
+        self.mood_names = list(mood_names)
+        self.mood_bit = {m: 1 << i for i, m in enumerate(self.mood_names)}
+        self._reset()
+
+    def _reset(self):
+        self.dim = None
+        self.ids = []
+        self.paths = []
+        self.row_of = {}
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.has_vec = np.zeros(0, dtype=bool)
+        self.mtime = np.zeros(0, dtype=np.float64)
+        self.size = np.zeros(0, dtype=np.int64)
+        self.moods = np.zeros(0, dtype=np.uint32)
+        self.bpm = np.zeros(0, dtype=np.float32)
+        self.key = np.zeros(0, dtype=np.int8)
+        self.dance = np.zeros(0, dtype=np.float32)
+        self.intensity = np.zeros(0, dtype=np.float32)
+        self.dirty = False
+        self.generation = 0
+        self._bufs = None
+        self.last_reuse = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _file(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def _touch(self):
+        """
+        Inhalt geändert: neue Generation. ANN, Codes und Warmstart-Zustand merken sich die
+        Generation, zu der sie passen, und vergleichen nur diese Zahl statt aller IDs.
+        Zeitbasiert, damit sich Generationen auch über Neustarts nicht wiederholen.
+        """
+        self.dirty = True
+        self.generation = max(self.generation + 1, time.time_ns())
+
+    # --------------------------------------------------
+    # Laden / Speichern
+    # --------------------------------------------------
+
+    def load(self):
+        try:
+            with open(self._file("meta.json"), "r") as f:
+                meta = json.load(f)
+            if meta.get("version") != INDEX_VERSION or meta.get("moods") != self.mood_names:
+                logger.info("Index-Format oder Mood-Liste geändert -> Neuaufbau.")
+                return False
+            with open(self._file("rows.json"), "r", encoding="utf-8") as f:
+                rows = json.load(f)
+
+            self.dim = meta.get("dim")
+            self.generation = meta.get("generation", 0)
+            self.ids, self.paths = rows["ids"], rows["paths"]
+            self.matrix = np.load(self._file("emb.npy"), mmap_mode="r")
+            self.has_vec = np.load(self._file("has_vec.npy"))
+            self.mtime = np.load(self._file("mtime.npy"))
+            self.size = np.load(self._file("size.npy"))
+            self.moods = np.load(self._file("moods.npy"))
+            for name in FEATURE_COLUMNS:
+                setattr(self, name, np.load(self._file(f"{name}.npy")))
+            if not (len(self.ids) == len(self.paths) == len(self.matrix) == len(self.mtime) == len(self.bpm)):
+                raise ValueError("Spaltenlängen passen nicht zusammen")
+            self.row_of = {sid: i for i, sid in enumerate(self.ids) if sid is not None}
+            self._bufs = None
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"Index-Ladefehler: {e}")
+            self._reset()
+            return False
+
+    def _save_array(self, name, arr):
+        tmp = self._file(name + ".tmp.npy")
+        np.save(tmp, arr)
+        os.replace(tmp, self._file(name))
+
+    def save(self):
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            self._save_array("emb.npy", np.ascontiguousarray(self.matrix, dtype=np.float32))
+            self._save_array("has_vec.npy", self.has_vec)
+            self._save_array("mtime.npy", self.mtime)
+            self._save_array("size.npy", self.size)
+            self._save_array("moods.npy", self.moods)
+            for name in FEATURE_COLUMNS:
+                self._save_array(f"{name}.npy", getattr(self, name))
+            tmp = self._file("rows.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"ids": self.ids, "paths": self.paths}, f)
+            os.replace(tmp, self._file("rows.json"))
+            # meta zuletzt: erst dann gilt der Index als vollständig
+            tmp = self._file("meta.json.tmp")
+            with open(tmp, "w") as f:
+                json.dump({"version": INDEX_VERSION, "dim": self.dim, "moods": self.mood_names,
+                           "generation": self.generation}, f)
+            os.replace(tmp, self._file("meta.json"))
+            # Matrix ab jetzt aus der Datei mappen (Seiten teilbar/auslagerbar)
+            self.matrix = np.load(self._file("emb.npy"), mmap_mode="r")
+            self._bufs = None
+            self.dirty = False
+            return True
+        except Exception as e:
+            logger.error(f"Index-Speicherfehler: {e}")
+            return False
+
+    # --------------------------------------------------
+    # Refresh (nur geänderte Dateien lesen)
+    # --------------------------------------------------
+
+    def mood_mask(self, moods):
+        mask = 0
+        for m in moods:
+            mask |= self.mood_bit.get(m, 0)
+        return mask
+
+    def refresh(self, entries, extract, carry=None):
+        """
+        entries: Liste (song_id, pfad). extract(pfad) -> (vec|None, [moods], (bpm, key, dance, intensity)).
+        carry: {song_id: (vec, [moods], features)} für Daten, die ohne Lesen übernommen werden (z.B. Moves).
+        Gibt (wiederverwendet, neu_gelesen) zurück.
+        """
+        return self.apply_refresh(self.prepare_refresh(entries, extract, carry))
+
+    def prepare_refresh(self, entries, extract, carry=None):
+        """
+        Teuer (stat aller Dateien, neue lesen), ändert den Index aber nicht: Suchen laufen
+        währenddessen weiter. Der Index darf sich bis apply_refresh nicht ändern.
+        """
+        carry = carry or {}
+        dim = self.dim
+        old_count = len(self.ids)
+        old_matrix = self.matrix
+        old_row_by_path = {p: i for i, p in enumerate(self.paths)}
+
+        n = len(entries)
+        new_mtime = np.zeros(n, dtype=np.float64)
+        new_size = np.zeros(n, dtype=np.int64)
+        new_moods = np.zeros(n, dtype=np.uint32)
+        new_has_vec = np.zeros(n, dtype=bool)
+        new_bpm = np.full(n, np.nan, dtype=np.float32)
+        new_key = np.full(n, -1, dtype=np.int8)
+        new_dance = np.full(n, np.nan, dtype=np.float32)
+        new_intensity = np.full(n, np.nan, dtype=np.float32)
+        reuse_dst, reuse_src = [], []
+        fresh = {}
+        reused = read = 0
+
+        for row, (song_id, path) in enumerate(entries):
+            try:
+                st = os.stat(path)
+                new_mtime[row], new_size[row] = st.st_mtime, st.st_size
+            except OSError:
+                pass
+
+            src = old_row_by_path.get(path)
+            if src is not None and self.mtime[src] == new_mtime[row] and self.size[src] == new_size[row]:
+                reuse_dst.append(row)
+                reuse_src.append(src)
+                reused += 1
+                continue
+
+            if song_id in carry:
+                vec, moods, features = carry[song_id]
+                reused += 1
+            else:
+                vec, moods, features = extract(path)
+                read += 1
+
+            new_moods[row] = self.mood_mask(moods)
+            bpm, key, dance, intensity = features or NO_FEATURES
+            new_bpm[row], new_key[row] = _to_float(bpm), key
+            new_dance[row], new_intensity[row] = _to_float(dance), _to_float(intensity)
+            if vec is not None:
+                vec = np.asarray(vec, dtype=np.float32)
+                if dim is None:
+                    dim = len(vec)
+                if len(vec) == dim:
+                    fresh[row] = vec
+                    new_has_vec[row] = True
+
+        matrix = np.zeros((n, dim or 0), dtype=np.float32)
+        if reuse_dst:
+            dst, src = np.array(reuse_dst), np.array(reuse_src)
+            if self.matrix.shape[1] == matrix.shape[1]:
+                matrix[dst] = self.matrix[src]
+            # Spalten übernommener Zeilen in einem Schritt kopieren
+            new_moods[dst], new_has_vec[dst] = self.moods[src], self.has_vec[src]
+            new_bpm[dst], new_key[dst] = self.bpm[src], self.key[src]
+            new_dance[dst], new_intensity[dst] = self.dance[src], self.intensity[src]
+        for row, vec in fresh.items():
+            matrix[row] = vec
+
+        return {"entries": entries, "dim": dim, "old_count": old_count, "old_matrix": old_matrix,
+                "matrix": matrix, "mtime": new_mtime, "size": new_size, "moods": new_moods,
+                "has_vec": new_has_vec, "bpm": new_bpm, "key": new_key, "dance": new_dance,
+                "intensity": new_intensity, "reuse": (reuse_dst, reuse_src), "counts": (reused, read)}
+
+    def apply_refresh(self, plan):
+        """Übernimmt ein prepare_refresh-Ergebnis (schnell, nur Zuweisungen)."""
+        entries, n, old_matrix = plan["entries"], len(plan["entries"]), plan["old_matrix"]
+        reuse_dst, reuse_src = plan["reuse"]
+        matrix = plan["matrix"]
+        self.dim = plan["dim"]
+        self.ids = [sid for sid, _ in entries]
+        self.paths = [p for _, p in entries]
+        self.row_of = {sid: i for i, sid in enumerate(self.ids)}
+        self._bufs = None
+        self.matrix, self.mtime, self.size = matrix, plan["mtime"], plan["size"]
+        self.moods, self.has_vec = plan["moods"], plan["has_vec"]
+        self.bpm, self.key, self.dance, self.intensity = plan["bpm"], plan["key"], plan["dance"], plan["intensity"]
+        self.last_reuse = (np.array(reuse_dst, dtype=np.int64), np.array(reuse_src, dtype=np.int64))
+        if len(reuse_src) != n or n != plan["old_count"] or reuse_src != list(range(n)):
+            self._touch()
+        else:
+            self.dirty = False
+        if not self.dirty and old_matrix.shape == matrix.shape:
+            # Nichts geändert -> weiter die gemappte Datei nutzen statt der Kopie
+            self.matrix = old_matrix
+        return plan["counts"]
+
+    # --------------------------------------------------
+    # Delta-Updates (einzelne Zeilen ändern, anhängen, löschen)
+    # --------------------------------------------------
+
+    _COLUMNS = ("matrix", "has_vec", "mtime", "size", "moods", "bpm", "key", "dance", "intensity")
+    _EMPTY = {"has_vec": False, "mtime": 0, "size": 0, "moods": 0,
+              "bpm": np.nan, "key": -1, "dance": np.nan, "intensity": np.nan}
+
+    def _ensure_capacity(self, n_needed):
+        """
+        Spalten in beschreibbare Puffer mit Reserve umziehen (die Matrix ist nach load/save
+        nur gemappt). Öffentliche Arrays bleiben Views auf die ersten n Zeilen.
+        Gibt True zurück, wenn neu alloziert wurde (alte Views zeigen dann auf die Kopie).
+        """
+        n = len(self.ids)
+        dim = self.dim or 0
+        if self._bufs is not None and n_needed <= len(self._bufs["has_vec"]) \
+                and self._bufs["matrix"].shape[1] == dim:
+            return False
+
+        capacity = max(n_needed, int(n * 1.25) + 256)
+        bufs = {}
+        for name in self._COLUMNS:
+            arr = getattr(self, name)
+            if name == "matrix":
+                buf = np.zeros((capacity, dim), dtype=np.float32)
+                if arr.shape[1] == dim:
+                    buf[:n] = arr
+            else:
+                buf = np.full(capacity, self._EMPTY[name], dtype=arr.dtype)
+                buf[:n] = arr
+            bufs[name] = buf
+        self._bufs = bufs
+        self._set_rows(n)
+        return True
+
+    def _set_rows(self, n):
+        for name, buf in self._bufs.items():
+            setattr(self, name, buf[:n])
+
+    def upsert(self, entries, extract):
+        """
+        entries: (song_id, pfad). Vorhandene Zeilen werden überschrieben, neue angehängt;
+        unveränderte Dateien (gleiche mtime/Größe) werden nicht gelesen.
+        Gibt (geänderte_zeilen, neu_alloziert) zurück.
+        """
+        updates = []
+        for song_id, path in entries:
+            try:
+                st = os.stat(path)
+                mtime, size = st.st_mtime, st.st_size
+            except OSError:
+                continue
+            row = self.row_of.get(song_id)
+            if row is not None and self.paths[row] == path and self.mtime[row] == mtime and self.size[row] == size:
+                continue
+            vec, moods, features = extract(path)
+            if vec is not None:
+                vec = np.asarray(vec, dtype=np.float32)
+                if self.dim is None:
+                    self.dim = len(vec)
+                if len(vec) != self.dim:
+                    vec = None
+            updates.append((song_id, path, mtime, size, vec, moods, features))
+
+        if not updates:
+            return [], False
+        new_rows = sum(1 for u in updates if u[0] not in self.row_of)
+        realloc = self._ensure_capacity(len(self.ids) + new_rows)
+
+        rows = []
+        for song_id, path, mtime, size, vec, moods, features in updates:
+            row = self.row_of.get(song_id)
+            if row is None:
+                row = len(self.ids)
+                self.ids.append(song_id)
+                self.paths.append(path)
+                self.row_of[song_id] = row
+                self._set_rows(len(self.ids))
+            self.paths[row] = path
+            self.mtime[row], self.size[row] = mtime, size
+            self.moods[row] = self.mood_mask(moods)
+            bpm, key, dance, intensity = features or NO_FEATURES
+            self.bpm[row], self.key[row] = _to_float(bpm), key
+            self.dance[row], self.intensity[row] = _to_float(dance), _to_float(intensity)
+            self.has_vec[row] = vec is not None
+            self.matrix[row] = vec if vec is not None else 0.0
+            rows.append(row)
+
+        self._touch()
+        return rows, realloc
+
+    def delete(self, song_ids):
+        """Zeilen als gelöscht markieren (Platz wird beim nächsten refresh freigegeben)."""
+        rows = [self.row_of[sid] for sid in song_ids if sid in self.row_of]
+        if not rows:
+            return []
+        self._ensure_capacity(len(self.ids))
+        for row in rows:
+            del self.row_of[self.ids[row]]
+            self.ids[row] = None
+            self.paths[row] = None
+            for name, value in self._EMPTY.items():
+                getattr(self, name)[row] = value
+        self._touch()
+        return rows
+
+    # --------------------------------------------------
+    # Abfragen
+    # --------------------------------------------------
+
+    def vectors(self):
+        """{song_id: Zeilen-View} für alle Songs mit Embedding (keine Kopien)."""
+        return {self.ids[i]: self.matrix[i] for i in np.nonzero(self.has_vec)[0]}
+
+    def mood_ids(self, mood):
+        bit = self.mood_bit.get(mood)
+        if not bit:
+            return []
+        return [self.ids[i] for i in np.nonzero(self.moods & bit)[0]]
+
+    def moods_of(self, song_id):
+        row = self.row_of.get(song_id)
+        if row is None:
+            return []
+        return [m for m in self.mood_names if self.moods[row] & self.mood_bit[m]]
+
+    def features_of(self, song_id):
+        """(bpm, key, dance, intensity) einer Zeile, für Übernahmen ohne Neulesen."""
+        row = self.row_of.get(song_id)
+        if row is None:
+            return NO_FEATURES
+        return (float(self.bpm[row]), int(self.key[row]), float(self.dance[row]), float(self.intensity[row]))
+
+    def select(self, moods=None, bpm_range=None, keys=None, min_dance=None, intensity_range=None):
+        """
+        Bool-Maske über alle Zeilen für eine Merkmals-Abfrage (alle Bedingungen UND-verknüpft).
+        moods: Liste, mindestens einer muss passen; Bereiche als (min, max), Grenzen inklusive.
+        """
+        mask = np.ones(len(self.ids), dtype=bool)
+        if moods:
+            mask &= (self.moods & self.mood_mask(moods)) != 0
+        if bpm_range:
+            mask &= (self.bpm >= bpm_range[0]) & (self.bpm <= bpm_range[1])
+        if keys is not None:
+            mask &= np.isin(self.key, [key_index(k) if isinstance(k, str) else k for k in keys])
+        if min_dance is not None:
+            mask &= self.dance >= min_dance
+        if intensity_range:
+            mask &= (self.intensity >= intensity_range[0]) & (self.intensity <= intensity_range[1])
+        return mask
+
+    # --------------------------------------------------
+    # Ähnlichkeitssuche (Matrix-Vektor-Produkt + argpartition)
+    # --------------------------------------------------
+
+    def mood_rows(self, mood):
+        """Zeilennummern aller Songs mit diesem Mood (für Bitmasken-Filter)."""
+        bit = self.mood_bit.get(mood)
+        if not bit:
+            return np.zeros(0, dtype=np.int64)
+        return np.nonzero(self.moods & bit)[0]
+
+    def id_mask(self, ids=()):
+        """Bool-Maske über alle Zeilen: True für die angegebenen IDs."""
+        return rows_mask(self.row_of, len(self.ids), ids)
+
+    def exclude_mask(self, ids=()):
+        """Bool-Maske über alle Zeilen: True = ausgeschlossen (IDs + Songs ohne Embedding)."""
+        return self.id_mask(ids) | ~self.has_vec
+
+    def top_k(self, query, k, exclude=None):
+        """Die k ähnlichsten Songs zu query als Liste (song_id, score), absteigend sortiert."""
+        if k <= 0 or len(self.ids) == 0 or self.dim is None:
+            return []
+        scores = self.matrix @ np.asarray(query, dtype=np.float32)
+        if exclude is None:
+            exclude = ~self.has_vec
+        scores[exclude] = -np.inf
+
+        k = min(k, int((~exclude).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    def top_k_batch(self, queries, k, excludes):
+        """
+        top_k für viele Anfragen auf einmal: ein Matrix-Matrix-Produkt, Top-k pro Zeile.
+        excludes: eine Maske pro Anfrage (gleiche Objekte für denselben User sind erlaubt).
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if k <= 0 or len(self.ids) == 0 or self.dim is None or len(queries) == 0:
+            return [[] for _ in range(len(queries))]
+        queries = queries.reshape(-1, self.dim)
+
+        results = []
+        step = max(1, BATCH_SCORE_CELLS // len(self.ids))
+        for start in range(0, len(queries), step):
+            scores = queries[start:start + step] @ self.matrix.T
+            scores[np.stack(excludes[start:start + step])] = -np.inf
+
+            kk = min(k, scores.shape[1])
+            top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            for rows, row_scores in zip(top, top_scores):
+                results.append([(self.ids[i], float(s)) for i, s in zip(rows, row_scores) if s != -np.inf])
+        return results
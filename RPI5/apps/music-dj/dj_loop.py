@@ -3,21 +3,28 @@
 
 import os
 import json
-import sqlite3
-import shutil
 import logging
 import numpy as np
-import uuid
 import time
 import re
-import csv
-import random
-from datetime import datetime, timezone
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from mutagen.flac import FLAC
 from mutagen.id3 import ID3
 
 import starain_config as cfg
+from move_journal import JournalReader
+from dj_index import EmbeddingIndex, key_index, rows_mask
+from ann_index import IVFIndex
+from emb_codec import CompactIndex
+from exclusion_cache import ExclusionCache
+from dj_state import StateStore
+from playlist_writer import PlaylistWriter
+from db_snapshot import DBSnapshot
+from db_access import connect, ConnectionManager
+from write_queue import WriteQueue
+from warm_state import WarmState
 
 # --------------------------------------------------
 # Konfiguration
@@ -27,11 +34,15 @@ DB_PATH = os.getenv("ND_DB_PATH", "/data/navidrome.db")
 TEMP_DB_PATH = os.getenv("ND_TEMP_DB_PATH", "/data/navidrome_snap.db")
 MUSIC_DIR = os.getenv("ND_MUSIC_DIR", "/music")
 PLAYLIST_LIMIT = int(os.getenv("ND_PLAYLIST_LIMIT", "30"))
+DAILY_WORKERS = int(os.getenv("ND_DAILY_WORKERS", "4"))
 
 BLACKLIST_NAME = cfg.get_text("pl_blacklist")
 
-MOOD_BLACKLIST_FILE = "/data/mood_blacklist.csv"
-MOOD_HISTORY_FILE = "/data/mood_history.json"
+DATA_DIR = os.getenv("ND_DATA_DIR", "/data")
+MOOD_BLACKLIST_FILE = os.path.join(DATA_DIR, "mood_blacklist.csv")
+MOOD_HISTORY_FILE = os.path.join(DATA_DIR, "mood_history.json")
+FINGERPRINT_DB_PATH = os.getenv("ND_FINGERPRINT_DB", "/data/fingerprints.db")
+PENDING_MOVES_FILE = os.path.join(DATA_DIR, "dj_pending_moves.json")
 
 TARGET_MOODS = cfg.translate_list([
     "Explosiv", "Aggressiv", "Friedlich", "Melancholisch", "Party",
@@ -39,6 +50,8 @@ TARGET_MOODS = cfg.translate_list([
     "Groovy", "Cool"
 ])
 
+MOOD_LOOKUP = {m.lower(): m for m in TARGET_MOODS}
+
 logger = logging.getLogger("DJ_Architect")
 
 # --------------------------------------------------
@@ -46,114 +59,160 @@ logger = logging.getLogger("DJ_Architect")
 # --------------------------------------------------
 
 class NavidromeDJ:
-    def __init__(self):
+    def __init__(self, exclusions=None, db=None, writes=None):
         self.library = {}
-        self.mood_library = defaultdict(list)
+        self.dedup_groups = {}
+        self.metadata = {}
+        self.dedup_keys = {}
+        self.paths = {}
+        self.pending_moves = self._load_pending_moves()
+        self.journal = JournalReader("dj")
+        self.emb_index = EmbeddingIndex(TARGET_MOODS)
+        self.emb_index.load()
+        self.ann = IVFIndex()
+        self.ann.load()
+        self.compact = CompactIndex()
+        self.compact.load()
+        self.db = db or ConnectionManager(DB_PATH)
+        self.exclusions = exclusions or ExclusionCache(self.db, BLACKLIST_NAME)
+        self.state = StateStore()
+        self.writes = writes or WriteQueue(self.db)
+        self.writer = PlaylistWriter(self.db, self.writes)
+        self.snapshot = DBSnapshot(DB_PATH, TEMP_DB_PATH)
+        self.write_lock = threading.Lock()
+        self.index_lock = threading.RLock()     # Lesen (Mix-Worker, Daily Moods) vs. Austausch des Index
+        self.rebuild_lock = threading.RLock()   # Änderungen am Index/Zustand nacheinander (Abgleich, Delta, Journal)
+        if self.state.import_legacy(MOOD_BLACKLIST_FILE, MOOD_HISTORY_FILE):
+            self.state.export_csv(MOOD_BLACKLIST_FILE)
         self.dim_detected = None
         self.last_index_time = 0
+        self.media_mark = None          # MAX(media_file.updated_at) beim letzten Abgleich
+        self.media_sum = None           # SUM(media_file.rowid): Prüfsumme der ID-Menge
+        self.fp_mark = None             # MAX(fingerprints.updated_at) beim letzten Abgleich
+        self.fp_stat = None
+        self.warm = WarmState()
+        self.unsaved = False            # Index/Zustand seit dem letzten Warmstart-Speichern geändert
+        self._sync_deferred = False     # Delta-Sync während eines vollen Abgleichs aufgeschoben
+        self._reconcile = None
+        self.csv_dirty = False          # Mood-Blacklist geändert, CSV-Export steht aus
 
     # --------------------------------------------------
-    # History
+    # Mood Blacklist (SQLite, CSV als menschenlesbarer Export)
     # --------------------------------------------------
 
-    def _load_history(self):
-        if os.path.exists(MOOD_HISTORY_FILE):
+    def _append_to_mood_blacklist(self, user_id, entries):
+        """entries: Liste (mood, song_id). Metadaten aus dem Speicher, Rest in einer Abfrage."""
+        if not entries:
+            return 0
+        missing = list({sid for _, sid in entries if sid not in self.metadata})
+        fetched = {}
+        if missing:
             try:
-                with open(MOOD_HISTORY_FILE, "r") as f:
-                    return json.load(f)
-            except:
-                pass
-        return {}
-
-    def _save_history(self, history):
+                with self.db.reader("dj_metadata") as conn:
+                    placeholders = ",".join("?" * len(missing))
+                    for sid, artist, album, title in conn.execute(
+                        f"SELECT id, artist, album, title FROM media_file WHERE id IN ({placeholders})",
+                        missing
+                    ):
+                        fetched[sid] = (artist, album, title)
+            except Exception as e:
+                logger.error(f"Metadaten für Mood-Blacklist nicht lesbar: {e}")
+
+        rows = []
+        for mood, sid in entries:
+            artist, album, title = self.metadata.get(sid) or fetched.get(sid) or ("Unknown",) * 3
+            rows.append((user_id, mood, sid, artist, album, title))
         try:
-            with open(MOOD_HISTORY_FILE, "w") as f:
-                json.dump(history, f)
+            added = self.state.add_to_mood_blacklist(rows)
+            if added:
+                self.csv_dirty = True
+            return added
         except Exception as e:
-            logger.error(f"History Save Error: {e}")
+            logger.error(f"Mood Blacklist Write Error: {e}")
+            return 0
 
     # --------------------------------------------------
-    # Mood Blacklist (menschenlesbar)
+    # Move-Journal (Hausmeister verschiebt Dateien)
     # --------------------------------------------------
 
-    def _append_to_mood_blacklist(self, user_id, mood, song_id):
-        try:
-            artist = album = title = "Unknown"
-
+    def _load_pending_moves(self):
+        if os.path.exists(PENDING_MOVES_FILE):
             try:
-                with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                    row = conn.execute(
-                        "SELECT artist, album, title FROM media_file WHERE id = ?",
-                        (song_id,)
-                    ).fetchone()
-                    if row:
-                        artist, album, title = row
+                with open(PENDING_MOVES_FILE, "r") as f:
+                    return json.load(f)
             except:
                 pass
+        return {}
 
-            file_exists = os.path.exists(MOOD_BLACKLIST_FILE)
-
-            with open(MOOD_BLACKLIST_FILE, "a", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-                if not file_exists:
-                    writer.writerow([
-                        "user_id",
-                        "mood",
-                        "song_id",
-                        "artist",
-                        "album",
-                        "title",
-                        "timestamp"
-                    ])
-                writer.writerow([
-                    str(user_id),
-                    mood,
-                    str(song_id),
-                    artist,
-                    album,
-                    title,
-                    datetime.now().isoformat()
-                ])
+    def _save_pending_moves(self):
+        try:
+            with open(PENDING_MOVES_FILE, "w") as f:
+                json.dump(self.pending_moves, f)
         except Exception as e:
-            logger.error(f"Mood Blacklist Write Error: {e}")
-
-    def _get_mood_blacklist(self, user_id, mood):
-        blocked_ids = set()
-        if not os.path.exists(MOOD_BLACKLIST_FILE):
-            return blocked_ids
-
+            logger.error(f"Pending-Moves Save Error: {e}")
+
+    def apply_move_journal(self):
+        """
+        Merkt sich neue Verschiebungen (neuer Pfad -> bisherige Song-ID). Sobald Navidrome
+        den Pfad mit neuer ID kennt, übernimmt index_library Vektor/Moods und schreibt
+        History und Mood-Blacklist auf die neue ID um, statt die Datei neu einzulesen.
+        """
+        # Läuft gerade ein voller Abgleich, liest der das Journal selbst (nicht committet = bleibt liegen)
+        if not self.rebuild_lock.acquire(blocking=False):
+            return 0
         try:
-            with open(MOOD_BLACKLIST_FILE, "r", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                next(reader, None)
-                for row in reader:
-                    if len(row) >= 3 and str(row[0]) == str(user_id) and row[1] == mood:
-                        blocked_ids.add(str(row[2]))
-        except:
-            pass
+            entries = self.journal.poll()
+            if not entries:
+                return 0
+
+            by_path = {p: sid for sid, p in self.paths.items()}
+            for e in entries:
+                old = os.path.normpath(os.path.join(MUSIC_DIR, e["old"]))
+                new = os.path.normpath(os.path.join(MUSIC_DIR, e["new"]))
+                sid = by_path.pop(old, None) or self.pending_moves.pop(old, None)
+                if sid is None:
+                    continue
+                self.pending_moves[new] = sid
+                self.paths[sid] = new
+                by_path[new] = sid
+
+            self._save_pending_moves()
+            self.journal.commit()
+            self.unsaved = True
+            logger.info(f"📦 {len(entries)} Verschiebungen aus dem Hausmeister-Journal übernommen.")
+            return len(entries)
+        finally:
+            self.rebuild_lock.release()
+
+    def _remap_song_ids(self, mapping):
+        """Schreibt Mood-History und Mood-Blacklist von alten auf neue Navidrome-IDs um."""
+        try:
+            if self.state.remap_song_ids(mapping):
+                self.csv_dirty = True
+        except Exception as e:
+            logger.error(f"Mood State Remap Error: {e}")
 
-        return blocked_ids
+    def _export_mood_blacklist(self):
+        """CSV-Export einmal am Ende eines Laufs statt nach jedem User bzw. jeder Umschreibung."""
+        if self.csv_dirty and self.state.export_csv(MOOD_BLACKLIST_FILE) is not None:
+            self.csv_dirty = False
 
     # --------------------------------------------------
     # DB Snapshot
     # --------------------------------------------------
 
     def create_safe_snapshot(self):
-        try:
-            if not os.path.exists(DB_PATH):
-                return False
-            shutil.copy2(DB_PATH, TEMP_DB_PATH)
-            return True
-        except:
-            return False
+        return self.snapshot.refresh()
 
     # --------------------------------------------------
     # Metadata
     # --------------------------------------------------
 
     def extract_metadata(self, filepath):
+        """Gibt (vec|None, [mood-tags], (bpm, key_index, danceability, intensity)) zurück."""
         vec = None
         moods_found = []
+        bpm = key = dance = intensity = None
 
         try:
             ext = os.path.splitext(filepath)[1].lower()
@@ -166,14 +225,27 @@ class NavidromeDJ:
                     moods_found = tags["Stimmung"]
                 elif "MOOD" in tags:
                     moods_found = tags["MOOD"]
+                bpm = tags["BPM"][0] if "BPM" in tags else None
+                key = tags["KEY"][0] if "KEY" in tags else None
+                dance = tags["XX_DANCEABILITY"][0] if "XX_DANCEABILITY" in tags else None
+                intensity = tags["XX_INTENSITY"][0] if "XX_INTENSITY" in tags else None
 
             elif ext == ".mp3":
                 tags = ID3(filepath)
                 for frame in tags.getall("TXXX"):
                     if frame.desc == "XX_EMBEDDING_JSON":
                         vec = np.array(json.loads(frame.text[0]))
+                    elif frame.desc == "XX_DANCEABILITY":
+                        dance = frame.text[0]
+                    elif frame.desc == "XX_INTENSITY":
+                        intensity = frame.text[0]
                     if frame.desc.lower() in ["stimmung", "mood"]:
                         moods_found.extend(frame.text)
+                # Der Analyzer schreibt Moods bei MP3 nach TMOO
+                if not moods_found and "TMOO" in tags:
+                    moods_found = list(tags["TMOO"].text)
+                bpm = tags["TBPM"].text[0] if "TBPM" in tags else None
+                key = tags["TKEY"].text[0] if "TKEY" in tags else None
 
             if vec is not None:
                 norm = np.linalg.norm(vec)
@@ -185,163 +257,446 @@ class NavidromeDJ:
         except:
             pass
 
-        return vec, moods_found
+        return vec, moods_found, (bpm, key_index(key), dance, intensity)
+
+    def _match_moods(self, raw_moods):
+        """Tag-Fragmente ('Party;Cool', 'Party/Cool') auf TARGET_MOODS abbilden."""
+        matched = []
+        for entry in raw_moods:
+            for part in re.split(r"[;,/]", entry):
+                target = MOOD_LOOKUP.get(part.strip().lower())
+                if target and target not in matched:
+                    matched.append(target)
+        return matched
+
+    def _extract_for_index(self, filepath):
+        vec, raw_moods, features = self.extract_metadata(filepath)
+        return vec, self._match_moods(raw_moods), features
+
+    # --------------------------------------------------
+    # Fingerprint-Gruppen (vom Analyzer geschrieben)
+    # --------------------------------------------------
+
+    def _fingerprint_stat(self):
+        try:
+            st = os.stat(FINGERPRINT_DB_PATH)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _load_fingerprint_groups(self, since=None):
+        """
+        Pfad -> Gruppen-ID gleicher Aufnahmen (FLAC/MP3-Rips, Compilations). Mit since nur Einträge,
+        die der Analyzer seitdem geschrieben hat. Merkt sich den neuen Wasserstand in fp_mark.
+        """
+        self.fp_stat = self._fingerprint_stat()
+        if self.fp_stat is None:
+            return {}
+        try:
+            with connect(FINGERPRINT_DB_PATH, "dj_fingerprints", readonly=True, timeout=10) as conn:
+                mark = conn.execute("SELECT MAX(updated_at) FROM fingerprints").fetchone()[0]
+                if since is None:
+                    rows = conn.execute("SELECT path, group_id FROM fingerprints").fetchall()
+                else:
+                    rows = conn.execute(
+                        "SELECT path, group_id FROM fingerprints WHERE updated_at >= ?", (since,)
+                    ).fetchall()
+            self.fp_mark = mark
+            return {os.path.normpath(p): g for p, g in rows}
+        except Exception as e:
+            logger.error(f"Fingerprint-Index Fehler: {e}")
+            return {}
 
     # --------------------------------------------------
     # Index
     # --------------------------------------------------
 
     def index_library(self):
-        self.library = {}
-        self.mood_library = defaultdict(list)
+        """
+        Voller Abgleich mit dem Snapshot. Aufgebaut wird ohne index_lock (Mixe und Daily Moods
+        laufen weiter), nur der Austausch am Ende sperrt kurz. rebuild_lock hält Delta-Sync und
+        Move-Journal so lange fern (sie holen ihre Änderungen danach nach).
+        """
+        with self.rebuild_lock:
+            self._index_library()
+            self._save_warm_state()
+        self._export_mood_blacklist()
+
+    def _index_library(self):
+        self.apply_move_journal()
+
+        old_library = self.library
+        old_paths = self.paths
+        dedup_groups = {}
+        paths = {}
+        id_remap = {}
+        entries = []
+        carry = {}
+
+        with connect(TEMP_DB_PATH, "dj_index") as conn:
+            rows = conn.execute("SELECT id, path, artist, album, title FROM media_file").fetchall()
+            media_mark, media_sum = conn.execute(
+                "SELECT MAX(updated_at), COALESCE(SUM(rowid), 0) FROM media_file"
+            ).fetchone()
+
+        # Metadaten in einem Rutsch (statt einer Verbindung pro Kandidat in generate_mix)
+        metadata, dedup_keys, _ = self._build_metadata([(r[0], r[2], r[3], r[4]) for r in rows])
+        fp_groups = self._load_fingerprint_groups()
+
+        for song_id, rel_path, _, _, _ in rows:
+            full_path = os.path.join(MUSIC_DIR, rel_path)
+            in_place = os.path.exists(full_path)
+            if not in_place:
+                # Schon verschoben, Navidrome hat noch nicht neu gescannt -> Pfad aus dem Journal
+                full_path = old_paths.get(song_id)
+                if not full_path or not os.path.exists(full_path):
+                    continue
 
-        with sqlite3.connect(TEMP_DB_PATH) as conn:
-            rows = conn.execute("SELECT id, path FROM media_file").fetchall()
+            key = os.path.normpath(full_path)
+            paths[song_id] = key
+            entries.append((song_id, key))
+
+            group = fp_groups.get(key)
+            if group:
+                dedup_groups[song_id] = group
+
+            # Vom Hausmeister verschoben -> Daten übernehmen statt Datei neu einzulesen
+            moved_from = self.pending_moves.get(key)
+            if moved_from is not None and in_place:
+                # Navidrome kennt den neuen Pfad (ggf. mit neuer ID) -> Move abgeschlossen
+                del self.pending_moves[key]
+                if moved_from != song_id:
+                    id_remap[moved_from] = song_id
+            if moved_from is not None and moved_from in old_library:
+                carry[song_id] = (old_library[moved_from], self.emb_index.moods_of(moved_from),
+                                  self.emb_index.features_of(moved_from))
+
+        if id_remap:
+            # Alte IDs (Navidrome hat noch beide Zeilen) nicht doppelt führen
+            stale = set(id_remap)
+            entries = [e for e in entries if e[0] not in stale]
+            for old_id in stale:
+                paths.pop(old_id, None)
+                dedup_groups.pop(old_id, None)
+
+        # Nur Dateien mit geändertem stat() werden geöffnet, der Rest kommt aus dem Index
+        plan = self.emb_index.prepare_refresh(entries, self._extract_for_index, carry)
+
+        # Austausch: ab hier sehen Leser den neuen Stand
+        with self.index_lock:
+            ann_aligned = self.ann.matches(self.emb_index)
+            compact_aligned = self.compact.matches(self.emb_index)
+            reused, read = self.emb_index.apply_refresh(plan)
+            ann_changed = self.ann.sync(self.emb_index, aligned=ann_aligned)
+            compact_changed = self.compact.sync(self.emb_index, aligned=compact_aligned)
+            self.metadata, self.dedup_keys = metadata, dedup_keys
+            self.paths, self.dedup_groups = paths, dedup_groups
+            self.media_mark, self.media_sum = media_mark, media_sum
+            self.dim_detected = self.emb_index.dim
+            self.library = self.emb_index.vectors()
+        logger.info(f"📚 Index: {len(entries)} Dateien ({reused} aus Cache, {read} neu gelesen).")
+
+        # Speichern liest nur (Delta-Sync wartet per rebuild_lock), die Matrix wird danach gemappt
+        if self.emb_index.dirty:
+            self.emb_index.save()
+            self.library = self.emb_index.vectors()
+        if ann_changed:
+            self.ann.save()
+        if compact_changed:
+            self.compact.save()
+
+        # Moves, deren Ziel es nicht mehr gibt, vergessen
+        self.pending_moves = {p: sid for p, sid in self.pending_moves.items() if os.path.exists(p)}
+        self._save_pending_moves()
+        if id_remap:
+            self._remap_song_ids(id_remap)
+            logger.info(f"📦 {len(id_remap)} verschobene Songs auf neue IDs umgeschrieben.")
 
-        for song_id, rel_path in rows:
-            full_path = os.path.join(MUSIC_DIR, rel_path)
-            if not os.path.exists(full_path):
-                continue
+        self.last_index_time = time.time()
 
-            vec, raw_moods = self.extract_metadata(full_path)
+    # --------------------------------------------------
+    # Warmstart (Zustand sichern, laden, im Hintergrund abgleichen)
+    # --------------------------------------------------
 
-            if vec is not None:
-                self.library[song_id] = vec
+    def warm_start(self):
+        """
+        Übernimmt den gesicherten Zustand passend zum geladenen Index. True: Mixe, Daily Moods
+        und Delta-Sync sind sofort möglich; der volle Abgleich folgt mit reconcile_in_background.
+        """
+        state = self.warm.load(self.emb_index)
+        if state is None:
+            return False
+        with self.index_lock:
+            self.metadata = state["metadata"]
+            self.dedup_keys = state["dedup_keys"]
+            self.paths = state["paths"]
+            self.dedup_groups = state["dedup_groups"]
+            self.media_mark = state["media_mark"]
+            self.media_sum = state.get("media_sum")
+            self.fp_mark = state["fp_mark"]
+            self.fp_stat = state["fp_stat"]
+            self.last_index_time = state["last_index_time"]
+            self.dim_detected = self.emb_index.dim
+            self.library = self.emb_index.vectors()
+            self.warm.saved_at = time.time()
+        saved = time.strftime("%d.%m. %H:%M", time.localtime(state["saved_at"]))
+        logger.info(f"♨️ Warmstart: {len(self.library)} Songs aus dem Zustand vom {saved} geladen.")
+        return True
+
+    def reconcile_in_background(self):
+        """Snapshot + index_library in einem eigenen Thread; bis dahin wird mit dem Warmstart-Zustand gearbeitet."""
+        def run():
+            try:
+                t0 = time.time()
+                if self.create_safe_snapshot():
+                    self.index_library()
+                    logger.info(f"✅ Abgleich nach Warmstart fertig ({time.time() - t0:.0f}s).")
+            except Exception as e:
+                logger.error(f"Abgleich nach Warmstart fehlgeschlagen: {e}")
+
+        self._reconcile = threading.Thread(target=run, name="dj-reconcile", daemon=True)
+        self._reconcile.start()
+
+    def reconciling(self):
+        return self._reconcile is not None and self._reconcile.is_alive()
+
+    def save_warm_state(self, timeout=-1):
+        """
+        Sichert Index (falls per Delta-Sync geändert) und Zustand. timeout=0: nur wenn gerade kein
+        Abgleich läuft. Speichern liest nur, Mixe und Daily Moods (index_lock) laufen weiter.
+        """
+        if not self.last_index_time or not self.rebuild_lock.acquire(timeout=timeout):
+            return False
+        try:
+            return self._save_warm_state()
+        finally:
+            self.rebuild_lock.release()
+
+    def save_warm_state_if_due(self):
+        """Periodisch aus der Monitor-Schleife: nur bei Änderungen, blockiert nie."""
+        if self.unsaved and self.warm.due():
+            return self.save_warm_state(timeout=0)
+        return False
+
+    def _save_warm_state(self):
+        if self.emb_index.dirty:
+            ann_aligned = self.ann.matches(self.emb_index)
+            compact_aligned = self.compact.matches(self.emb_index)
+            if not self.emb_index.save():
+                return False
+            # save() mappt die Matrix neu -> Zeilen-Views erneuern
+            self.library = self.emb_index.vectors()
+            if ann_aligned:
+                self.ann.save()
+            if compact_aligned:
+                self.compact.save()
+        saved = self.warm.save(
+            self.emb_index, metadata=self.metadata, dedup_keys=self.dedup_keys, paths=self.paths,
+            dedup_groups=self.dedup_groups, media_mark=self.media_mark, media_sum=self.media_sum,
+            fp_mark=self.fp_mark, fp_stat=self.fp_stat, last_index_time=self.last_index_time
+        )
+        if saved:
+            self.unsaved = False
+        return saved
 
-            for entry in raw_moods:
-                for part in re.split(r"[;,/]", entry):
-                    clean = part.strip()
-                    for target in TARGET_MOODS:
-                        if clean.lower() == target.lower():
-                            self.mood_library[target].append(song_id)
+    # --------------------------------------------------
+    # Delta-Abgleich (zwischen den vollen Index-Läufen)
+    # --------------------------------------------------
 
-        self.last_index_time = time.time()
+    def sync_library(self, media_changed=True):
+        """
+        Übernimmt neue, geänderte und gelöschte Songs direkt aus der Live-DB, ohne Snapshot und
+        ohne die ganze Bibliothek zu prüfen. Signale: media_file.updated_at (Navidrome-Scan),
+        die ID-Menge (nur wenn Anzahl oder rowid-Summe nicht zu den neuen Zeilen passen) und
+        fingerprints.updated_at (Analyzer hat gerade Tags geschrieben). media_changed=False prüft
+        nur den Fingerprint-Index.
+        Gibt die Anzahl geänderter Zeilen zurück.
+        """
+        if not self.last_index_time:
+            return 0
+        media_changed = media_changed or self._sync_deferred
+        fp_changed = self._fingerprint_stat() != self.fp_stat
+        if not media_changed and not fp_changed:
+            return 0
+
+        # Voller Abgleich läuft: im nächsten Zyklus nachholen (Delta-Updates sind kurz -> index_lock)
+        if not self.rebuild_lock.acquire(blocking=False):
+            self._sync_deferred = media_changed
+            return 0
+        try:
+            self._sync_deferred = False
+            with self.index_lock:
+                return self._sync_library(media_changed, fp_changed)
+        finally:
+            self.rebuild_lock.release()
+
+    def _sync_library(self, media_changed, fp_changed):
+        self.unsaved = True
+        changed_rows, deleted = [], []
+        if media_changed:
+            with self.db.reader("dj_sync") as conn:
+                mark, count, rowsum = conn.execute(
+                    "SELECT MAX(updated_at), COUNT(*), COALESCE(SUM(rowid), 0) FROM media_file"
+                ).fetchone()
+                if mark != self.media_mark or self.media_mark is None:
+                    changed_rows = conn.execute(
+                        "SELECT rowid, id, path, artist, album, title FROM media_file WHERE updated_at >= ?",
+                        (self.media_mark or "",)
+                    ).fetchall()
+                # Nur neue Zeilen dazu? Dann passen Anzahl und rowid-Summe. "Einer neu, einer gelöscht"
+                # lässt die Anzahl gleich, nicht aber die Summe -> ID-Menge vergleichen.
+                new_rows = [r for r in changed_rows if r[1] not in self.metadata]
+                expected = (self.media_sum or 0) + sum(r[0] for r in new_rows)
+                if self.media_sum is None or count != len(self.metadata) + len(new_rows) or rowsum != expected:
+                    live_ids = {r[0] for r in conn.execute("SELECT id FROM media_file")}
+                    deleted = [sid for sid in self.metadata if sid not in live_ids]
+            self.media_mark, self.media_sum = mark, rowsum
+
+        entries = {}
+        for _, song_id, rel_path, artist, album, title in changed_rows:
+            self.metadata[song_id] = (artist, album, title)
+            self.dedup_keys[song_id] = self._song_key(artist, title)
+            full_path = os.path.normpath(os.path.join(MUSIC_DIR, rel_path))
+            if os.path.exists(full_path):
+                self.paths[song_id] = full_path
+                entries[song_id] = full_path
+
+        if fp_changed:
+            by_path = {p: sid for sid, p in self.paths.items()}
+            for path, group in self._load_fingerprint_groups(since=self.fp_mark).items():
+                sid = by_path.get(path)
+                if sid is None:
+                    continue
+                self.dedup_groups[sid] = group
+                entries[sid] = path
+
+        for sid in deleted:
+            for table in (self.metadata, self.dedup_keys, self.paths, self.dedup_groups, self.library):
+                table.pop(sid, None)
+
+        ann_aligned = self.ann.matches(self.emb_index)
+        compact_aligned = self.compact.matches(self.emb_index)
+        rows, realloc = self.emb_index.upsert(list(entries.items()), self._extract_for_index)
+        rows += self.emb_index.delete(deleted)
+        if not rows:
+            return 0
+        if ann_aligned:
+            self.ann.update_rows(self.emb_index, rows)
+        if compact_aligned:
+            self.compact.update_rows(self.emb_index, rows)
+
+        if realloc:
+            self.library = self.emb_index.vectors()
+        else:
+            for row in rows:
+                sid = self.emb_index.ids[row]
+                if sid is not None and self.emb_index.has_vec[row]:
+                    self.library[sid] = self.emb_index.matrix[row]
+                elif sid is not None:
+                    self.library.pop(sid, None)
+        self.dim_detected = self.emb_index.dim
+        logger.info(f"🔄 Delta-Sync: {len(rows) - len(deleted)} Songs aktualisiert, {len(deleted)} entfernt.")
+        return len(rows)
 
     # --------------------------------------------------
     # Blacklists / Ratings
     # --------------------------------------------------
 
     def get_user_blacklist_ids(self, user_id):
-        try:
-            with sqlite3.connect(DB_PATH) as conn:
-                rows = conn.execute("""
-                    SELECT pt.media_file_id
-                    FROM playlist_tracks pt
-                    JOIN playlist p ON pt.playlist_id = p.id
-                    WHERE p.name = ? AND p.owner_id = ?
-                """, (BLACKLIST_NAME, user_id)).fetchall()
-                return {str(r[0]) for r in rows}
-        except:
-            return set()
+        return self.exclusions.blacklist(user_id)
 
     def get_low_rated_ids(self, user_id):
-        try:
-            with sqlite3.connect(DB_PATH) as conn:
-                rows = conn.execute("""
-                    SELECT item_id FROM annotation
-                    WHERE user_id = ? AND rating BETWEEN 1 AND 2
-                """, (user_id,)).fetchall()
-                return {str(r[0]) for r in rows}
-        except:
-            return set()
+        return self.exclusions.low_rated(user_id)
 
     # --------------------------------------------------
     # Playlist Write
     # --------------------------------------------------
 
     def overwrite_playlist(self, user_id, name, song_ids):
-        try:
-            with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                cursor = conn.cursor()
-
-                cursor.execute(
-                    "SELECT id FROM playlist WHERE name = ? AND owner_id = ?",
-                    (name, user_id)
-                )
-                row = cursor.fetchone()
-
-                if row:
-                    pl_id = row[0]
-                else:
-                    pl_id = str(uuid.uuid4())
-                    now = datetime.now(timezone.utc).isoformat()
-                    cursor.execute("""
-                        INSERT INTO playlist (id, name, owner_id, public, created_at, updated_at)
-                        VALUES (?, ?, ?, 0, ?, ?)
-                    """, (pl_id, name, user_id, now, now))
-
-                cursor.execute("DELETE FROM playlist_tracks WHERE playlist_id = ?", (pl_id,))
-                data = [(str(uuid.uuid4()), pl_id, sid) for sid in song_ids]
-                cursor.executemany(
-                    "INSERT INTO playlist_tracks (id, playlist_id, media_file_id) VALUES (?, ?, ?)",
-                    data
-                )
-
-                cursor.execute(
-                    "UPDATE playlist SET song_count = ?, updated_at = ? WHERE id = ?",
-                    (len(song_ids), datetime.now(timezone.utc).isoformat(), pl_id)
-                )
-
-                conn.commit()
-                return pl_id
-        except:
-            return None
+        written, ids = self.writer.write(user_id, {name: song_ids})
+        return ids.get(name) if written is not None else None
 
     # --------------------------------------------------
-    # Daily Mood Processing (UNVERÄNDERT)
+    # Daily Mood Processing
     # --------------------------------------------------
 
     def process_daily_moods(self, user_id):
-        history = self._load_history()
-        user_history = history.get(str(user_id), {})
-
-        global_blacklist = self.get_user_blacklist_ids(user_id)
-        low_rated = self.get_low_rated_ids(user_id)
-
+        self.process_daily_moods_all([user_id])
+
+    def process_daily_moods_all(self, user_ids, workers=DAILY_WORKERS):
+        """
+        Daily Moods für mehrere User: Kandidaten (Zeilen pro Mood) werden einmal geteilt,
+        Ausschlüsse pro User als Bitmaske angewendet. User laufen parallel, die Playlists
+        gehen gesammelt durch die Schreib-Queue, der lokale Zustand wird nacheinander
+        aktualisiert (write_lock).
+        """
+        # Zeilen, IDs und Zeilennummern unter dem index_lock kopieren; der Rest läuft ohne Lock,
+        # damit Mix-Worker, Delta-Sync und Move-Journal nicht auf den ganzen Lauf warten
+        with self.index_lock:
+            candidates = {}
+            for mood in TARGET_MOODS:
+                rows = self.emb_index.mood_rows(mood)
+                if len(rows):
+                    candidates[mood] = rows
+            view = (list(self.emb_index.ids), dict(self.emb_index.row_of))
+        if not candidates or not user_ids:
+            return
+
+        def run(user_id):
+            try:
+                self._daily_moods_for_user(user_id, candidates, view)
+            except Exception as e:
+                logger.error(f"Daily-Mood Fehler bei {user_id}: {e}")
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(user_ids)))) as pool:
+            list(pool.map(run, user_ids))
+        self._export_mood_blacklist()
+
+    def _daily_moods_for_user(self, user_id, candidates, view):
+        rng = np.random.default_rng()
+        ids, row_of = view
+        user_history = self.state.load_history(user_id)
+        mood_blacklists = self.state.mood_blacklists(user_id)
+        existing = self.writer.read(user_id, [f"{cfg.MOOD_PREFIX} {m}" for m in candidates])
+        excluded = rows_mask(row_of, len(ids), self.exclusions.excluded(user_id))
+
+        blacklist_entries = []
         new_user_history = {}
+        new_playlists = {}
 
-        for mood in TARGET_MOODS:
+        for mood, rows in candidates.items():
             pl_name = f"{cfg.MOOD_PREFIX} {mood}"
-            candidate_ids = self.mood_library.get(mood, [])
-            if not candidate_ids:
-                continue
-
-            current_ids = set()
-            with sqlite3.connect(DB_PATH) as conn:
-                row = conn.execute(
-                    "SELECT id FROM playlist WHERE name = ? AND owner_id = ?",
-                    (pl_name, user_id)
-                ).fetchone()
-                if row:
-                    tracks = conn.execute(
-                        "SELECT media_file_id FROM playlist_tracks WHERE playlist_id = ?",
-                        (row[0],)
-                    ).fetchall()
-                    current_ids = {str(r[0]) for r in tracks}
+            current_ids = set(existing[pl_name][1]) if pl_name in existing else set()
 
+            mood_blacklist = mood_blacklists.setdefault(mood, set())
             if mood in user_history:
                 deleted = set(user_history[mood]) - current_ids
                 for did in deleted:
-                    self._append_to_mood_blacklist(user_id, mood, did)
-
-            mood_blacklist = self._get_mood_blacklist(user_id, mood)
+                    blacklist_entries.append((mood, did))
+                    mood_blacklist.add(did)
 
-            valid_pool = [
-                sid for sid in candidate_ids
-                if str(sid) not in global_blacklist
-                and str(sid) not in mood_blacklist
-                and str(sid) not in low_rated
-            ]
+            blocked = excluded | rows_mask(row_of, len(ids), mood_blacklist) if mood_blacklist else excluded
+            valid_pool = rows[~blocked[rows]]
+            if len(valid_pool) == 0:
+                continue
 
-            random.shuffle(valid_pool)
-            final_selection = valid_pool[:PLAYLIST_LIMIT]
+            picked = rng.choice(valid_pool, size=min(PLAYLIST_LIMIT, len(valid_pool)), replace=False)
+            final_selection = [ids[r] for r in picked]
+            new_playlists[pl_name] = final_selection
+            new_user_history[mood] = [str(s) for s in final_selection]
 
-            if final_selection:
-                self.overwrite_playlist(user_id, pl_name, final_selection)
-                new_user_history[mood] = [str(s) for s in final_selection]
+        # Alle Mood-Playlists des Users in einer Transaktion, nur geänderte Zeilen
+        written, _ = self.writer.write(user_id, new_playlists,
+                                       {name: pl[0] for name, pl in existing.items()})
+        if written is not None:
+            logger.info(f"💾 {len(new_playlists)} Mood-Playlists für {user_id} aktualisiert ({written} Zeilen geschrieben).")
 
-        history[str(user_id)] = new_user_history
-        self._save_history(history)
+        with self.write_lock:
+            self._append_to_mood_blacklist(user_id, blacklist_entries)
+            try:
+                self.state.save_history(user_id, new_user_history)
+            except Exception as e:
+                logger.error(f"History Save Error: {e}")
 
     # --------------------------------------------------
     # Similarity / Heart / Seed Mix (LEGACY – required)
@@ -359,105 +714,165 @@ class NavidromeDJ:
         parts = re.split(r"[,&]|\bfeat\b|\bft\b", artist, flags=re.IGNORECASE)
         return self.normalize_string(parts[0].strip())
 
+    def _song_key(self, artist, title):
+        if not artist or not title:
+            return None
+        return f"{self.normalize_artist(artist)}_{self.normalize_string(title)}"
+
+    def refresh_metadata(self, rows):
+        """
+        rows: (id, artist, album, title). Hält Metadaten und den normalisierten
+        Artist/Titel-Schlüssel im Speicher; Regex nur für neue oder geänderte Einträge.
+        """
+        self.metadata, self.dedup_keys, changed = self._build_metadata(rows)
+        return changed
+
+    def _build_metadata(self, rows):
+        metadata, keys = {}, {}
+        changed = 0
+        for sid, artist, album, title in rows:
+            meta = (artist, album, title)
+            if self.metadata.get(sid) == meta and sid in self.dedup_keys:
+                keys[sid] = self.dedup_keys[sid]
+            else:
+                keys[sid] = self._song_key(artist, title)
+                changed += 1
+            metadata[sid] = meta
+        return metadata, keys, changed
+
     def get_song_metadata(self, song_id):
+        meta = self.metadata.get(song_id)
+        if meta:
+            return meta[0], meta[2]
         try:
-            with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                return conn.execute(
+            with self.db.reader("dj_metadata") as conn:
+                row = conn.execute(
                     "SELECT artist, title FROM media_file WHERE id = ?",
                     (song_id,)
                 ).fetchone()
-        except:
+                return row if row else (None, None)
+        except Exception as e:
+            logger.error(f"Metadaten für {song_id} nicht lesbar: {e}")
             return None, None
 
-    def ensure_playlist(self, user_id, name):
-        try:
-            with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT id FROM playlist WHERE name = ? AND owner_id = ?",
-                    (name, user_id)
-                )
-                row = cursor.fetchone()
-                if row:
-                    return row[0]
-
-                pl_id = str(uuid.uuid4())
-                now = datetime.now(timezone.utc).isoformat()
-                cursor.execute("""
-                    INSERT INTO playlist (id, name, owner_id, public, created_at, updated_at)
-                    VALUES (?, ?, ?, 0, ?, ?)
-                """, (pl_id, name, user_id, now, now))
-                conn.commit()
-                return pl_id
-        except:
-            return None
+    def dedup_signatures(self, song_id):
+        """
+        Schlüssel, über die zwei Songs als gleiche Aufnahme gelten: Gruppe laut Audio-Fingerprint
+        und normalisierter Artist/Titel. Beide zählen, damit eine noch nicht gefingerprintete
+        Kopie nicht neben ihrer analysierten Schwester im Mix landet.
+        """
+        keys = []
+        group = self.dedup_groups.get(song_id)
+        if group:
+            keys.append(f"group:{group}")
+        if song_id in self.dedup_keys:
+            key = self.dedup_keys[song_id]
+        else:
+            key = self._song_key(*self.get_song_metadata(song_id))
+        if key:
+            keys.append(key)
+        return keys
+
+    def nearest(self, query, k, exclude):
+        """Top-k ähnlichste Songs; ANN für große Bibliotheken, kompakte Codes mit Re-Ranking, sonst exakt."""
+        if self.ann.enabled_for(self.emb_index) and len(self.ann.assign) == len(self.emb_index):
+            return self.ann.search(self.emb_index, query, k, exclude)
+        if self.compact.enabled_for(self.emb_index):
+            return self.compact.search(self.emb_index, query, k, exclude)
+        return self.emb_index.top_k(query, k, exclude=exclude)
+
+    def nearest_batch(self, queries, k, excludes):
+        """nearest für viele Anfragen als Matrix-Matrix-Produkt (exakt oder über die kompakten Codes)."""
+        if self.ann.enabled_for(self.emb_index) and len(self.ann.assign) == len(self.emb_index):
+            return [self.ann.search(self.emb_index, q, k, ex) for q, ex in zip(queries, excludes)]
+        if self.compact.enabled_for(self.emb_index):
+            return self.compact.search_batch(self.emb_index, queries, k, excludes)
+        return self.emb_index.top_k_batch(queries, k, excludes)
 
     def generate_mix(self, user_id, seed_id, mix_name, refill_id=None):
-        if seed_id not in self.library or len(self.library) < 2:
-            return False
-
-        seed_vec = self.library.get(seed_id)
-        if seed_vec is None:
-            return False
-
-        scores = []
-        for sid, vec in self.library.items():
-            if sid == seed_id:
+        """Baut den Mix und gibt die Anzahl geschriebener Tracks zurück (0 = nichts geschrieben)."""
+        return self.generate_mixes([(user_id, seed_id, mix_name, refill_id)])[0]
+
+    def generate_mixes(self, jobs):
+        """
+        Baut mehrere Mixe in einem Durchgang. jobs: Liste (user_id, seeds, mix_name, refill_id);
+        seeds ist eine Song-ID oder eine Liste von IDs (Geschmacks-Zentroid über alle Seeds).
+        Alle Ähnlichkeiten kommen aus einem Matrix-Matrix-Produkt, geschrieben wird eine
+        Transaktion pro User. Gibt pro Job die Anzahl geschriebener Tracks zurück.
+        """
+        with self.index_lock:
+            selections = self._select_mix_tracks_batch(jobs)
+
+        by_user = defaultdict(list)
+        for i, (user_id, _, _, _) in enumerate(jobs):
+            if selections[i]:
+                by_user[user_id].append(i)
+
+        # Alle User einreihen, bevor auf das Ergebnis gewartet wird: ein Batch der Schreib-Queue
+        futures = {}
+        for user_id, idxs in by_user.items():
+            playlists = {jobs[i][2]: selections[i] for i in idxs}
+            known = {jobs[i][2]: jobs[i][3] for i in idxs if jobs[i][3]}
+            futures[user_id] = self.writer.submit(user_id, playlists, known or None)
+
+        counts = [0] * len(jobs)
+        for user_id, idxs in by_user.items():
+            written, _ = self.writer.result(futures[user_id])
+            if written is None:
                 continue
-            dist = 1.0 - np.dot(seed_vec, vec)
-            scores.append((sid, dist))
-
-        scores.sort(key=lambda x: x[1])
-
-        candidate_ids = [seed_id] + [sid for sid, _ in scores[:PLAYLIST_LIMIT + 100]]
-
-        user_blacklist = self.get_user_blacklist_ids(user_id)
-        low_rated = self.get_low_rated_ids(user_id)
-
-        final_tracks = []
-        seen_fingerprints = set()
-
-        for sid in candidate_ids:
-            sid_str = str(sid)
-            if sid_str in user_blacklist or sid_str in low_rated:
+            for i in idxs:
+                counts[i] = len(selections[i])
+            names = ", ".join(f"'{jobs[i][2]}'" for i in idxs)
+            logger.info(f"💾 Mix {names} gespeichert ({sum(counts[i] for i in idxs)} Tracks, {written} Zeilen geschrieben).")
+        return counts
+
+    def _select_mix_tracks_batch(self, jobs):
+        selections = [[] for _ in jobs]
+        if len(self.library) < 2:
+            return selections
+
+        user_masks = {}
+        pending, queries, masks = [], [], []
+        for i, (user_id, seeds, _, _) in enumerate(jobs):
+            seeds = list(seeds) if isinstance(seeds, (list, tuple, set, frozenset)) else [seeds]
+            vecs = [self.library[s] for s in seeds if s in self.library]
+            if not vecs:
                 continue
 
-            artist, title = self.get_song_metadata(sid)
-            if artist and title:
-                fp = f"{self.normalize_artist(artist)}_{self.normalize_string(title)}"
-                if fp in seen_fingerprints:
+            # Ausschlüsse als Maske, einmal pro User; Seeds kommen pro Job dazu
+            if user_id not in user_masks:
+                excluded = self.exclusions.excluded(user_id)
+                user_masks[user_id] = (excluded, self.emb_index.exclude_mask(excluded))
+            excluded, mask = user_masks[user_id]
+            mask = mask | self.emb_index.id_mask(seeds)
+
+            query = np.mean(vecs, axis=0) if len(vecs) > 1 else vecs[0]
+            norm = np.linalg.norm(query)
+            pending.append((i, seeds, excluded))
+            queries.append(query / norm if norm > 0 else query)
+            masks.append(mask)
+
+        if not pending:
+            return selections
+        results = self.nearest_batch(np.asarray(queries, dtype=np.float32), PLAYLIST_LIMIT + 100, masks)
+
+        for (i, seeds, excluded), nearest in zip(pending, results):
+            # Einzel-Seed steht vorne im Mix, bei Zentroid-Mixen nur die ähnlichsten Songs
+            candidate_ids = [seeds[0]] if len(seeds) == 1 and str(seeds[0]) not in excluded else []
+            candidate_ids += [sid for sid, _ in nearest]
+
+            final_tracks = []
+            seen_fingerprints = set()
+
+            for sid in candidate_ids:
+                keys = self.dedup_signatures(sid)
+                if any(k in seen_fingerprints for k in keys):
                     continue
-                seen_fingerprints.add(fp)
-
-            final_tracks.append(sid)
-            if len(final_tracks) >= PLAYLIST_LIMIT:
-                break
+                seen_fingerprints.update(keys)
 
-        if not final_tracks:
-            return False
+                final_tracks.append(sid)
+                if len(final_tracks) >= PLAYLIST_LIMIT:
+                    break
+            selections[i] = final_tracks
 
-        pl_id = refill_id if refill_id else self.ensure_playlist(user_id, mix_name)
-        if not pl_id:
-            return False
-
-        try:
-            with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM playlist_tracks WHERE playlist_id = ?", (pl_id,))
-                data = [(str(uuid.uuid4()), pl_id, sid) for sid in final_tracks]
-                cursor.executemany(
-                    "INSERT INTO playlist_tracks (id, playlist_id, media_file_id) VALUES (?, ?, ?)",
-                    data
-                )
-                cursor.execute(
-                    "UPDATE playlist SET song_count = ?, updated_at = ? WHERE id = ?",
-                    (len(final_tracks), datetime.now(timezone.utc).isoformat(), pl_id)
-                )
-                conn.commit()
-
-            logger.info(f"💾 Mix '{mix_name}' gespeichert ({len(final_tracks)} Tracks).")
-            return True
-
-        except Exception as e:
-            logger.error(f"Mix-Speicherfehler: {e}")
-            return False
+        return selections
@@ -0,0 +1,217 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import csv
+import json
+import sqlite3
+import logging
+import argparse
+from datetime import datetime
+
+STATE_DB_PATH = os.getenv("ND_STATE_DB", "/data/dj_state.db")
+CSV_HEADER = ["user_id", "mood", "song_id", "artist", "album", "title", "timestamp"]
+
+logger = logging.getLogger("DJ_State")
+
+# --------------------------------------------------
+# Zustand des DJs (Mood-Blacklist + Mood-History)
+# --------------------------------------------------
+
+class StateStore:
+    """
+    Mood-Blacklist und Mood-History in SQLite statt CSV/JSON. Der Primärschlüssel
+    (user_id, mood, song_id) dient zugleich als Index für die Abfrage pro User und Mood.
+    Die CSV bleibt als menschenlesbarer Export erhalten (export_csv).
+    """
+
+    def __init__(self, db_path=STATE_DB_PATH):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS mood_blacklist (
+                    user_id TEXT NOT NULL,
+                    mood TEXT NOT NULL,
+                    song_id TEXT NOT NULL,
+                    artist TEXT,
+                    album TEXT,
+                    title TEXT,
+                    timestamp TEXT,
+                    PRIMARY KEY (user_id, mood, song_id)
+                );
+                CREATE TABLE IF NOT EXISTS mood_history (
+                    user_id TEXT NOT NULL,
+                    mood TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    song_id TEXT NOT NULL,
+                    PRIMARY KEY (user_id, mood, position)
+                );
+                CREATE TABLE IF NOT EXISTS state_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    # --------------------------------------------------
+    # Mood-Blacklist
+    # --------------------------------------------------
+
+    def mood_blacklists(self, user_id):
+        """{mood: {song_id}} für einen User (eine Abfrage für alle Moods)."""
+        result = {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT mood, song_id FROM mood_blacklist WHERE user_id = ?", (str(user_id),)
+            ).fetchall()
+        for mood, song_id in rows:
+            result.setdefault(mood, set()).add(song_id)
+        return result
+
+    def mood_blacklist(self, user_id, mood):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT song_id FROM mood_blacklist WHERE user_id = ? AND mood = ?", (str(user_id), mood)
+            ).fetchall()
+        return {r[0] for r in rows}
+
+    def add_to_mood_blacklist(self, rows):
+        """rows: (user_id, mood, song_id, artist, album, title). Eine Transaktion für alle."""
+        if not rows:
+            return 0
+        now = datetime.now().isoformat()
+        with self._connect() as conn:
+            cur = conn.executemany("""
+                INSERT OR IGNORE INTO mood_blacklist (user_id, mood, song_id, artist, album, title, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [(str(u), m, str(s), a, al, t, now) for u, m, s, a, al, t in rows])
+            return cur.rowcount
+
+    # --------------------------------------------------
+    # Mood-History
+    # --------------------------------------------------
+
+    def load_history(self, user_id):
+        """{mood: [song_id, ...]} in Playlist-Reihenfolge."""
+        history = {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT mood, song_id FROM mood_history WHERE user_id = ? ORDER BY mood, position",
+                (str(user_id),)
+            ).fetchall()
+        for mood, song_id in rows:
+            history.setdefault(mood, []).append(song_id)
+        return history
+
+    def save_history(self, user_id, history):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM mood_history WHERE user_id = ?", (str(user_id),))
+            conn.executemany(
+                "INSERT INTO mood_history (user_id, mood, position, song_id) VALUES (?, ?, ?, ?)",
+                [(str(user_id), mood, pos, str(sid))
+                 for mood, ids in history.items() for pos, sid in enumerate(ids)]
+            )
+
+    # --------------------------------------------------
+    # ID-Umschreibung (Hausmeister-Moves)
+    # --------------------------------------------------
+
+    def remap_song_ids(self, mapping):
+        if not mapping:
+            return 0
+        pairs = [(new, old) for old, new in mapping.items()]
+        with self._connect() as conn:
+            n = conn.executemany("UPDATE OR REPLACE mood_blacklist SET song_id = ? WHERE song_id = ?", pairs).rowcount
+            n += conn.executemany("UPDATE mood_history SET song_id = ? WHERE song_id = ?", pairs).rowcount
+        return n
+
+    # --------------------------------------------------
+    # Import (einmalig) / Export (CSV)
+    # --------------------------------------------------
+
+    def import_legacy(self, csv_path, history_path):
+        """Übernimmt die alte mood_blacklist.csv und mood_history.json genau einmal."""
+        with self._connect() as conn:
+            if conn.execute("SELECT 1 FROM state_meta WHERE key = 'legacy_imported'").fetchone():
+                return False
+
+        blacklist_rows = []
+        if os.path.exists(csv_path):
+            try:
+                with open(csv_path, "r", encoding="utf-8") as f:
+                    reader = csv.reader(f)
+                    next(reader, None)
+                    for row in reader:
+                        if len(row) >= 3:
+                            row = (row + [""] * len(CSV_HEADER))[:len(CSV_HEADER)]
+                            blacklist_rows.append(tuple(row))
+            except Exception as e:
+                logger.error(f"Import der Mood-Blacklist fehlgeschlagen: {e}")
+                return False
+
+        history = {}
+        if os.path.exists(history_path):
+            try:
+                with open(history_path, "r") as f:
+                    history = json.load(f)
+            except Exception as e:
+                logger.error(f"Import der Mood-History fehlgeschlagen: {e}")
+                return False
+
+        with self._connect() as conn:
+            conn.executemany("""
+                INSERT OR IGNORE INTO mood_blacklist (user_id, mood, song_id, artist, album, title, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, blacklist_rows)
+            conn.executemany(
+                "INSERT OR REPLACE INTO mood_history (user_id, mood, position, song_id) VALUES (?, ?, ?, ?)",
+                [(str(uid), mood, pos, str(sid))
+                 for uid, moods in history.items() for mood, ids in moods.items() for pos, sid in enumerate(ids)]
+            )
+            conn.execute("INSERT OR REPLACE INTO state_meta (key, value) VALUES ('legacy_imported', ?)",
+                         (datetime.now().isoformat(),))
+
+        if os.path.exists(history_path):
+            os.replace(history_path, history_path + ".imported")
+        logger.info(f"📥 Alter DJ-Zustand importiert: {len(blacklist_rows)} Blacklist-Einträge, {len(history)} User-Historien.")
+        return True
+
+    def export_csv(self, csv_path):
+        """Schreibt die komplette Mood-Blacklist als CSV (atomar ersetzt)."""
+        try:
+            with self._connect() as conn:
+                rows = conn.execute("""
+                    SELECT user_id, mood, song_id, artist, album, title, timestamp
+                    FROM mood_blacklist ORDER BY timestamp, user_id, mood
+                """).fetchall()
+            tmp = csv_path + ".tmp"
+            with open(tmp, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(CSV_HEADER)
+                writer.writerows(rows)
+            os.replace(tmp, csv_path)
+            return len(rows)
+        except Exception as e:
+            logger.error(f"Mood-Blacklist Export Fehler: {e}")
+            return None
+
+# ==========================================
+# CLI
+# ==========================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DJ-Zustand importieren/exportieren")
+    parser.add_argument("--db", default=STATE_DB_PATH)
+    parser.add_argument("--import-csv", help="Alte mood_blacklist.csv übernehmen")
+    parser.add_argument("--import-history", default="", help="Alte mood_history.json übernehmen")
+    parser.add_argument("--export-csv", help="Mood-Blacklist als CSV schreiben")
+    args = parser.parse_args()
+
+    store = StateStore(args.db)
+    if args.import_csv or args.import_history:
+        print("Importiert." if store.import_legacy(args.import_csv or "", args.import_history) else "Bereits importiert.")
+    if args.export_csv:
+        print(f"{store.export_csv(args.export_csv)} Einträge exportiert.")
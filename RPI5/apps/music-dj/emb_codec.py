@@ -0,0 +1,280 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import time
+import logging
+import numpy as np
+
+from dj_index import INDEX_DIR, BATCH_SCORE_CELLS
+
+EMB_CODEC = os.getenv("ND_EMB_CODEC", "off")                # off | float16 | int8
+EMB_RERANK = int(os.getenv("ND_EMB_RERANK", "4"))          # Kandidaten = k * Faktor, exakt nachsortiert
+CODECS = ("float16", "int8")
+CHUNK_ROWS = 8192
+
+logger = logging.getLogger("DJ_Codec")
+
+# --------------------------------------------------
+# Kompakte Embeddings (float16 / int8) mit exaktem Re-Ranking
+# --------------------------------------------------
+
+class CompactIndex:
+    """
+    Hält eine komprimierte Kopie der Embedding-Matrix im Speicher (float16: halbe Größe,
+    int8 mit Skalierung pro Dimension: ein Viertel). Die Grobsuche läuft über die Kopie
+    (Anfrage bleibt float32, asymmetrisch), die besten k * rerank Kandidaten werden mit den
+    exakten Zeilen aus der gemappten float32-Matrix nachsortiert. Von der Matrix werden so
+    nur die Seiten der Kandidaten gelesen.
+    """
+
+    def __init__(self, path=None, codec=EMB_CODEC, rerank=EMB_RERANK):
+        self.path = path or os.path.join(INDEX_DIR, "codes.npz")
+        self.codec = codec
+        self.rerank = max(1, rerank)
+        self.codes = None
+        self.scale = None
+        self.generation = None
+
+    @property
+    def trained(self):
+        return self.codes is not None
+
+    def enabled_for(self, emb_index):
+        return self.codec in CODECS and self.trained and len(self.codes) == len(emb_index)
+
+    # --------------------------------------------------
+    # Laden / Speichern
+    # --------------------------------------------------
+
+    def load(self):
+        if self.codec not in CODECS:
+            return False
+        try:
+            with np.load(self.path) as data:
+                if str(data["codec"]) != self.codec:
+                    logger.info("Codec geändert -> kompakte Embeddings werden neu aufgebaut.")
+                    return False
+                self.codes = data["codes"]
+                self.scale = data["scale"]
+                self.generation = int(data["generation"]) if "generation" in data.files else None
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"Codec-Ladefehler: {e}")
+            self.codes = None
+            return False
+
+    def save(self):
+        if not self.trained:
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp.npz"
+            np.savez(tmp, codes=self.codes, scale=self.scale, codec=self.codec,
+                     generation=self.generation)
+            os.replace(tmp, self.path)
+            return True
+        except Exception as e:
+            logger.error(f"Codec-Speicherfehler: {e}")
+            return False
+
+    # --------------------------------------------------
+    # Kodieren
+    # --------------------------------------------------
+
+    def _encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.codec == "float16":
+            return vectors.astype(np.float16)
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def _encode_rows(self, matrix, rows):
+        for start in range(0, len(rows), CHUNK_ROWS):
+            chunk = rows[start:start + CHUNK_ROWS]
+            self.codes[chunk] = self._encode(matrix[chunk])
+
+    def _fit_scale(self, emb_index, valid):
+        dim = emb_index.dim
+        if self.codec == "float16":
+            return np.ones(dim, dtype=np.float32)
+        peak = np.zeros(dim, dtype=np.float32)
+        for start in range(0, len(valid), CHUNK_ROWS):
+            chunk = valid[start:start + CHUNK_ROWS]
+            peak = np.maximum(peak, np.abs(emb_index.matrix[chunk]).max(axis=0))
+        return (np.maximum(peak, 1e-6) / 127).astype(np.float32)
+
+    def build(self, emb_index):
+        if self.codec not in CODECS or emb_index.dim is None:
+            self.codes = None
+            return False
+        valid = np.nonzero(emb_index.has_vec)[0]
+        self.scale = self._fit_scale(emb_index, valid)
+        dtype = np.float16 if self.codec == "float16" else np.int8
+        self.codes = np.zeros((len(emb_index), emb_index.dim), dtype=dtype)
+        self._encode_rows(emb_index.matrix, valid)
+        self.generation = emb_index.generation
+        self.report(emb_index)
+        return True
+
+    def sync(self, emb_index, aligned=True):
+        """
+        Nach einem Refresh: übernommene Zeilen behalten ihren Code, nur neue werden kodiert.
+        Die int8-Skalierung bleibt dabei fest (Ausreißer werden abgeschnitten), neu angepasst
+        wird sie beim vollständigen Aufbau.
+        """
+        if self.codec not in CODECS:
+            return False
+        if not self.trained or not aligned or emb_index.dim is None or self.codes.shape[1] != emb_index.dim:
+            return self.build(emb_index)
+
+        old_codes = self.codes
+        self.codes = np.zeros((len(emb_index), emb_index.dim), dtype=old_codes.dtype)
+        dst, src = emb_index.last_reuse
+        if len(dst):
+            self.codes[dst] = old_codes[src]
+        reused = np.zeros(len(emb_index), dtype=bool)
+        reused[dst] = True
+        missing = np.nonzero(emb_index.has_vec & ~reused)[0]
+        self._encode_rows(emb_index.matrix, missing)
+
+        changed = len(missing) > 0 or len(old_codes) != len(self.codes) or not np.array_equal(dst, src) \
+            or self.generation != emb_index.generation
+        self.generation = emb_index.generation
+        return changed
+
+    def update_rows(self, emb_index, rows):
+        """Delta-Update: geänderte/neue/gelöschte Zeilen neu kodieren."""
+        if not self.trained:
+            return False
+        n = len(emb_index)
+        if len(self.codes) < n:
+            grow = np.zeros((n - len(self.codes), self.codes.shape[1]), dtype=self.codes.dtype)
+            self.codes = np.concatenate([self.codes, grow])
+        rows = np.asarray(rows, dtype=np.int64)
+        self.codes[rows] = 0
+        self._encode_rows(emb_index.matrix, rows[emb_index.has_vec[rows]])
+        self.generation = emb_index.generation
+        return True
+
+    def matches(self, emb_index):
+        return self.trained and len(self.codes) == len(emb_index) and self.generation == emb_index.generation
+
+    # --------------------------------------------------
+    # Suche
+    # --------------------------------------------------
+
+    def approx_scores(self, query):
+        """Skalarprodukt Anfrage (float32) x Codes, blockweise ohne vollständige float32-Kopie."""
+        q = np.asarray(query, dtype=np.float32) * self.scale
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), CHUNK_ROWS):
+            scores[start:start + CHUNK_ROWS] = self.codes[start:start + CHUNK_ROWS].astype(np.float32) @ q
+        return scores
+
+    def search(self, emb_index, query, k, exclude, rerank=None):
+        """Gleiche Ausgabe wie EmbeddingIndex.top_k: Liste (song_id, score) mit exakten Scores."""
+        query = np.asarray(query, dtype=np.float32)
+        scores = self.approx_scores(query)
+        return self._rerank(emb_index, query, scores, k, exclude, rerank)
+
+    def search_batch(self, emb_index, queries, k, excludes, rerank=None):
+        """search für viele Anfragen: Grobsuche als ein Produkt Codes x Anfragen pro Block."""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.codes.shape[1])
+        results = []
+        step = max(1, BATCH_SCORE_CELLS // max(1, len(self.codes)))
+        for start in range(0, len(queries), step):
+            batch = queries[start:start + step]
+            scaled = (batch * self.scale).T
+            scores = np.empty((len(self.codes), len(batch)), dtype=np.float32)
+            for row in range(0, len(self.codes), CHUNK_ROWS):
+                scores[row:row + CHUNK_ROWS] = self.codes[row:row + CHUNK_ROWS].astype(np.float32) @ scaled
+            for j, query in enumerate(batch):
+                results.append(self._rerank(emb_index, query, scores[:, j].copy(), k, excludes[start + j], rerank))
+        return results
+
+    def _rerank(self, emb_index, query, scores, k, exclude, rerank):
+        scores[exclude] = -np.inf
+        n_cands = min(k * (rerank or self.rerank), int((~exclude).sum()))
+        if k <= 0 or n_cands <= 0:
+            return []
+
+        cands = np.sort(np.argpartition(-scores, n_cands - 1)[:n_cands])
+        exact = np.asarray(emb_index.matrix[cands]) @ query
+        k = min(k, len(cands))
+        top = np.argpartition(-exact, k - 1)[:k]
+        top = top[np.argsort(-exact[top], kind="stable")]
+        return [(emb_index.ids[cands[i]], float(exact[i])) for i in top]
+
+    # --------------------------------------------------
+    # Auswertung (Speicher + Recall)
+    # --------------------------------------------------
+
+    def memory(self, emb_index):
+        full = len(emb_index) * (emb_index.dim or 0) * 4
+        compact = self.codes.nbytes + self.scale.nbytes if self.trained else 0
+        return {"codec": self.codec, "compact_mb": compact / 2 ** 20, "float32_mb": full / 2 ** 20,
+                "ratio": compact / full if full else 0.0}
+
+    def evaluate(self, emb_index, k=30, n_queries=50, rerank=None, seed=0):
+        """Recall@k gegenüber exakter Suche, mit und ohne Re-Ranking, plus mittlere Latenz."""
+        valid = np.nonzero(emb_index.has_vec)[0]
+        if not self.trained or len(valid) == 0:
+            return None
+        rng = np.random.default_rng(seed)
+        queries = rng.choice(valid, min(n_queries, len(valid)), replace=False)
+        hits = hits_raw = total = 0
+        t_compact = t_exact = 0.0
+        for row in queries:
+            q = np.asarray(emb_index.matrix[row], dtype=np.float32)
+            exclude = emb_index.exclude_mask([emb_index.ids[row]])
+            t0 = time.perf_counter()
+            exact = {sid for sid, _ in emb_index.top_k(q, k, exclude=exclude)}
+            t1 = time.perf_counter()
+            approx = {sid for sid, _ in self.search(emb_index, q, k, exclude, rerank=rerank)}
+            t2 = time.perf_counter()
+            raw = {sid for sid, _ in self.search(emb_index, q, k, exclude, rerank=1)}
+            hits += len(exact & approx)
+            hits_raw += len(exact & raw)
+            total += len(exact)
+            t_exact += t1 - t0
+            t_compact += t2 - t1
+        n = len(queries)
+        result = self.memory(emb_index)
+        result.update({"recall": hits / max(1, total), "recall_no_rerank": hits_raw / max(1, total),
+                       "compact_ms": 1000 * t_compact / n, "exact_ms": 1000 * t_exact / n,
+                       "rerank": rerank or self.rerank, "k": k})
+        return result
+
+    def report(self, emb_index, k=30, n_queries=20):
+        stats = self.evaluate(emb_index, k=k, n_queries=n_queries)
+        if stats:
+            logger.info(f"🗜️ Embeddings {self.codec}: {stats['compact_mb']:.1f} MB statt {stats['float32_mb']:.1f} MB, "
+                        f"Recall@{k} {stats['recall']:.3f} (ohne Re-Ranking {stats['recall_no_rerank']:.3f}).")
+        return stats
+
+# --------------------------------------------------
+# CLI: Speicherbedarf und Recall aller Codecs vergleichen
+# --------------------------------------------------
+
+if __name__ == "__main__":
+    import json
+    import argparse
+    from dj_index import EmbeddingIndex
+
+    parser = argparse.ArgumentParser(description="Kompakte Embeddings auswerten")
+    parser.add_argument("-k", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--rerank", type=int, default=EMB_RERANK)
+    args = parser.parse_args()
+
+    with open(os.path.join(INDEX_DIR, "meta.json"), "r") as f:
+        index = EmbeddingIndex(json.load(f)["moods"])
+    if not index.load():
+        raise SystemExit("Kein gespeicherter Index gefunden.")
+    for codec in CODECS:
+        compact = CompactIndex(path=os.devnull, codec=codec, rerank=args.rerank)
+        compact.build(index)
+        print(codec, compact.evaluate(index, k=args.k, n_queries=args.queries))
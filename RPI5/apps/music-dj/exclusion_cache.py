@@ -0,0 +1,139 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import threading
+import logging
+
+logger = logging.getLogger("DJ_Exclusions")
+
+# --------------------------------------------------
+# Ausschluss-Cache (Blacklist + schlecht bewertete Songs pro User)
+# --------------------------------------------------
+
+class ExclusionCache:
+    """
+    Hält pro User die Blacklist-IDs und die mit 1-2 Sternen bewerteten IDs im Speicher.
+    Stufe 1: PRAGMA data_version auf einer offenen Verbindung - unverändert heißt, niemand
+    hat seit der letzten Prüfung committet (auch nicht über das WAL), kein weiteres SQL.
+    Stufe 2: Hat sich die DB geändert (Play-Counts etc.), entscheiden gezielte Wasserstände
+    (Blacklist-Playlist updated_at/Anzahl, MAX(rated_at)/Anzahl), ob wirklich neu geladen wird.
+    """
+
+    def __init__(self, db, blacklist_name):
+        self.db = db                        # db_access.ConnectionManager
+        self.blacklist_name = blacklist_name
+        self._conn = None
+        self._generation = None
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.reloads = 0
+
+    def _connect(self):
+        # Eigene Verbindung: data_version ist nur innerhalb derselben Verbindung vergleichbar
+        generation = self.db.check()
+        if self._conn is not None and generation != self._generation:
+            self._drop_connection()
+            self._entries.clear()
+        if self._conn is None:
+            self._conn = self.db.open_reader("exclusions")
+            self._generation = generation
+        return self._conn
+
+    def _drop_connection(self):
+        try:
+            if self._conn is not None:
+                self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    # --------------------------------------------------
+    # Wasserstände / Laden
+    # --------------------------------------------------
+
+    def _blacklist_mark(self, conn, user_id):
+        return conn.execute("""
+            SELECT p.id, p.updated_at,
+                   (SELECT COUNT(*) FROM playlist_tracks pt WHERE pt.playlist_id = p.id)
+            FROM playlist p WHERE p.name = ? AND p.owner_id = ?
+        """, (self.blacklist_name, user_id)).fetchall()
+
+    def _low_rated_mark(self, conn, user_id):
+        return conn.execute("""
+            SELECT MAX(rated_at), COUNT(*) FROM annotation
+            WHERE user_id = ? AND rating BETWEEN 1 AND 2
+        """, (user_id,)).fetchone()
+
+    def _load_blacklist(self, conn, user_id):
+        rows = conn.execute("""
+            SELECT pt.media_file_id
+            FROM playlist_tracks pt
+            JOIN playlist p ON pt.playlist_id = p.id
+            WHERE p.name = ? AND p.owner_id = ?
+        """, (self.blacklist_name, user_id)).fetchall()
+        return frozenset(str(r[0]) for r in rows)
+
+    def _load_low_rated(self, conn, user_id):
+        rows = conn.execute("""
+            SELECT item_id FROM annotation
+            WHERE user_id = ? AND rating BETWEEN 1 AND 2
+        """, (user_id,)).fetchall()
+        return frozenset(str(r[0]) for r in rows)
+
+    def _entry(self, user_id):
+        with self._lock:
+            try:
+                conn = self._connect()
+                version = conn.execute("PRAGMA data_version").fetchone()[0]
+                entry = self._entries.get(user_id)
+                if entry and entry["version"] == version:
+                    return entry
+
+                bl_mark = self._blacklist_mark(conn, user_id)
+                lr_mark = self._low_rated_mark(conn, user_id)
+                if entry is None:
+                    entry = {"bl_mark": None, "lr_mark": None}
+                if entry["bl_mark"] != bl_mark:
+                    entry["blacklist"] = self._load_blacklist(conn, user_id)
+                    entry["bl_mark"] = bl_mark
+                    entry["excluded"] = None
+                    self.reloads += 1
+                if entry["lr_mark"] != lr_mark:
+                    entry["low_rated"] = self._load_low_rated(conn, user_id)
+                    entry["lr_mark"] = lr_mark
+                    entry["excluded"] = None
+                    self.reloads += 1
+                if entry["excluded"] is None:
+                    entry["excluded"] = entry["blacklist"] | entry["low_rated"]
+                entry["version"] = version
+                self._entries[user_id] = entry
+                return entry
+            except Exception as e:
+                logger.error(f"Ausschluss-Cache Fehler: {e}")
+                self._drop_connection()
+                return None
+
+    # --------------------------------------------------
+    # Abfragen (frozensets, nicht verändern)
+    # --------------------------------------------------
+
+    def blacklist(self, user_id):
+        entry = self._entry(user_id)
+        return entry["blacklist"] if entry else frozenset()
+
+    def low_rated(self, user_id):
+        entry = self._entry(user_id)
+        return entry["low_rated"] if entry else frozenset()
+
+    def excluded(self, user_id):
+        """Blacklist und schlecht bewertete Songs zusammen."""
+        entry = self._entry(user_id)
+        return entry["excluded"] if entry else frozenset()
@@ -0,0 +1,126 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import time
+import heapq
+import itertools
+import threading
+import logging
+
+MIX_WORKERS = int(os.getenv("ND_MIX_WORKERS", "2"))
+MIX_BATCH = int(os.getenv("ND_MIX_BATCH", "32"))       # Jobs pro Durchgang (ein Matrix-Matrix-Produkt)
+BACKOFF_BASE = 300          # Sekunden bis zum ersten erneuten Versuch eines unvollständigen Mixes
+BACKOFF_MAX = 6 * 3600
+
+PRIORITY_NEW = 0            # Neues Herz: noch keine Playlist
+PRIORITY_REFILL = 1         # Bestehende Playlist auffüllen/bereinigen
+
+logger = logging.getLogger("MixQueue")
+
+# --------------------------------------------------
+# Job-Queue für Mix-Generierung
+# --------------------------------------------------
+
+class MixJobQueue:
+    """
+    Mixe werden im Hintergrund gebaut, der Monitor reiht nur ein. Gleiche (user, seed)-Jobs
+    werden zusammengefasst, neue Herzen laufen vor Refills. Liefert ein Job weniger als
+    min_tracks (z.B. kleine Bibliothek), wird derselbe Mix erst nach exponentiellem Backoff
+    erneut angenommen. Ein Worker nimmt bis zu batch_size Jobs auf einmal.
+    """
+
+    def __init__(self, handler, min_tracks, workers=MIX_WORKERS, batch_size=MIX_BATCH):
+        self.handler = handler              # handler([job, ...]) -> [Anzahl geschriebener Tracks, ...]
+        self.min_tracks = min_tracks
+        self.batch_size = max(1, batch_size)
+        self._cond = threading.Condition()
+        self._heap = []
+        self._jobs = {}
+        self._running = set()
+        self._failures = {}
+        self._seq = itertools.count()
+        self._stopped = False
+        self.completed = 0
+        self._threads = [threading.Thread(target=self._worker, name=f"mix-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, user_id, seed_id, name, refill_id=None):
+        """True, wenn ein neuer Job angelegt wurde (False: zusammengefasst, läuft schon oder Backoff)."""
+        key = (user_id, seed_id)
+        priority = PRIORITY_NEW if refill_id is None else PRIORITY_REFILL
+        with self._cond:
+            if key in self._running:
+                return False
+            failure = self._failures.get(key)
+            if failure and time.time() < failure[1]:
+                return False
+
+            job = self._jobs.get(key)
+            if job is not None:
+                job.update(name=name, refill_id=refill_id or job["refill_id"])
+                if priority < job["priority"]:
+                    job["priority"], job["seq"] = priority, next(self._seq)
+                    heapq.heappush(self._heap, (priority, job["seq"], key))
+                return False
+
+            job = {"user_id": user_id, "seed_id": seed_id, "name": name, "refill_id": refill_id,
+                   "priority": priority, "seq": next(self._seq)}
+            self._jobs[key] = job
+            heapq.heappush(self._heap, (priority, job["seq"], key))
+            self._cond.notify()
+            return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._jobs) + len(self._running)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _next_jobs(self):
+        with self._cond:
+            jobs = []
+            while not jobs:
+                while not self._heap and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return None
+                while self._heap and len(jobs) < self.batch_size:
+                    _, seq, key = heapq.heappop(self._heap)
+                    job = self._jobs.get(key)
+                    if job is None or job["seq"] != seq:
+                        continue  # veralteter Heap-Eintrag (Priorität wurde angehoben)
+                    del self._jobs[key]
+                    self._running.add(key)
+                    jobs.append(job)
+            return jobs
+
+    def _worker(self):
+        while True:
+            jobs = self._next_jobs()
+            if jobs is None:
+                return
+            try:
+                results = self.handler(jobs) or [0] * len(jobs)
+            except Exception as e:
+                logger.error(f"Mix-Job Fehler ({len(jobs)} Jobs, u.a. {jobs[0]['name']}): {e}")
+                results = [0] * len(jobs)
+
+            with self._cond:
+                for job, tracks in zip(jobs, results):
+                    key = (job["user_id"], job["seed_id"])
+                    self._running.discard(key)
+                    self.completed += 1
+                    if tracks >= self.min_tracks:
+                        self._failures.pop(key, None)
+                    else:
+                        count = self._failures.get(key, (0, 0))[0] + 1
+                        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (count - 1))
+                        self._failures[key] = (count, time.time() + delay)
+                        logger.info(f"⏳ Mix '{job['name']}' unvollständig ({tracks} Tracks), nächster Versuch in {delay // 60} min.")
@@ -3,19 +3,25 @@
 # Licensed under the GNU General Public License v3.0
 import os
 import time
-import sqlite3
 import logging
 import signal
 import sys
-from datetime import datetime, timedelta, date
-from dj_loop import NavidromeDJ, TARGET_MOODS
+import threading
+from collections import defaultdict
+from datetime import datetime, date
+from dj_loop import NavidromeDJ, TARGET_MOODS, BLACKLIST_NAME, PLAYLIST_LIMIT
+from exclusion_cache import ExclusionCache
+from change_detector import ChangeDetector
+from rating_engine import RatingEngine
+from mix_queue import MixJobQueue
+from db_access import ConnectionManager, operation, STATS
+from write_queue import WriteQueue
 
 # Konfiguration
 DB_PATH = os.getenv("ND_DB_PATH", "/data/navidrome.db")
-CHECK_INTERVAL = 20
+CHECK_INTERVAL = 3      # Leerlauf kostet nur ein stat(), daher kurz
 RATING_STAGES = [(35, 4, 5), (15, 3, 4), (5, 0, 3)]
 LOCK_DAYS = 1095
-COOLDOWN_MINUTES = 1
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - [MONITOR] - %(message)s', stream=sys.stdout)
 logger = logging.getLogger("PlaylistMonitor")
@@ -23,8 +29,14 @@ logger = logging.getLogger("PlaylistMonitor")
 class PlaylistMonitor:
     def __init__(self):
         self.dj = None
+        self.db = ConnectionManager(DB_PATH)
+        self.exclusions = ExclusionCache(self.db, BLACKLIST_NAME)
+        self.changes = ChangeDetector(self.db)
+        self.writes = WriteQueue(self.db)
+        self.ratings = RatingEngine(self.writes, RATING_STAGES, LOCK_DAYS)
+        self.users = []
         self.running = True
-        self.cooldowns = {}
+        self.mixes = MixJobQueue(self._run_mix_jobs, PLAYLIST_LIMIT)
         self.last_mood_gen_date = None
 
         signal.signal(signal.SIGINT, self.shutdown)
@@ -33,17 +45,24 @@ class PlaylistMonitor:
     def shutdown(self, signum, frame):
         logger.info("Fahre Monitor sauber herunter...")
         self.running = False
+        self.mixes.stop()
+        self.writes.stop()
 
     def get_all_users(self):
         try:
-            with sqlite3.connect(DB_PATH, timeout=10) as conn:
+            with self.db.reader("monitor_users") as conn:
                 return conn.execute("SELECT id, user_name FROM user").fetchall()
-        except: return []
+        except Exception as e:
+            logger.error(f"User-Liste nicht lesbar: {e}")
+            return []
 
     def ensure_dj_initialized(self):
         if not self.dj:
-            self.dj = NavidromeDJ()
-            if self.dj.create_safe_snapshot():
+            self.dj = NavidromeDJ(exclusions=self.exclusions, db=self.db, writes=self.writes)
+            if self.dj.warm_start():
+                # Sofort einsatzbereit, Snapshot + voller Index-Abgleich laufen nebenher
+                self.dj.reconcile_in_background()
+            elif self.dj.create_safe_snapshot():
                 self.dj.index_library()
 
     def check_startup_missing_playlists(self):
@@ -52,112 +71,120 @@ class PlaylistMonitor:
         self.ensure_dj_initialized()
 
         users = self.get_all_users()
+        missing_users = []
         for uid, uname in users:
             try:
-                with sqlite3.connect(DB_PATH, timeout=10) as conn:
+                with self.db.reader("monitor_startup") as conn:
                     rows = conn.execute("SELECT name FROM playlist WHERE owner_id = ?", (uid,)).fetchall()
                     existing_names = {r[0] for r in rows}
 
-                missing_found = False
                 for mood in TARGET_MOODS:
                     target_name = f"Mood: {mood}"
                     if target_name not in existing_names:
                         logger.info(f"⚠️ {uname}: Playlist '{target_name}' fehlt. Starte Sofort-Generierung.")
-                        missing_found = True
+                        missing_users.append(uid)
                         break
 
-                if missing_found:
-                    self.dj.process_daily_moods(uid)
-                    self.last_mood_gen_date = date.today()
-
             except Exception as e:
                 logger.error(f"Startup-Check Fehler bei {uname}: {e}")
 
+        if missing_users:
+            self.start_daily_moods(missing_users)
+
+    def start_daily_moods(self, user_ids, done=None):
+        """
+        Daily Moods für user_ids. Läuft nach einem Warmstart noch der Abgleich, im eigenen Thread,
+        damit die Schleife (Ratings, Mixe, Delta-Sync) weiterläuft; sonst direkt.
+        """
+        if self.dj.reconciling():
+            threading.Thread(target=self._daily_moods_in_background, args=(user_ids, done),
+                             name="dj-startup-moods", daemon=True).start()
+        else:
+            self._daily_moods(user_ids, done)
+        self.last_mood_gen_date = date.today()
+
+    def _daily_moods(self, user_ids, done=None):
+        with operation("daily_moods"):
+            self.dj.process_daily_moods_all(user_ids)
+        if done:
+            logger.info(done)
+
+    def _daily_moods_in_background(self, user_ids, done=None):
+        try:
+            self._daily_moods(user_ids, done)
+        except Exception as e:
+            logger.error(f"Daily Moods im Hintergrund fehlgeschlagen: {e}")
+
     def check_daily_schedule(self):
         now = datetime.now()
         if now.hour >= 4 and self.last_mood_gen_date != date.today():
             logger.info("🕓 Es ist 4 Uhr durch - Zeit für die Daily Moods!")
             self.ensure_dj_initialized()
 
-            if time.time() - self.dj.last_index_time > 86000:
+            if time.time() - self.dj.last_index_time > 86000 and not self.dj.reconciling():
                 if self.dj.create_safe_snapshot():
                     self.dj.index_library()
 
             users = self.get_all_users()
-            for uid, uname in users:
-                self.dj.process_daily_moods(uid)
-
-            self.last_mood_gen_date = date.today()
-            logger.info("✅ Daily Moods abgeschlossen.")
+            self.start_daily_moods([uid for uid, _ in users], done="✅ Daily Moods abgeschlossen.")
 
-    def check_ratings(self, user_id, user_name):
+    def check_ratings(self):
         try:
-            with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                lock_date = (datetime.now() - timedelta(days=LOCK_DAYS)).isoformat()
-                cursor = conn.cursor()
-                for plays, cur, new in RATING_STAGES:
-                    cond = "(ann.rating IS NULL OR ann.rating = 0)" if cur == 0 else f"ann.rating = {cur}"
-                    query = f"""
-                        SELECT ann.item_id, mf.title FROM annotation ann
-                        JOIN media_file mf ON ann.item_id = mf.id
-                        WHERE ann.user_id = ? AND ann.play_count >= ? AND {cond}
-                        AND (ann.rated_at IS NULL OR ann.rated_at < ?)
-                    """
-                    cursor.execute(query, (user_id, plays, lock_date))
-                    for rid, title in cursor.fetchall():
-                        logger.info(f"🚀 {user_name}: '{title}' -> {new} Sterne")
-                        cursor.execute("UPDATE annotation SET rating = ? WHERE user_id = ? AND item_id = ?", (new, user_id, rid))
-                conn.commit()
+            names = dict(self.users)
+            for uid, rid, title, old, new in self.ratings.promote():
+                logger.info(f"🚀 {names.get(uid, uid)}: '{title}' -> {new} Sterne")
         except Exception as e: logger.error(f"Rating-Fehler: {e}")
 
-    def is_in_cooldown(self, pl_id):
-        if pl_id not in self.cooldowns: return False
-        return (time.time() - self.cooldowns[pl_id]) < (COOLDOWN_MINUTES * 60)
+    def _run_mix_jobs(self, jobs):
+        with operation("mix_jobs"):
+            return self.dj.generate_mixes([(j["user_id"], j["seed_id"], j["name"], j["refill_id"]) for j in jobs])
 
     def check_playlists(self, user_id, user_name):
         try:
             queue = []
-            with sqlite3.connect(DB_PATH, timeout=10) as conn:
+            with self.db.reader("check_playlists") as conn:
                 favs = conn.execute("""
                     SELECT mf.id, mf.title, mf.artist FROM annotation ann
                     JOIN media_file mf ON ann.item_id = mf.id
                     WHERE ann.user_id = ? AND ann.starred = 1
                 """, (user_id,)).fetchall()
-
-                for fid, title, artist in favs:
-                    name = f"KI-Mix: {title} - {artist}"
-                    row = conn.execute("SELECT id FROM playlist WHERE owner_id = ? AND name = ?", (user_id, name)).fetchone()
-
-                    if not row:
-                        queue.append((fid, name, None))
-                    else:
-                        pl_id = row[0]
-                        if self.is_in_cooldown(pl_id): continue
-
-                        cnt = conn.execute("SELECT COUNT(*) FROM playlist_tracks WHERE playlist_id = ?", (pl_id,)).fetchone()[0]
-                        bad_songs = conn.execute("""
-                            SELECT COUNT(*) FROM playlist_tracks pt
-                            LEFT JOIN annotation ann ON pt.media_file_id = ann.item_id AND ann.user_id = ?
-                            WHERE pt.playlist_id = ?
-                            AND (
-                                ann.rating BETWEEN 1 AND 2
-                                OR pt.media_file_id IN (
-                                    SELECT media_file_id FROM playlist_tracks pt2
-                                    JOIN playlist p ON pt2.playlist_id = p.id
-                                    WHERE p.name = 'KI-Blacklist' AND p.owner_id = ?
-                                )
-                            )
-                        """, (user_id, pl_id, user_id)).fetchone()[0]
-
-                        if cnt < 30 or bad_songs > 0:
-                            queue.append((fid, name, pl_id))
-                            self.cooldowns[pl_id] = time.time()
+                if not favs:
+                    return
+
+                # Alle KI-Mixe des Users mit ihren Tracks in zwei Abfragen statt zwei pro Favorit
+                mix_ids = dict(conn.execute(
+                    "SELECT name, id FROM playlist WHERE owner_id = ? AND name LIKE 'KI-Mix: %'", (user_id,)
+                ).fetchall())
+                tracks = defaultdict(list)
+                for pl_id, tid in conn.execute("""
+                    SELECT pt.playlist_id, pt.media_file_id FROM playlist_tracks pt
+                    JOIN playlist p ON pt.playlist_id = p.id
+                    WHERE p.owner_id = ? AND p.name LIKE 'KI-Mix: %'
+                """, (user_id,)).fetchall():
+                    tracks[pl_id].append(str(tid))
+
+            # Blacklist/Bewertungen aus dem Cache statt Subquery pro Favorit
+            excluded = self.exclusions.excluded(user_id)
+            for fid, title, artist in favs:
+                name = f"KI-Mix: {title} - {artist}"
+                pl_id = mix_ids.get(name)
+
+                if not pl_id:
+                    queue.append((fid, name, None))
+                else:
+                    cnt = len(tracks[pl_id])
+                    bad_songs = sum(1 for tid in tracks[pl_id] if tid in excluded)
+
+                    if cnt < PLAYLIST_LIMIT or bad_songs > 0:
+                        queue.append((fid, name, pl_id))
 
             if queue:
+                # Nur einreihen: gebaut wird im Hintergrund (neue Herzen zuerst, doppelte Jobs zusammengefasst)
                 self.ensure_dj_initialized()
-                for fid, name, plid in queue:
-                    if fid in self.dj.library:
-                        self.dj.generate_mix(user_id, fid, name, refill_id=plid)
+                added = sum(self.mixes.submit(user_id, fid, name, refill_id=plid)
+                            for fid, name, plid in queue if fid in self.dj.library)
+                if added:
+                    logger.info(f"🎛️ {user_name}: {added} Mix-Jobs eingereiht ({self.mixes.pending()} offen).")
         except Exception as e: logger.error(f"Playlist-Fehler: {e}")
 
     def run(self):
@@ -167,13 +194,35 @@ class PlaylistMonitor:
         self.check_startup_missing_playlists()
 
         while self.running:
+            if self.dj:
+                self.dj.apply_move_journal()
             self.check_daily_schedule()
-            for uid, uname in self.get_all_users():
-                self.check_ratings(uid, uname)
-                self.check_playlists(uid, uname)
+
+            # Nur die Prüfungen laufen lassen, deren Eingaben sich geändert haben
+            changed = self.changes.poll()
+            if self.dj:
+                # Neue/geänderte/gelöschte Songs sofort übernehmen (volle Indizierung nur noch täglich)
+                self.dj.sync_library(media_changed="library" in changed)
+            if "users" in changed or not self.users:
+                self.users = self.get_all_users()
+            if "plays" in changed:
+                self.check_ratings()
+            if changed & {"stars", "ratings", "playlists"}:
+                for uid, uname in self.users:
+                    self.check_playlists(uid, uname)
+
+            # Wohin die SQL-Zeit geht: langsame Zyklen loggen, Zähler für Prometheus exportieren
+            STATS.end_cycle(logger)
+            STATS.write_textfile()
+            if self.dj:
+                self.dj.save_warm_state_if_due()
             for _ in range(CHECK_INTERVAL):
                 if not self.running: break
                 time.sleep(1)
 
+        # Zustand für den nächsten Start sichern (läuft noch ein Abgleich, nicht ewig darauf warten)
+        if self.dj and self.dj.save_warm_state(timeout=5):
+            logger.info("♨️ DJ-Zustand für den Warmstart gesichert.")
+
 if __name__ == "__main__":
     PlaylistMonitor().run()
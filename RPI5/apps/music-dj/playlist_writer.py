@@ -0,0 +1,144 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import uuid
+import logging
+from collections import Counter
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+logger = logging.getLogger("DJ_Writer")
+
+# --------------------------------------------------
+# Playlist-Writer (nur Differenzen, eine Transaktion pro User)
+# --------------------------------------------------
+
+class PlaylistWriter:
+    """
+    Schreibt Playlists in die Navidrome-DB, indem nur entfernte Tracks gelöscht und neue
+    eingefügt werden. Unveränderte Playlists bleiben komplett unberührt (auch updated_at),
+    damit Clients sie nicht neu laden. Alle Playlists eines Aufrufs landen gemeinsam in einer
+    Transaktion der Schreib-Queue.
+    """
+
+    def __init__(self, db, queue):
+        self.db = db                        # db_access.ConnectionManager (Lesen)
+        self.queue = queue                  # write_queue.WriteQueue (Schreiben)
+
+    def _placeholders(self, values):
+        return ",".join("?" * len(values))
+
+    def _find_ids(self, conn, user_id, names):
+        if not names:
+            return {}
+        rows = conn.execute(
+            f"SELECT name, id FROM playlist WHERE owner_id = ? AND name IN ({self._placeholders(names)})",
+            [user_id] + list(names)
+        ).fetchall()
+        return {name: pl_id for name, pl_id in rows}
+
+    def _tracks(self, conn, pl_ids):
+        """{playlist_id: [(rowid, media_file_id), ...]}"""
+        result = {pl_id: [] for pl_id in pl_ids}
+        if not pl_ids:
+            return result
+        rows = conn.execute(
+            f"SELECT playlist_id, rowid, media_file_id FROM playlist_tracks "
+            f"WHERE playlist_id IN ({self._placeholders(pl_ids)}) ORDER BY rowid",
+            list(pl_ids)
+        ).fetchall()
+        for pl_id, rowid, mid in rows:
+            result[pl_id].append((rowid, str(mid)))
+        return result
+
+    def read(self, user_id, names):
+        """{name: (playlist_id, [media_file_id])} für die vorhandenen Playlists (eine Verbindung)."""
+        try:
+            with self.db.reader("playlist_read") as conn:
+                ids = self._find_ids(conn, user_id, list(names))
+                tracks = self._tracks(conn, list(ids.values()))
+                return {name: (pl_id, [mid for _, mid in tracks[pl_id]]) for name, pl_id in ids.items()}
+        except Exception as e:
+            logger.error(f"Playlist-Lesefehler: {e}")
+            return {}
+
+    def write(self, user_id, playlists, playlist_ids=None):
+        """
+        playlists: {name: [song_id, ...]}; playlist_ids: {name: playlist_id} für bekannte Playlists.
+        Läuft über die Schreib-Queue (ein neuerer Auftrag für dieselben Playlists ersetzt einen
+        noch wartenden). Gibt (geschriebene_zeilen, {name: playlist_id}) zurück, bei Fehler (None, {}).
+        """
+        if not playlists:
+            return 0, {}
+        return self.result(self.submit(user_id, playlists, playlist_ids))
+
+    def submit(self, user_id, playlists, playlist_ids=None):
+        """Wie write, wartet aber nicht: Future für result(). Mehrere Aufträge landen so gemeinsam in einem Batch."""
+        key = ("playlists", user_id, tuple(sorted(playlists)))
+        try:
+            return self.queue.submit(lambda conn: self._apply(conn, user_id, playlists, playlist_ids),
+                                     "playlist_write", key=key)
+        except RuntimeError as e:
+            # Queue beim Herunterfahren gestoppt -> wie ein fehlgeschlagener Schreibvorgang
+            future = Future()
+            future.set_exception(e)
+            return future
+
+    def result(self, future):
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error(f"Playlist-Schreibfehler: {e}")
+            return None, {}
+
+    def _apply(self, conn, user_id, playlists, playlist_ids):
+        """Schreibt die Differenzen innerhalb der laufenden Transaktion der Schreib-Queue."""
+        playlist_ids = dict(playlist_ids or {})
+        written = 0
+        unknown = [n for n in playlists if not playlist_ids.get(n)]
+        playlist_ids.update(self._find_ids(conn, user_id, unknown))
+        current = self._tracks(conn, [pl_id for n, pl_id in playlist_ids.items() if n in playlists and pl_id])
+        now = datetime.now(timezone.utc).isoformat()
+
+        for name, song_ids in playlists.items():
+            pl_id = playlist_ids.get(name)
+            if not pl_id:
+                pl_id = str(uuid.uuid4())
+                playlist_ids[name] = pl_id
+                conn.execute("""
+                    INSERT INTO playlist (id, name, owner_id, public, created_at, updated_at)
+                    VALUES (?, ?, ?, 0, ?, ?)
+                """, (pl_id, name, user_id, now, now))
+                written += 1
+            existing = current.get(pl_id, [])
+
+            # Multimengen-Differenz: vorhandene Zeilen behalten, soweit der Song bleibt
+            wanted = Counter(str(s) for s in song_ids)
+            remove = []
+            for rowid, mid in existing:
+                if wanted[mid] > 0:
+                    wanted[mid] -= 1
+                else:
+                    remove.append((rowid,))
+            add = []
+            for sid in song_ids:
+                if wanted[str(sid)] > 0:
+                    wanted[str(sid)] -= 1
+                    add.append((str(uuid.uuid4()), pl_id, sid))
+
+            if not remove and not add and len(existing) == len(song_ids):
+                continue
+            if remove:
+                conn.executemany("DELETE FROM playlist_tracks WHERE rowid = ?", remove)
+            if add:
+                conn.executemany(
+                    "INSERT INTO playlist_tracks (id, playlist_id, media_file_id) VALUES (?, ?, ?)", add
+                )
+            conn.execute(
+                "UPDATE playlist SET song_count = ?, updated_at = ? WHERE id = ?",
+                (len(song_ids), now, pl_id)
+            )
+            written += len(remove) + len(add) + 1
+
+        return written, {n: playlist_ids[n] for n in playlists}
@@ -0,0 +1,94 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import time
+from datetime import datetime, timedelta
+
+FULL_PASS_SECONDS = 86400   # Einmal täglich alles prüfen (Sperrfrist kann ohne neue Plays ablaufen)
+
+# --------------------------------------------------
+# Auto-Rating (eine UPDATE-Anweisung für alle User)
+# --------------------------------------------------
+
+def promotion_rules(stages):
+    """
+    Aus den Stufen (plays, von, nach) alle erreichbaren Sprünge (von, ziel, min_plays) ableiten,
+    höchstes Ziel zuerst. Ein Song landet so direkt auf der Stufe, die die alte Schleife erst
+    nach mehreren Durchläufen erreicht hätte (Fixpunkt).
+    """
+    best = {}
+
+    def walk(start, rating, need):
+        for plays, cur, new in stages:
+            if cur == rating and new > rating:
+                req = max(need, plays)
+                if req < best.get((start, new), float("inf")):
+                    best[(start, new)] = req
+                    walk(start, new, req)
+
+    for start in {cur for _, cur, _ in stages}:
+        walk(start, start, 0)
+    return sorted(((s, t, p) for (s, t), p in best.items()), key=lambda r: (-r[1], r[2]))
+
+class RatingEngine:
+    """
+    Hebt Bewertungen nach Play-Count an. Pro Lauf ein SELECT (für das Log) und ein
+    mengenbasiertes UPDATE in derselben Transaktion (der Schreib-Queue), begrenzt auf
+    Annotationen mit play_date seit dem letzten Wasserstand.
+    """
+
+    def __init__(self, queue, stages, lock_days):
+        self.queue = queue                  # write_queue.WriteQueue
+        self.lock_days = lock_days
+        self.rules = promotion_rules(stages)
+        self.min_plays = min(p for p, _, _ in stages)
+        self.watermark = None
+        self._last_full = 0
+
+    def _target_sql(self):
+        whens = " ".join("WHEN COALESCE(rating, 0) = ? AND play_count >= ? THEN ?" for _ in self.rules)
+        params = [v for start, target, plays in self.rules for v in (start, plays, target)]
+        return f"CASE {whens} END", params
+
+    def promote(self, full=False):
+        """Gibt die angehobenen Songs als Liste (user_id, item_id, title, alt, neu) zurück."""
+        if not self.rules:
+            return []
+        if time.time() - self._last_full >= FULL_PASS_SECONDS:
+            full = True
+
+        target, target_params = self._target_sql()
+        lock_date = (datetime.now() - timedelta(days=self.lock_days)).isoformat()
+        where = """
+            play_count >= ? AND (rated_at IS NULL OR rated_at < ?)
+            AND EXISTS (SELECT 1 FROM media_file mf WHERE mf.id = annotation.item_id)
+        """
+        where_params = [self.min_plays, lock_date]
+        if not full and self.watermark is not None:
+            where += " AND play_date >= ?"
+            where_params.append(self.watermark)
+
+        def apply(conn):
+            new_watermark = conn.execute("SELECT MAX(play_date) FROM annotation").fetchone()[0]
+            promoted = conn.execute(f"""
+                SELECT user_id, item_id, title, old, target FROM (
+                    SELECT annotation.user_id, annotation.item_id,
+                           (SELECT mf.title FROM media_file mf WHERE mf.id = annotation.item_id) AS title,
+                           COALESCE(rating, 0) AS old, {target} AS target
+                    FROM annotation WHERE {where}
+                ) WHERE target IS NOT NULL
+            """, target_params + where_params).fetchall()
+            if promoted:
+                conn.execute(f"""
+                    UPDATE annotation SET rating = {target}
+                    WHERE {where} AND {target} IS NOT NULL
+                """, target_params + where_params + target_params)
+            return new_watermark, promoted
+
+        new_watermark, promoted = self.queue.run(apply, "ratings")
+
+        self.watermark = new_watermark
+        if full:
+            self._last_full = time.time()
+        return promoted
@@ -0,0 +1,71 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import json
+import time
+import logging
+
+from dj_index import INDEX_DIR
+
+WARM_VERSION = 2
+WARM_SAVE_SECONDS = int(os.getenv("ND_WARM_SAVE_SECONDS", "900"))     # periodisch sichern (nur wenn geändert)
+
+logger = logging.getLogger("DJ_WarmState")
+
+# --------------------------------------------------
+# Warmstart: Zustand des DJs neben dem Embedding-Index sichern
+# --------------------------------------------------
+
+class WarmState:
+    """
+    Sichert, was der DJ neben Embedding-, ANN- und Codec-Index im Speicher hält (Metadaten,
+    Dedup-Schlüssel, Pfade, Fingerprint-Gruppen, Wasserstände des letzten Abgleichs).
+    Die Datei gilt nur zusammen mit genau dem Index, zu dem sie geschrieben wurde
+    (Generation des EmbeddingIndex); passt er nicht, wird kalt gestartet.
+    """
+
+    def __init__(self, path=None, save_seconds=WARM_SAVE_SECONDS):
+        self.path = path or os.path.join(INDEX_DIR, "warm.json")
+        self.save_seconds = save_seconds
+        self.saved_at = 0.0
+
+    def due(self):
+        return time.time() - self.saved_at >= self.save_seconds
+
+    def load(self, emb_index):
+        """Gespeicherter Zustand als dict oder None (fehlt, veraltet oder zu anderem Index)."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Warmstart-Ladefehler: {e}")
+            return None
+        if state.get("version") != WARM_VERSION or state.get("moods") != emb_index.mood_names:
+            logger.info("Warmstart-Format oder Mood-Liste geändert -> Kaltstart.")
+            return None
+        if not len(emb_index) or state.get("generation") != emb_index.generation:
+            logger.info("Warmstart-Zustand passt nicht zum gespeicherten Index -> Kaltstart.")
+            return None
+        state["metadata"] = {sid: tuple(meta) for sid, meta in state["metadata"].items()}
+        state["fp_stat"] = tuple(state["fp_stat"]) if state.get("fp_stat") else None
+        return state
+
+    def save(self, emb_index, **state):
+        """Schreibt atomar (tmp + rename); der Index muss vorher gespeichert sein."""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            state.update({"version": WARM_VERSION, "moods": emb_index.mood_names,
+                          "generation": emb_index.generation, "saved_at": time.time()})
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+            self.saved_at = state["saved_at"]
+            return True
+        except Exception as e:
+            logger.error(f"Warmstart-Speicherfehler: {e}")
+            return False
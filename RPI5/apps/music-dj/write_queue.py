@@ -0,0 +1,211 @@
+# STARAIN - Stefan Aretz AI Navidrome Architect
+# Copyright (C) 2026 Stefan Aretz
+# Licensed under the GNU General Public License v3.0
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from db_access import STATS, LOCK_ERRORS
+
+WRITE_BATCH = int(os.getenv("ND_WRITE_BATCH", "16"))                 # Absichten pro Transaktion
+WRITE_BATCH_MS = float(os.getenv("ND_WRITE_BATCH_MS", "50"))         # ... bzw. bis die Transaktion so lange läuft
+BUSY_BACKOFF_BASE = 0.05
+BUSY_BACKOFF_MAX = 5.0
+BUSY_RETRIES = 8
+
+logger = logging.getLogger("DJ_WriteQueue")
+
+# --------------------------------------------------
+# Ein Schreib-Thread für alle Änderungen an der Navidrome-DB
+# --------------------------------------------------
+
+class WriteIntent:
+    """Eine Schreibabsicht: apply(conn) läuft innerhalb der Batch-Transaktion und liefert das Ergebnis."""
+
+    __slots__ = ("apply", "label", "key", "futures", "queued_at", "result", "error")
+
+    def __init__(self, apply, label, key=None):
+        self.apply = apply
+        self.label = label
+        self.key = key
+        self.futures = [Future()]
+        self.queued_at = time.perf_counter()
+        self.result = None
+        self.error = None
+
+class WriteQueue:
+    """
+    Alle Schreibzugriffe (Ratings, Playlists anlegen/ersetzen/abgleichen) laufen über einen
+    Thread und damit über die eine Schreib-Verbindung. Wartende Absichten werden zu kurzen
+    Transaktionen zusammengefasst (BEGIN IMMEDIATE, je Absicht ein SAVEPOINT - ein Fehler
+    betrifft nur die eigene Absicht). Absichten mit gleichem key ersetzen eine noch nicht
+    geschriebene ältere (beide Aufrufer erhalten das Ergebnis der neueren). Ist die DB
+    gesperrt (SQLITE_BUSY nach busy_timeout), wird mit exponentiellem Backoff wiederholt.
+    """
+
+    def __init__(self, db, batch_size=WRITE_BATCH, batch_ms=WRITE_BATCH_MS):
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self.batch_ms = batch_ms
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()
+        self._seq = 0
+        self._stopped = False
+        self.commits = 0
+        self.intents = 0
+        self.busy_retries = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self.total_commit_ms = 0.0
+        self.last_wait_ms = 0.0
+        self._thread = threading.Thread(target=self._run, name="nd-writer", daemon=True)
+        self._thread.start()
+        STATS.register_gauge("write_queue_depth", "Wartende Schreibabsichten", self.depth)
+        STATS.register_gauge("write_commit_ms_last", "Dauer der letzten Schreib-Transaktion (ms)",
+                             lambda: self.last_commit_ms)
+        STATS.register_gauge("write_commit_ms_max", "Längste Schreib-Transaktion (ms)", lambda: self.max_commit_ms)
+        STATS.register_counter("write_commits", "Geschriebene Transaktionen", lambda: self.commits)
+        STATS.register_counter("write_busy_retries", "Wiederholungen wegen SQLITE_BUSY", lambda: self.busy_retries)
+
+    # --------------------------------------------------
+    # API
+    # --------------------------------------------------
+
+    def submit(self, apply, label, key=None):
+        """Reiht apply(conn) ein und gibt ein Future auf dessen Ergebnis zurück."""
+        intent = WriteIntent(apply, label, key)
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Schreib-Queue ist gestoppt")
+            if key is not None and key in self._pending:
+                # Ältere, noch nicht geschriebene Absicht wird ersetzt, ihr Aufrufer wartet mit
+                older = self._pending.pop(key)
+                intent.futures = older.futures + intent.futures
+                intent.queued_at = older.queued_at
+            self._seq += 1
+            self._pending[key if key is not None else ("_", self._seq)] = intent
+            self._cond.notify()
+        return intent.futures[-1]
+
+    def run(self, apply, label, key=None, timeout=None):
+        """submit + auf das Ergebnis warten (Fehler der Absicht werden weitergereicht)."""
+        return self.submit(apply, label, key).result(timeout)
+
+    def depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._pending)
+        return {"depth": depth, "commits": self.commits, "intents": self.intents,
+                "busy_retries": self.busy_retries, "last_commit_ms": self.last_commit_ms,
+                "max_commit_ms": self.max_commit_ms, "last_wait_ms": self.last_wait_ms,
+                "avg_commit_ms": self.total_commit_ms / self.commits if self.commits else 0.0}
+
+    def stop(self, timeout=10):
+        """Noch wartende Absichten schreiben, dann den Thread beenden."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    # --------------------------------------------------
+    # Schreib-Thread
+    # --------------------------------------------------
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                batch.append(self._pending.popitem(last=False)[1])
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        attempt = 0
+        while batch:
+            try:
+                done, rest = self._transaction(batch)
+            except sqlite3.OperationalError as e:
+                if not any(word in str(e).lower() for word in LOCK_ERRORS) or attempt >= BUSY_RETRIES:
+                    logger.error(f"Schreib-Transaktion fehlgeschlagen ({len(batch)} Absichten): {e}")
+                    self._finish(batch, error=e)
+                    return
+                delay = min(BUSY_BACKOFF_MAX, BUSY_BACKOFF_BASE * 2 ** attempt)
+                attempt += 1
+                self.busy_retries += 1
+                logger.info(f"⏳ Navidrome-DB gesperrt, neuer Versuch in {delay:.2f}s ({len(batch)} Absichten).")
+                time.sleep(delay)
+                continue
+            except Exception as e:
+                logger.error(f"Schreib-Transaktion fehlgeschlagen ({len(batch)} Absichten): {e}")
+                self._finish(batch, error=e)
+                return
+            self._finish(done)
+            # Zeitbudget überschritten: Rest in einer eigenen, kurzen Transaktion
+            batch, attempt = rest, 0
+
+    def _transaction(self, batch):
+        """Schreibt Absichten, bis Batch oder Zeitbudget erschöpft sind. Gibt (erledigt, rest) zurück."""
+        done = []
+        with self.db.writer("write_queue") as conn:
+            t0 = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            for intent in batch:
+                if done and (time.perf_counter() - t0) * 1000 >= self.batch_ms:
+                    break
+                conn.execute("SAVEPOINT intent")
+                conn.label = intent.label
+                try:
+                    intent.result = intent.apply(conn)
+                    intent.error = None
+                    conn.execute("RELEASE SAVEPOINT intent")
+                except sqlite3.OperationalError as e:
+                    if any(word in str(e).lower() for word in LOCK_ERRORS):
+                        raise  # ganze Transaktion zurückrollen und wiederholen
+                    self._undo(conn, intent, e)
+                except Exception as e:
+                    self._undo(conn, intent, e)
+                done.append(intent)
+            conn.execute("COMMIT")
+            elapsed = (time.perf_counter() - t0) * 1000
+
+        self.commits += 1
+        self.last_commit_ms = elapsed
+        self.max_commit_ms = max(self.max_commit_ms, elapsed)
+        self.total_commit_ms += elapsed
+        return done, batch[len(done):]
+
+    @staticmethod
+    def _undo(conn, intent, error):
+        conn.execute("ROLLBACK TO SAVEPOINT intent")
+        conn.execute("RELEASE SAVEPOINT intent")
+        intent.result = None
+        intent.error = error
+        logger.error(f"Schreibabsicht '{intent.label}' verworfen: {error}")
+
+    def _finish(self, intents, error=None):
+        now = time.perf_counter()
+        for intent in intents:
+            self.intents += 1
+            self.last_wait_ms = (now - intent.queued_at) * 1000
+            failure = error or intent.error
+            for future in intent.futures:
+                if failure is not None:
+                    future.set_exception(failure)
+                else:
+                    future.set_result(intent.result)